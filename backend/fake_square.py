@@ -0,0 +1,490 @@
+"""Local stand-in for Square, for exercising the app without a Square account.
+
+Fake Payments/Refunds API, with configurable latency, error rate and decline
+codes. It runs in-process (PAYMENT_GATEWAY=fake) or as a localhost server the
+real SDK is pointed at (PAYMENT_GATEWAY=http://localhost:8099):
+
+    python fake_square.py serve --port 8099 --latency-ms 150 --decline-rate 0.05
+
+Behaviour is read from FAKE_SQUARE_* environment variables (see FakeConfig),
+overridable on the command line. The sandbox test nonces work as in Square:
+cnon:card-nonce-declined, cnon:card-nonce-rejected-cvv, ...
+
+Checkout benchmark: drives /api/payments/create and follows each payment
+until it is final, then reports throughput and latency percentiles.
+
+    python fake_square.py bench --api http://localhost:8001/api --cruise-id <id> \
+        --requests 500 --concurrency 50
+
+Webhook sender: builds Square-shaped notifications, signs them the way Square
+does and posts them to /api/webhooks/square, optionally as a concurrent burst
+with redelivered duplicates.
+
+    python fake_square.py webhook --url http://localhost:8001/api/webhooks/square \
+        --key "$SQUARE_WEBHOOK_SIGNATURE_KEY" --payment-id sq_123 --type refund.updated
+
+The signature key and URL must match SQUARE_WEBHOOK_SIGNATURE_KEY and
+SQUARE_WEBHOOK_URL on the server. Only the standard library is used, except
+for the in-process client which raises the SDK's ApiError.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+# Nonces Square's sandbox declines, and the error code it answers with
+SANDBOX_DECLINES = {
+    "cnon:card-nonce-declined": "GENERIC_DECLINE",
+    "cnon:card-nonce-rejected-cvv": "CVV_FAILURE",
+    "cnon:card-nonce-rejected-postalcode": "ADDRESS_VERIFICATION_FAILURE",
+    "cnon:card-nonce-rejected-expiration": "INVALID_EXPIRATION",
+    "cnon:card-nonce-insufficient-funds": "INSUFFICIENT_FUNDS",
+}
+
+@dataclass
+class FakeConfig:
+    latency_ms: float = 120.0
+    jitter_ms: float = 80.0
+    error_rate: float = 0.0  # Share of calls answered with a 500
+    decline_rate: float = 0.0  # Share of charges declined with one of decline_codes
+    decline_codes: List[str] = field(default_factory=lambda: ["GENERIC_DECLINE", "INSUFFICIENT_FUNDS", "CVV_FAILURE"])
+    page_size: int = 100
+
+    @classmethod
+    def from_env(cls) -> "FakeConfig":
+        config = cls()
+        config.latency_ms = float(os.environ.get("FAKE_SQUARE_LATENCY_MS", config.latency_ms))
+        config.jitter_ms = float(os.environ.get("FAKE_SQUARE_JITTER_MS", config.jitter_ms))
+        config.error_rate = float(os.environ.get("FAKE_SQUARE_ERROR_RATE", config.error_rate))
+        config.decline_rate = float(os.environ.get("FAKE_SQUARE_DECLINE_RATE", config.decline_rate))
+        codes = os.environ.get("FAKE_SQUARE_DECLINE_CODES")
+        if codes:
+            config.decline_codes = [code.strip() for code in codes.split(",") if code.strip()]
+        return config
+
+def square_error(status: int, category: str, code: str, detail: str) -> Tuple[int, dict]:
+    return status, {"errors": [{"category": category, "code": code, "detail": detail}]}
+
+class FakeSquare:
+    """In-memory Payments and Refunds API speaking Square's JSON.
+
+    Idempotency keys are honoured like Square does: the same key returns the
+    first answer. Thread-safe, since the app calls it from a thread pool.
+    """
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.payments = {}
+        self.replies = {}
+
+    def _delay(self):
+        latency = self.config.latency_ms + random.uniform(-1, 1) * self.config.jitter_ms
+        time.sleep(max(0.0, latency) / 1000)
+
+    def _idempotent(self, key: Optional[str], handler) -> Tuple[int, dict]:
+        self._delay()
+        if key:
+            with self.lock:
+                if key in self.replies:
+                    return self.replies[key]
+        if random.random() < self.config.error_rate:
+            # Not remembered: a retry with the same key may succeed
+            return square_error(500, "API_ERROR", "INTERNAL_SERVER_ERROR", "Fake outage")
+        reply = handler()
+        if key:
+            with self.lock:
+                reply = self.replies.setdefault(key, reply)
+        return reply
+
+    def create_payment(self, body: dict) -> Tuple[int, dict]:
+        def charge():
+            source_id = body.get("source_id", "")
+            decline = SANDBOX_DECLINES.get(source_id)
+            if decline is None and self.config.decline_codes and random.random() < self.config.decline_rate:
+                decline = random.choice(self.config.decline_codes)
+            if decline:
+                return square_error(402, "PAYMENT_METHOD_ERROR", decline, "Card declined")
+            now = datetime.now(timezone.utc).isoformat()
+            payment_id = uuid.uuid4().hex[:22].upper()
+            payment = {
+                "id": payment_id,
+                "status": "COMPLETED",
+                "amount_money": body.get("amount_money"),
+                "refunded_money": None,
+                "location_id": body.get("location_id"),
+                "reference_id": body.get("reference_id"),
+                "note": body.get("note"),
+                "buyer_email_address": body.get("buyer_email_address"),
+                "receipt_url": f"https://squareup.com/receipt/preview/{payment_id}",
+                "created_at": now,
+                "updated_at": now,
+            }
+            with self.lock:
+                self.payments[payment_id] = payment
+            return 200, {"payment": payment}
+        return self._idempotent(body.get("idempotency_key"), charge)
+
+    def refund_payment(self, body: dict) -> Tuple[int, dict]:
+        def refund():
+            amount = (body.get("amount_money") or {}).get("amount", 0)
+            with self.lock:
+                payment = self.payments.get(body.get("payment_id"))
+                if payment is None:
+                    return square_error(404, "INVALID_REQUEST_ERROR", "NOT_FOUND", "Payment not found")
+                refunded = (payment["refunded_money"] or {}).get("amount", 0)
+                if refunded + amount > payment["amount_money"]["amount"]:
+                    return square_error(400, "INVALID_REQUEST_ERROR", "AMOUNT_TOO_HIGH", "Refund exceeds payment")
+                payment["refunded_money"] = {"amount": refunded + amount, "currency": payment["amount_money"]["currency"]}
+            return 200, {"refund": {
+                "id": uuid.uuid4().hex[:22].upper(),
+                "payment_id": payment["id"],
+                "status": "COMPLETED",
+                "amount_money": body.get("amount_money"),
+                "reason": body.get("reason"),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }}
+        return self._idempotent(body.get("idempotency_key"), refund)
+
+    def list_payments(self, params: dict) -> Tuple[int, dict]:
+        self._delay()
+        begin, end = params.get("begin_time"), params.get("end_time")
+        limit = min(int(params.get("limit") or self.config.page_size), self.config.page_size)
+        offset = int(params.get("cursor") or 0)
+        with self.lock:
+            matching = sorted(
+                (p for p in self.payments.values()
+                 if (not begin or p["created_at"] >= _utc(begin)) and (not end or p["created_at"] < _utc(end))),
+                key=lambda p: p["created_at"]
+            )
+        page = matching[offset:offset + limit]
+        reply = {"payments": page}
+        if offset + limit < len(matching):
+            reply["cursor"] = str(offset + limit)
+        return 200, reply
+
+def _utc(timestamp: str) -> str:
+    """RFC 3339 timestamp in the same form as created_at, for comparisons"""
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).astimezone(timezone.utc).isoformat()
+
+# ============= IN-PROCESS CLIENT =============
+
+# PAYMENT_GATEWAY=fake
+
+class _Obj:
+    """Attribute view over Square JSON, like the SDK's response models"""
+
+    def __init__(self, data: dict):
+        for key, value in data.items():
+            setattr(self, key, _wrap(value))
+
+    def __getattr__(self, name):
+        return None
+
+def _wrap(value):
+    if isinstance(value, dict):
+        return _Obj(value)
+    if isinstance(value, list):
+        return [_wrap(item) for item in value]
+    return value
+
+def _unwrap(reply: Tuple[int, dict]):
+    status, body = reply
+    if status >= 400:
+        # Raised as the SDK would, so the app's error handling is exercised
+        from square.core.api_error import ApiError
+        raise ApiError(status_code=status, body=body)
+    return _Obj(body)
+
+class _Pager:
+    def __init__(self, fake: FakeSquare, params: dict):
+        self.fake = fake
+        self.params = params
+
+    def iter_pages(self):
+        cursor = None
+        while True:
+            page = _unwrap(self.fake.list_payments({**self.params, "cursor": cursor}))
+            page.items = page.payments or []
+            yield page
+            cursor = page.cursor
+            if not cursor:
+                return
+
+class _Payments:
+    def __init__(self, fake: FakeSquare):
+        self.fake = fake
+
+    def create(self, **kwargs):
+        return _unwrap(self.fake.create_payment(kwargs))
+
+    def list(self, **kwargs):
+        return _Pager(self.fake, kwargs)
+
+class _Refunds:
+    def __init__(self, fake: FakeSquare):
+        self.fake = fake
+
+    def refund_payment(self, **kwargs):
+        return _unwrap(self.fake.refund_payment(kwargs))
+
+class FakeSquareClient:
+    """Drop-in for square.Square covering the calls the app makes"""
+
+    def __init__(self, fake: FakeSquare):
+        self.payments = _Payments(fake)
+        self.refunds = _Refunds(fake)
+
+    @classmethod
+    def from_env(cls) -> "FakeSquareClient":
+        return cls(FakeSquare(FakeConfig.from_env()))
+
+# ============= LOCALHOST SERVER =============
+
+# PAYMENT_GATEWAY=http://localhost:PORT
+
+def make_handler(fake: FakeSquare):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, reply: Tuple[int, dict]):
+            status, body = reply
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_POST(self):
+            path = urllib.parse.urlparse(self.path).path.rstrip("/")
+            if path == "/v2/payments":
+                self._reply(fake.create_payment(self._body()))
+            elif path == "/v2/refunds":
+                self._reply(fake.refund_payment(self._body()))
+            else:
+                self._reply(square_error(404, "INVALID_REQUEST_ERROR", "NOT_FOUND", "Unknown endpoint"))
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path.rstrip("/") == "/v2/payments":
+                params = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+                self._reply(fake.list_payments(params))
+            else:
+                self._reply(square_error(404, "INVALID_REQUEST_ERROR", "NOT_FOUND", "Unknown endpoint"))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def serve(port: int, config: FakeConfig):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(FakeSquare(config)))
+    print(f"Fake Square listening on http://127.0.0.1:{port} ({config})")
+    server.serve_forever()
+
+# ============= CHECKOUT BENCHMARK =============
+
+def _request(method: str, url: str, body: dict = None, headers: dict = None) -> Tuple[int, dict]:
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json", **(headers or {})})
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, json.loads(response.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+def checkout(api: str, booking: dict, amount: int, nonce: str) -> Tuple[str, float]:
+    """One customer checkout, from submit to final status; returns (outcome, seconds)"""
+    started = time.perf_counter()
+    status, reply = _request("POST", f"{api}/payments/create", {
+        **booking, "source_id": nonce, "amount": amount, "currency": "EUR",
+    }, {"Idempotency-Key": str(uuid.uuid4())})
+    if status != 202:
+        return f"http_{status}", time.perf_counter() - started
+    while True:
+        time.sleep(0.05)
+        status, payment = _request("GET", f"{api}/payments/{reply['payment_id']}")
+        if status == 200 and payment.get("status") != "PENDING":
+            return payment["status"].lower(), time.perf_counter() - started
+
+def bench(api: str, cruise_id: str, selected_date: Optional[str], requests: int, concurrency: int,
+          nonce: str = "cnon:card-nonce-ok") -> dict:
+    booking = {
+        "cruise_id": cruise_id,
+        "cruise_name": "Benchmark",
+        "customer_email": "bench@example.com",
+        "customer_name": "Benchmark",
+        "passengers": 1,
+        "selected_date": selected_date,
+        "booking_type": "cabin",
+    }
+    status, quote = _request("POST", f"{api}/quotes", {
+        "cruise_id": cruise_id, "passengers": 1, "booking_type": "cabin", "selected_date": selected_date,
+    })
+    if status != 200:
+        raise SystemExit(f"Quote failed ({status}): {quote}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: checkout(api, booking, quote["amount"], nonce), range(requests)))
+    elapsed = time.perf_counter() - started
+
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    latencies = sorted(seconds for _, seconds in results)
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000)
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "checkouts_per_second": round(requests / elapsed, 1),
+        "outcomes": outcomes,
+        "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99), "max": percentile(1.0)},
+    }
+
+def sign(signature_key: str, notification_url: str, body: bytes) -> str:
+    digest = hmac.new(signature_key.encode(), notification_url.encode() + body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+def make_event(event_type: str, payment_id: str, amount: int = 10000, status: str = "COMPLETED",
+               reference_id: str = None) -> dict:
+    """A notification shaped like the ones Square sends for `event_type`"""
+    now = datetime.now(timezone.utc).isoformat()
+    if event_type.startswith("payment."):
+        obj = {"payment": {
+            "id": payment_id,
+            "status": status,
+            "amount_money": {"amount": amount, "currency": "EUR"},
+            "reference_id": reference_id,
+            "receipt_url": f"https://squareup.com/receipt/preview/{payment_id}",
+            "updated_at": now,
+        }}
+    elif event_type.startswith("refund."):
+        obj = {"refund": {
+            "id": f"refund_{uuid.uuid4().hex[:16]}",
+            "payment_id": payment_id,
+            "status": status,
+            "amount_money": {"amount": amount, "currency": "EUR"},
+            "reason": "Refund from the Square dashboard",
+            "updated_at": now,
+        }}
+    elif event_type.startswith("dispute."):
+        obj = {"dispute": {
+            "id": f"dispute_{uuid.uuid4().hex[:16]}",
+            "state": status,
+            "reason": "NOT_AS_DESCRIBED",
+            "amount_money": {"amount": amount, "currency": "EUR"},
+            "disputed_payment": {"payment_id": payment_id},
+        }}
+    else:
+        raise ValueError(f"Unsupported event type: {event_type}")
+    return {
+        "merchant_id": "FAKE_MERCHANT",
+        "type": event_type,
+        "event_id": str(uuid.uuid4()),
+        "created_at": now,
+        "data": {"type": event_type.split(".")[0], "id": payment_id, "object": obj},
+    }
+
+def send_event(url: str, signature_key: str, event: dict, notification_url: str = None) -> int:
+    """POST one signed event; returns the HTTP status"""
+    body = json.dumps(event).encode()
+    request = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        "x-square-hmacsha256-signature": sign(signature_key, notification_url or url, body),
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def send_burst(url: str, signature_key: str, events: list, concurrency: int = 20,
+               duplicates: int = 0, notification_url: str = None) -> dict:
+    """Send events concurrently, redelivering the first `duplicates` of them"""
+    deliveries = events + events[:duplicates]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        statuses = list(pool.map(lambda e: send_event(url, signature_key, e, notification_url), deliveries))
+    elapsed = time.perf_counter() - started
+    counts = {}
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    return {"sent": len(deliveries), "statuses": counts, "seconds": round(elapsed, 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    server = commands.add_parser("serve", help="run the fake Square API on localhost")
+    server.add_argument("--port", type=int, default=8099)
+    server.add_argument("--latency-ms", type=float)
+    server.add_argument("--jitter-ms", type=float)
+    server.add_argument("--error-rate", type=float)
+    server.add_argument("--decline-rate", type=float)
+    server.add_argument("--decline-codes", help="comma-separated Square error codes")
+
+    benchmark = commands.add_parser("bench", help="benchmark checkout against a running app")
+    benchmark.add_argument("--api", default="http://localhost:8001/api")
+    benchmark.add_argument("--cruise-id", required=True)
+    benchmark.add_argument("--date", help="departure date range; seats are taken per checkout")
+    benchmark.add_argument("--requests", type=int, default=200)
+    benchmark.add_argument("--concurrency", type=int, default=20)
+    benchmark.add_argument("--nonce", default="cnon:card-nonce-ok")
+
+    webhook = commands.add_parser("webhook", help="send signed webhook events")
+    webhook.add_argument("--url", required=True)
+    webhook.add_argument("--key", required=True, help="webhook signature key")
+    webhook.add_argument("--notification-url", help="URL registered with Square, if not --url")
+    webhook.add_argument("--type", default="payment.updated")
+    webhook.add_argument("--payment-id", required=True)
+    webhook.add_argument("--reference-id", help="our payment record id, for payment events")
+    webhook.add_argument("--status", default="COMPLETED")
+    webhook.add_argument("--amount", type=int, default=10000, help="amount in cents")
+    webhook.add_argument("--count", type=int, default=1, help="number of distinct events")
+    webhook.add_argument("--duplicates", type=int, default=0, help="events to deliver twice")
+    webhook.add_argument("--concurrency", type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        config = FakeConfig.from_env()
+        for name in ("latency_ms", "jitter_ms", "error_rate", "decline_rate"):
+            if getattr(args, name) is not None:
+                setattr(config, name, getattr(args, name))
+        if args.decline_codes:
+            config.decline_codes = [code.strip() for code in args.decline_codes.split(",") if code.strip()]
+        serve(args.port, config)
+    elif args.command == "bench":
+        print(json.dumps(bench(args.api, args.cruise_id, args.date, args.requests, args.concurrency, args.nonce), indent=2))
+    elif args.command == "webhook":
+        events = [
+            make_event(args.type, args.payment_id, args.amount, args.status, args.reference_id)
+            for _ in range(args.count)
+        ]
+        print(json.dumps(send_burst(
+            args.url, args.key, events, args.concurrency, args.duplicates, args.notification_url
+        ), indent=2))
+
+if __name__ == "__main__":
+    main()
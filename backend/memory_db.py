@@ -0,0 +1,1376 @@
+"""In-memory stand-in for MongoDB, for tests and benchmarks without a database.
+
+STORAGE_BACKEND=memory replaces the Motor client in server.py with MemoryClient,
+so the whole API runs on one machine with no external service:
+
+    STORAGE_BACKEND=memory PAYMENT_GATEWAY=fake uvicorn server:app --port 8001
+
+Collections implement the part of Motor's collection interface the app uses:
+find/find_one with sort and projection, inserts, update operators (positional
+$ included) and update pipelines, find_one_and_update/delete, bulk_write,
+count_documents, aggregate ($match, $group, ...), and indexes. Matching,
+comparisons and sorting follow MongoDB's rules and BSON type order. Unique and
+partial indexes raise DuplicateKeyError, TTL indexes expire documents, and
+equality lookups on an indexed field go through a hash index instead of a scan.
+Anything outside that subset raises rather than being ignored: unknown operators
+fail like in MongoDB, and operators, stages and driver options MongoDB has but
+the emulator lacks raise NotImplementedError or TypeError. tests/test_memory_db.py
+runs the same operations here and, with MONGO_URL set, against a real server.
+
+Every operation runs to completion without yielding to the event loop, so a
+single-document write is atomic like in MongoDB. Data lives in the worker
+process: run one worker, since each gunicorn worker would get its own empty
+database. Only the standard library and pymongo (installed with Motor) are used.
+"""
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from functools import cmp_to_key
+from typing import Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+# Absent field, distinct from an explicit null
+MISSING = object()
+
+# How often expired documents are purged from collections with a TTL index
+TTL_PURGE_SECONDS = 1.0
+
+# ============= VALUES =============
+
+def to_bson(value):
+    """Copy a value the way a round trip through BSON would change it:
+    enums become their value, datetimes naive UTC with millisecond precision"""
+    if isinstance(value, dict):
+        return {str(key): to_bson(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_bson(item) for item in value]
+    if isinstance(value, Enum):
+        return to_bson(value.value)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+def copy_value(value):
+    if isinstance(value, dict):
+        return {key: copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    return value
+
+def hashable(value):
+    if isinstance(value, dict):
+        return ("__dict__",) + tuple((key, hashable(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return ("__list__",) + tuple(hashable(item) for item in value)
+    if value is MISSING:
+        return None
+    return value
+
+def type_rank(value) -> int:
+    """Position of the value's type in BSON comparison order"""
+    if value is MISSING or value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+def compare(a, b) -> int:
+    rank_a, rank_b = type_rank(a), type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a == 1:
+        return 0
+    if rank_a == 4:
+        for (key_a, item_a), (key_b, item_b) in zip(a.items(), b.items()):
+            result = compare(key_a, key_b) or compare(item_a, item_b)
+            if result:
+                return result
+        return (len(a) > len(b)) - (len(a) < len(b))
+    if rank_a == 5:
+        for item_a, item_b in zip(a, b):
+            result = compare(item_a, item_b)
+            if result:
+                return result
+        return (len(a) > len(b)) - (len(a) < len(b))
+    try:
+        return (a > b) - (a < b)
+    except TypeError:
+        return 0
+
+def truthy(value) -> bool:
+    """Aggregation truthiness: false, null, missing and 0 are false"""
+    return value is not MISSING and value is not None and value is not False and value != 0
+
+BSON_TYPES = {
+    "double": lambda v: isinstance(v, float),
+    "string": lambda v: isinstance(v, str),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "objectId": lambda v: isinstance(v, ObjectId),
+    "bool": lambda v: isinstance(v, bool),
+    "date": lambda v: isinstance(v, datetime),
+    "null": lambda v: v is None,
+    "int": lambda v: isinstance(v, int) and not isinstance(v, bool) and -2 ** 31 <= v < 2 ** 31,
+    "long": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+}
+
+# ============= PATHS =============
+
+def lookup(value, parts: List[str]) -> list:
+    """Values at a dotted path; arrays along the way fan out as in queries"""
+    if not parts:
+        return [value]
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        return lookup(value[head], rest) if head in value else [MISSING]
+    if isinstance(value, list):
+        found = []
+        if head.isdigit() and int(head) < len(value):
+            found.extend(lookup(value[int(head)], rest))
+        for item in value:
+            if isinstance(item, dict):
+                found.extend(value for value in lookup(item, parts) if value is not MISSING)
+        return found or [MISSING]
+    return [MISSING]
+
+def get_path(value, path: str):
+    """Value at a dotted path for expressions: "$a.b" over an array of
+    documents gives the list of their b"""
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list):
+            value = [item.get(part) for item in value if isinstance(item, dict) and part in item]
+        else:
+            return MISSING
+    return value
+
+def set_path(doc: dict, path: str, value):
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)]
+            continue
+        if not isinstance(target.get(part, MISSING), (dict, list)):
+            target[part] = {}
+        target = target[part]
+    if isinstance(target, list):
+        index = int(parts[-1])
+        target.extend([None] * (index + 1 - len(target)))
+        target[index] = value
+    else:
+        target[parts[-1]] = value
+
+def unset_path(doc: dict, path: str):
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)] if part.isdigit() and int(part) < len(target) else None
+        else:
+            target = target.get(part)
+        if not isinstance(target, (dict, list)):
+            return
+    if isinstance(target, dict):
+        target.pop(parts[-1], None)
+    elif parts[-1].isdigit() and int(parts[-1]) < len(target):
+        # MongoDB leaves a null in place of an unset array element
+        target[int(parts[-1])] = None
+
+def current_value(doc: dict, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return MISSING
+    return value
+
+# ============= QUERIES =============
+
+def is_operator_dict(condition) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith("$") for key in condition)
+
+def expand(candidates: list):
+    """Each candidate, then the elements of array candidates"""
+    for value in candidates:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+def equal(a, b) -> bool:
+    return type_rank(a) == type_rank(b) and compare(a, b) == 0
+
+REGEX_FLAGS = {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL, "x": re.VERBOSE}
+
+def match_operator(candidates: list, operator: str, argument, condition: dict, now: datetime) -> bool:
+    if operator == "$eq":
+        return any(equal(value, argument) for value in expand(candidates))
+    if operator == "$ne":
+        return not match_operator(candidates, "$eq", argument, condition, now)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        accept = {"$gt": (1,), "$gte": (0, 1), "$lt": (-1,), "$lte": (-1, 0)}[operator]
+        return any(
+            value is not MISSING and type_rank(value) == type_rank(argument) and compare(value, argument) in accept
+            for value in expand(candidates)
+        )
+    if operator == "$in":
+        return any(match_operator(candidates, "$eq", item, condition, now) for item in argument)
+    if operator == "$nin":
+        return not match_operator(candidates, "$in", argument, condition, now)
+    if operator == "$exists":
+        return any(value is not MISSING for value in candidates) == bool(argument)
+    if operator == "$not":
+        if not is_operator_dict(argument):
+            argument = {"$eq": argument}
+        return not all(match_operator(candidates, op, arg, argument, now) for op, arg in argument.items())
+    if operator == "$type":
+        names = argument if isinstance(argument, list) else [argument]
+        return any(
+            value is not MISSING and any(BSON_TYPES[name](value) for name in names)
+            for value in expand(candidates)
+        )
+    if operator == "$size":
+        return any(isinstance(value, list) and len(value) == argument for value in candidates)
+    if operator == "$all":
+        return all(match_operator(candidates, "$eq", item, condition, now) for item in argument)
+    if operator == "$elemMatch":
+        for value in candidates:
+            if not isinstance(value, list):
+                continue
+            for item in value:
+                if is_operator_dict(argument):
+                    if all(match_operator([item], op, arg, argument, now) for op, arg in argument.items()):
+                        return True
+                elif isinstance(item, dict) and matches(item, argument, now):
+                    return True
+        return False
+    if operator == "$regex":
+        flags = 0
+        for option in condition.get("$options", ""):
+            if option not in REGEX_FLAGS:
+                raise OperationFailure(f"invalid flag in regex options: {option}", code=51108)
+            flags |= REGEX_FLAGS[option]
+        pattern = re.compile(argument, flags)
+        return any(isinstance(value, str) and pattern.search(value) for value in expand(candidates))
+    if operator == "$options":
+        return True
+    raise OperationFailure(f"unknown operator: {operator}", code=2)
+
+def match_field(doc: dict, path: str, condition, now: datetime) -> bool:
+    candidates = lookup(doc, path.split("."))
+    if is_operator_dict(condition):
+        return all(match_operator(candidates, op, arg, condition, now) for op, arg in condition.items())
+    return match_operator(candidates, "$eq", condition, {}, now)
+
+def matches(doc: dict, query: Optional[dict], now: Optional[datetime] = None) -> bool:
+    if not query:
+        return True
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(doc, part, now) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, part, now) for part in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, part, now) for part in condition):
+                return False
+        elif key == "$expr":
+            variables = {"ROOT": doc, "CURRENT": doc, "NOW": now or utcnow()}
+            if not truthy(evaluate(condition, doc, variables)):
+                return False
+        elif key == "$comment":
+            continue
+        elif key.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {key}", code=2)
+        elif not match_field(doc, key, condition, now):
+            return False
+    return True
+
+def utcnow() -> datetime:
+    return to_bson(datetime.utcnow())
+
+# ============= EXPRESSIONS =============
+
+def evaluate(expression, root, variables: dict):
+    if isinstance(expression, str):
+        if expression.startswith("$$"):
+            name, _, path = expression[2:].partition(".")
+            if name not in variables:
+                raise OperationFailure(f"Use of undefined variable: {name}", code=17276)
+            value = variables[name]
+            return get_path(value, path) if path else value
+        if expression.startswith("$"):
+            return get_path(root, expression[1:])
+        return expression
+    if isinstance(expression, list):
+        return [evaluate(item, root, variables) for item in expression]
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator, argument = next(iter(expression.items()))
+            if operator.startswith("$"):
+                if operator not in EXPRESSIONS:
+                    raise OperationFailure(f"Unrecognized expression '{operator}'", code=168)
+                return EXPRESSIONS[operator](argument, root, variables)
+        result = {}
+        for key, item in expression.items():
+            value = evaluate(item, root, variables)
+            if value is not MISSING:
+                result[key] = value
+        return result
+    return expression
+
+def evaluate_args(argument, root, variables: dict) -> list:
+    if not isinstance(argument, list):
+        argument = [argument]
+    return [evaluate(item, root, variables) for item in argument]
+
+def is_null(value) -> bool:
+    return value is None or value is MISSING
+
+def numbers(values) -> list:
+    return [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+def expr_map(argument, root, variables):
+    items = evaluate(argument["input"], root, variables)
+    if is_null(items):
+        return None
+    name = argument.get("as", "this")
+    return [evaluate(argument["in"], root, {**variables, name: item}) for item in items]
+
+def expr_filter(argument, root, variables):
+    items = evaluate(argument["input"], root, variables)
+    if is_null(items):
+        return None
+    name = argument.get("as", "this")
+    return [item for item in items if truthy(evaluate(argument["cond"], root, {**variables, name: item}))]
+
+def expr_let(argument, root, variables):
+    scope = dict(variables)
+    for name, value in argument["vars"].items():
+        scope[name] = evaluate(value, root, variables)
+    return evaluate(argument["in"], root, scope)
+
+def expr_cond(argument, root, variables):
+    if isinstance(argument, list):
+        condition, then, otherwise = argument
+    else:
+        condition, then, otherwise = argument["if"], argument["then"], argument["else"]
+    return evaluate(then if truthy(evaluate(condition, root, variables)) else otherwise, root, variables)
+
+def expr_switch(argument, root, variables):
+    for branch in argument["branches"]:
+        if truthy(evaluate(branch["case"], root, variables)):
+            return evaluate(branch["then"], root, variables)
+    if "default" not in argument:
+        raise OperationFailure("$switch could not find a matching branch for an input", code=40066)
+    return evaluate(argument["default"], root, variables)
+
+def expr_if_null(argument, root, variables):
+    for item in argument[:-1]:
+        value = evaluate(item, root, variables)
+        if not is_null(value):
+            return value
+    return evaluate(argument[-1], root, variables)
+
+def expr_sum(argument, root, variables):
+    values = evaluate_args(argument, root, variables)
+    if len(values) == 1 and isinstance(values[0], list):
+        values = values[0]
+    return sum(numbers(values))
+
+def expr_add(argument, root, variables):
+    values = evaluate_args(argument, root, variables)
+    if any(is_null(value) for value in values):
+        return None
+    dates = [value for value in values if isinstance(value, datetime)]
+    total = sum(numbers(values))
+    return dates[0] + timedelta(milliseconds=total) if dates else total
+
+def expr_subtract(argument, root, variables):
+    a, b = evaluate_args(argument, root, variables)
+    if is_null(a) or is_null(b):
+        return None
+    if isinstance(a, datetime) and isinstance(b, datetime):
+        return int((a - b).total_seconds() * 1000)
+    if isinstance(a, datetime):
+        return a - timedelta(milliseconds=b)
+    return a - b
+
+def expr_multiply(argument, root, variables):
+    values = evaluate_args(argument, root, variables)
+    if any(is_null(value) for value in values):
+        return None
+    result = 1
+    for value in values:
+        result *= value
+    return result
+
+def expr_divide(argument, root, variables):
+    a, b = evaluate_args(argument, root, variables)
+    if is_null(a) or is_null(b):
+        return None
+    return a / b
+
+def comparison(accept):
+    def expr(argument, root, variables):
+        a, b = evaluate_args(argument, root, variables)
+        return compare(None if a is MISSING else a, None if b is MISSING else b) in accept
+    return expr
+
+def expr_cmp(argument, root, variables):
+    a, b = evaluate_args(argument, root, variables)
+    return compare(a, b)
+
+def expr_and(argument, root, variables):
+    return all(truthy(evaluate(item, root, variables)) for item in argument)
+
+def expr_or(argument, root, variables):
+    return any(truthy(evaluate(item, root, variables)) for item in argument)
+
+def expr_not(argument, root, variables):
+    return not truthy(evaluate_args(argument, root, variables)[0])
+
+def expr_in(argument, root, variables):
+    value, items = evaluate_args(argument, root, variables)
+    return any(equal(value, item) for item in items)
+
+def expr_size(argument, root, variables):
+    value = evaluate_args(argument, root, variables)[0]
+    if not isinstance(value, list):
+        raise OperationFailure("The argument to $size must be an array", code=17124)
+    return len(value)
+
+def expr_concat(argument, root, variables):
+    values = evaluate_args(argument, root, variables)
+    if any(is_null(value) for value in values):
+        return None
+    return "".join(values)
+
+def expr_concat_arrays(argument, root, variables):
+    values = evaluate_args(argument, root, variables)
+    if any(is_null(value) for value in values):
+        return None
+    return [item for value in values for item in value]
+
+def expr_merge_objects(argument, root, variables):
+    values = evaluate_args(argument, root, variables)
+    if len(values) == 1 and isinstance(values[0], list):
+        values = values[0]
+    merged = {}
+    for value in values:
+        if isinstance(value, dict):
+            merged.update(value)
+    return merged
+
+def expr_to_string(argument, root, variables):
+    value = evaluate_args(argument, root, variables)[0]
+    if is_null(value):
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+    return str(value)
+
+def expr_date_to_string(argument, root, variables):
+    value = evaluate(argument["date"], root, variables)
+    if is_null(value):
+        return evaluate(argument["onNull"], root, variables) if "onNull" in argument else None
+    fmt = argument.get("format", "%Y-%m-%dT%H:%M:%S.%LZ")
+    return value.strftime(fmt.replace("%L", f"{value.microsecond // 1000:03d}"))
+
+def expr_any_element_true(argument, root, variables):
+    return any(truthy(item) for item in evaluate_args(argument, root, variables)[0])
+
+def expr_all_elements_true(argument, root, variables):
+    return all(truthy(item) for item in evaluate_args(argument, root, variables)[0])
+
+def expr_set_union(argument, root, variables):
+    union = []
+    for value in evaluate_args(argument, root, variables):
+        if is_null(value):
+            return None
+        for item in value:
+            if not any(equal(item, seen) for seen in union):
+                union.append(item)
+    return union
+
+def extreme(sign):
+    def expr(argument, root, variables):
+        values = evaluate_args(argument, root, variables)
+        if len(values) == 1 and isinstance(values[0], list):
+            values = values[0]
+        values = [value for value in values if not is_null(value)]
+        if not values:
+            return None
+        best = values[0]
+        for value in values[1:]:
+            if compare(value, best) * sign > 0:
+                best = value
+        return best
+    return expr
+
+def expr_first(argument, root, variables):
+    value = evaluate_args(argument, root, variables)[0]
+    return value[0] if isinstance(value, list) and value else MISSING if isinstance(value, list) else None
+
+def expr_array_elem_at(argument, root, variables):
+    items, index = evaluate_args(argument, root, variables)
+    if is_null(items):
+        return None
+    return items[index] if -len(items) <= index < len(items) else MISSING
+
+def expr_type(argument, root, variables):
+    value = evaluate_args(argument, root, variables)[0]
+    if value is MISSING:
+        return "missing"
+    for name in ("null", "bool", "int", "long", "double", "string", "object", "array", "objectId", "date"):
+        if BSON_TYPES[name](value):
+            return name
+    return "unknown"
+
+EXPRESSIONS: Dict[str, Callable] = {
+    "$literal": lambda argument, root, variables: argument,
+    "$map": expr_map,
+    "$filter": expr_filter,
+    "$let": expr_let,
+    "$cond": expr_cond,
+    "$switch": expr_switch,
+    "$ifNull": expr_if_null,
+    "$sum": expr_sum,
+    "$add": expr_add,
+    "$subtract": expr_subtract,
+    "$multiply": expr_multiply,
+    "$divide": expr_divide,
+    "$eq": comparison((0,)),
+    "$ne": comparison((-1, 1)),
+    "$gt": comparison((1,)),
+    "$gte": comparison((0, 1)),
+    "$lt": comparison((-1,)),
+    "$lte": comparison((-1, 0)),
+    "$cmp": expr_cmp,
+    "$and": expr_and,
+    "$or": expr_or,
+    "$not": expr_not,
+    "$in": expr_in,
+    "$size": expr_size,
+    "$concat": expr_concat,
+    "$concatArrays": expr_concat_arrays,
+    "$mergeObjects": expr_merge_objects,
+    "$toString": expr_to_string,
+    "$dateToString": expr_date_to_string,
+    "$anyElementTrue": expr_any_element_true,
+    "$allElementsTrue": expr_all_elements_true,
+    "$setUnion": expr_set_union,
+    "$max": extreme(1),
+    "$min": extreme(-1),
+    "$first": expr_first,
+    "$arrayElemAt": expr_array_elem_at,
+    "$type": expr_type,
+}
+
+# ============= UPDATES =============
+
+def positional_index(doc: dict, array_path: str, query: dict, now: datetime) -> int:
+    """Index of the first element of `array_path` matched by the query, for "$" """
+    conditions = {}
+    for key, condition in query.items():
+        if key.startswith(array_path + "."):
+            conditions[key[len(array_path) + 1:]] = condition
+        elif key == array_path and isinstance(condition, dict) and "$elemMatch" in condition:
+            conditions = condition["$elemMatch"]
+    items = current_value(doc, array_path)
+    if isinstance(items, list) and conditions:
+        for index, item in enumerate(items):
+            if is_operator_dict(conditions):
+                if all(match_operator([item], op, arg, conditions, now) for op, arg in conditions.items()):
+                    return index
+            elif isinstance(item, dict) and matches(item, conditions, now):
+                return index
+            elif not isinstance(item, dict) and all(
+                match_field({"": item}, "", condition, now) for condition in conditions.values()
+            ):
+                return index
+    raise OperationFailure("The positional operator did not find the match needed from the query.", code=2)
+
+def resolve_positional(path: str, doc: dict, query: dict, now: datetime) -> str:
+    if ".$." not in path and not path.endswith(".$"):
+        return path
+    array_path, _, rest = path.partition(".$")
+    index = positional_index(doc, array_path, query, now)
+    return f"{array_path}.{index}{rest}"
+
+def pull_matches(item, condition, now: datetime) -> bool:
+    if is_operator_dict(condition):
+        return all(match_operator([item], op, arg, condition, now) for op, arg in condition.items())
+    if isinstance(condition, dict) and isinstance(item, dict):
+        return matches(item, condition, now)
+    return equal(item, condition)
+
+def apply_operators(doc: dict, update: dict, query: dict, inserting: bool, now: datetime):
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not inserting:
+            continue
+        if not operator.startswith("$"):
+            raise OperationFailure("update only works with $ operators", code=9)
+        for path, argument in fields.items():
+            path = resolve_positional(path, doc, query, now)
+            value = current_value(doc, path)
+            if operator in ("$set", "$setOnInsert"):
+                set_path(doc, path, to_bson(argument))
+            elif operator == "$unset":
+                unset_path(doc, path)
+            elif operator in ("$inc", "$mul"):
+                if value is MISSING:
+                    set_path(doc, path, argument if operator == "$inc" else 0)
+                elif not numbers([value]):
+                    raise OperationFailure(f"Cannot apply {operator} to a value of non-numeric type", code=14)
+                else:
+                    set_path(doc, path, value + argument if operator == "$inc" else value * argument)
+            elif operator in ("$min", "$max"):
+                sign = -1 if operator == "$min" else 1
+                if value is MISSING or compare(argument, value) * sign > 0:
+                    set_path(doc, path, to_bson(argument))
+            elif operator in ("$push", "$addToSet"):
+                if value is MISSING:
+                    value = []
+                    set_path(doc, path, value)
+                elif not isinstance(value, list):
+                    raise OperationFailure(f"Cannot apply {operator} to a non-array field", code=2)
+                if isinstance(argument, dict) and set(argument) - {"$each"} and "$each" in argument:
+                    raise NotImplementedError(f"memory_db does not support {operator} modifiers other than $each")
+                items = argument["$each"] if isinstance(argument, dict) and "$each" in argument else [argument]
+                for item in to_bson(items):
+                    if operator == "$push" or not any(equal(item, existing) for existing in value):
+                        value.append(item)
+            elif operator == "$pull":
+                if isinstance(value, list):
+                    value[:] = [item for item in value if not pull_matches(item, argument, now)]
+            elif operator == "$currentDate":
+                set_path(doc, path, now)
+            else:
+                raise OperationFailure(f"Unknown modifier: {operator}", code=9)
+
+def apply_pipeline(doc: dict, pipeline: list, now: datetime) -> dict:
+    for stage in pipeline:
+        (name, argument), = stage.items()
+        variables = {"ROOT": doc, "CURRENT": doc, "NOW": now}
+        if name in ("$set", "$addFields"):
+            values = {path: evaluate(expression, doc, variables) for path, expression in argument.items()}
+            doc = copy_value(doc)
+            for path, value in values.items():
+                if value is MISSING:
+                    unset_path(doc, path)
+                else:
+                    set_path(doc, path, to_bson(value))
+        elif name in ("$unset", "$project") and (name == "$unset" or all(not v for v in argument.values())):
+            doc = copy_value(doc)
+            for path in ([argument] if isinstance(argument, str) else list(argument)):
+                unset_path(doc, path)
+        elif name in ("$replaceWith", "$replaceRoot"):
+            replacement = evaluate(argument["newRoot"] if name == "$replaceRoot" else argument, doc, variables)
+            doc = {"_id": doc["_id"], **to_bson(replacement)}
+        else:
+            raise OperationFailure(f"{name} is not allowed in an update pipeline", code=72)
+    return doc
+
+def apply_update(doc: dict, update, query: dict, inserting: bool, now: datetime) -> dict:
+    """New version of `doc`; the stored document is left untouched"""
+    if isinstance(update, list):
+        updated = apply_pipeline(doc, update, now)
+    else:
+        updated = copy_value(doc)
+        apply_operators(updated, update, query, inserting, now)
+    if updated.get("_id", MISSING) != doc.get("_id", MISSING) and not inserting:
+        raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'", code=66)
+    return updated
+
+def upsert_seed(query: dict) -> dict:
+    """Equality fields of a query, the starting document of an upsert"""
+    seed = {}
+    for key, condition in query.items():
+        if key == "$and":
+            for part in condition:
+                for path, value in upsert_seed(part).items():
+                    set_path(seed, path, value)
+        elif key.startswith("$"):
+            continue
+        elif is_operator_dict(condition):
+            if "$eq" in condition:
+                set_path(seed, key, to_bson(condition["$eq"]))
+        else:
+            set_path(seed, key, to_bson(condition))
+    return seed
+
+# ============= PROJECTION AND SORT =============
+
+def project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return copy_value(doc)
+    include_id = bool(projection.get("_id", 1))
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    if fields and all(fields.values()):
+        result = {}
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+        for path in fields:
+            value = current_value(doc, path)
+            if value is not MISSING:
+                set_path(result, path, copy_value(value))
+        return result
+    result = copy_value(doc)
+    for path in fields:
+        unset_path(result, path)
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+def normalize_sort(key_or_list, direction=None) -> list:
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(key, value) for key, value in key_or_list]
+
+def sort_documents(docs: list, sort: list) -> list:
+    if not sort:
+        return docs
+
+    def sort_value(doc, path, direction):
+        value = current_value(doc, path)
+        if isinstance(value, list) and value:
+            # Arrays sort by their smallest element ascending, largest descending
+            best = value[0]
+            for item in value[1:]:
+                if compare(item, best) * direction < 0:
+                    best = item
+            return best
+        return value
+
+    def order(a, b):
+        for path, direction in sort:
+            result = compare(sort_value(a, path, direction), sort_value(b, path, direction))
+            if result:
+                return result * (1 if direction >= 0 else -1)
+        return 0
+
+    return sorted(docs, key=cmp_to_key(order))
+
+# ============= AGGREGATION =============
+
+def accumulate(groups: dict, key, row: dict, spec: dict, doc: dict):
+    variables = {"ROOT": doc, "CURRENT": doc}
+    for field, accumulator in spec.items():
+        if field == "_id":
+            continue
+        (operator, argument), = accumulator.items()
+        value = evaluate(argument, doc, variables)
+        if operator == "$sum":
+            row[field] = row.get(field, 0) + (sum(numbers(value)) if isinstance(value, list) else sum(numbers([value])))
+        elif operator == "$avg":
+            total, count = row.get(field, (0, 0))
+            row[field] = (total + sum(numbers([value])), count + len(numbers([value])))
+        elif operator == "$first":
+            row.setdefault(field, None if value is MISSING else value)
+        elif operator == "$last":
+            row[field] = None if value is MISSING else value
+        elif operator in ("$min", "$max"):
+            sign = -1 if operator == "$min" else 1
+            if not is_null(value) and (field not in row or row[field] is None or compare(value, row[field]) * sign > 0):
+                row[field] = value
+            row.setdefault(field, None)
+        elif operator == "$push":
+            row.setdefault(field, []).append(value)
+        elif operator == "$addToSet":
+            items = row.setdefault(field, [])
+            if not any(equal(value, item) for item in items):
+                items.append(value)
+        else:
+            raise OperationFailure(f"unknown group operator '{operator}'", code=15952)
+
+def run_aggregation(docs: list, pipeline: list, now: datetime) -> list:
+    for stage in pipeline:
+        (name, argument), = stage.items()
+        if name == "$match":
+            docs = [doc for doc in docs if matches(doc, argument, now)]
+        elif name == "$group":
+            groups = {}
+            for doc in docs:
+                key = evaluate(argument["_id"], doc, {"ROOT": doc, "CURRENT": doc, "NOW": now})
+                key = None if key is MISSING else key
+                entry = groups.setdefault(hashable(key), {"_id": key})
+                accumulate(groups, key, entry, argument, doc)
+            docs = list(groups.values())
+            for row in docs:
+                for field, accumulator in argument.items():
+                    if field != "_id" and "$avg" in accumulator:
+                        total, count = row[field]
+                        row[field] = total / count if count else None
+        elif name == "$sort":
+            docs = sort_documents(docs, normalize_sort(argument))
+        elif name == "$limit":
+            docs = docs[:argument]
+        elif name == "$skip":
+            docs = docs[argument:]
+        elif name == "$count":
+            docs = [{argument: len(docs)}] if docs else []
+        elif name == "$unwind":
+            if isinstance(argument, dict) and set(argument) != {"path"}:
+                raise NotImplementedError("memory_db supports $unwind with a path only")
+            path = (argument["path"] if isinstance(argument, dict) else argument)[1:]
+            unwound = []
+            for doc in docs:
+                items = current_value(doc, path)
+                for item in items if isinstance(items, list) else []:
+                    copy = copy_value(doc)
+                    set_path(copy, path, copy_value(item))
+                    unwound.append(copy)
+            docs = unwound
+        elif name == "$project" and all(isinstance(value, (bool, int)) for value in argument.values()):
+            docs = [project(doc, argument) for doc in docs]
+        elif name in ("$set", "$addFields", "$unset", "$replaceWith", "$replaceRoot"):
+            docs = [apply_pipeline(doc, [stage], now) for doc in docs]
+        else:
+            raise NotImplementedError(f"memory_db does not support the {name} stage")
+    return docs
+
+# ============= INDEXES =============
+
+def index_name(keys: list) -> str:
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+class Index:
+    def __init__(self, keys: list, unique: bool = False, sparse: bool = False,
+                 partial: Optional[dict] = None, expire_after: Optional[float] = None):
+        self.keys = keys
+        self.name = index_name(keys)
+        self.unique = unique
+        self.sparse = sparse
+        self.partial = partial
+        self.expire_after = expire_after
+        # Leading field value -> keys of the documents holding it
+        self.postings: Dict[object, set] = {}
+        # Full key -> document key, for unique indexes
+        self.entries: Dict[tuple, object] = {}
+
+    def options(self) -> tuple:
+        return (self.unique, self.sparse, hashable(self.partial), self.expire_after)
+
+    def covers(self, doc: dict) -> bool:
+        if self.partial is not None and not matches(doc, self.partial):
+            return False
+        if self.sparse and all(current_value(doc, field) is MISSING for field, _ in self.keys):
+            return False
+        return True
+
+    def leading_values(self, doc: dict) -> set:
+        values = set()
+        for value in expand(lookup(doc, self.keys[0][0].split("."))):
+            if not isinstance(value, list):
+                values.add(hashable(value))
+        return values
+
+    def unique_key(self, doc: dict) -> tuple:
+        return tuple(hashable(current_value(doc, field)) for field, _ in self.keys)
+
+    def add(self, key, doc: dict):
+        if not self.covers(doc):
+            return
+        for value in self.leading_values(doc):
+            self.postings.setdefault(value, set()).add(key)
+        if self.unique:
+            self.entries[self.unique_key(doc)] = key
+
+    def remove(self, key, doc: dict):
+        if not self.covers(doc):
+            return
+        for value in self.leading_values(doc):
+            posting = self.postings.get(value)
+            if posting:
+                posting.discard(key)
+                if not posting:
+                    del self.postings[value]
+        if self.unique and self.entries.get(self.unique_key(doc)) == key:
+            del self.entries[self.unique_key(doc)]
+
+    def conflict(self, key, doc: dict) -> bool:
+        if not self.unique or not self.covers(doc):
+            return False
+        holder = self.entries.get(self.unique_key(doc))
+        return holder is not None and holder != key
+
+# ============= COLLECTIONS =============
+
+class MemoryCursor:
+    """find() and aggregate() results, evaluated when first read"""
+
+    def __init__(self, produce: Callable[["MemoryCursor"], list]):
+        self._produce = produce
+        self._sort: list = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None) -> "MemoryCursor":
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int) -> "MemoryCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int) -> "MemoryCursor":
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> list:
+        docs = self._produce(self)
+        return docs[:length] if length else docs
+
+    async def _iterate(self):
+        for doc in self._produce(self):
+            yield doc
+
+    def __aiter__(self):
+        return self._iterate()
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: Dict[object, dict] = {}
+        self._indexes: Dict[str, Index] = {"_id_": Index([("_id", 1)], unique=True)}
+        self._purged_at = 0.0
+
+    def __getitem__(self, name: str) -> "MemoryCollection":
+        return self.database[f"{self.name}.{name}"]
+
+    # -- internals
+
+    def _command(self, name: str):
+        self.database.client.on_command(name)
+        self._expire()
+
+    def _expire(self):
+        """TTL indexes: drop documents past their expiry, at most once a second"""
+        ttl = [index for index in self._indexes.values() if index.expire_after is not None]
+        if not ttl or time.monotonic() - self._purged_at < TTL_PURGE_SECONDS:
+            return
+        self._purged_at = time.monotonic()
+        now = datetime.utcnow()
+        for index in ttl:
+            field = index.keys[0][0]
+            cutoff = now - timedelta(seconds=index.expire_after)
+            for key, doc in list(self._docs.items()):
+                value = current_value(doc, field)
+                if isinstance(value, datetime) and value <= cutoff:
+                    self._remove(key)
+
+    def _candidates(self, query: Optional[dict]):
+        """Keys of the documents that may match: a hash lookup when the query
+        has an equality on the leading field of an index, else every document"""
+        for field, condition in (query or {}).items():
+            if field.startswith("$"):
+                continue
+            if is_operator_dict(condition):
+                if "$eq" in condition:
+                    values = [condition["$eq"]]
+                elif "$in" in condition:
+                    values = list(condition["$in"])
+                else:
+                    continue
+            else:
+                values = [condition]
+            if any(isinstance(value, (dict, list)) or value is None for value in values):
+                continue
+            for index in self._indexes.values():
+                if index.keys[0][0] == field and index.partial is None and not index.sparse:
+                    keys = set()
+                    for value in values:
+                        keys |= index.postings.get(hashable(to_bson(value)), set())
+                    return [key for key in self._docs if key in keys] if len(keys) > 1 else list(keys)
+        return list(self._docs)
+
+    def _find(self, query: Optional[dict], sort: Optional[list] = None) -> list:
+        now = utcnow()
+        docs = [
+            self._docs[key] for key in self._candidates(query)
+            if key in self._docs and matches(self._docs[key], query, now)
+        ]
+        return sort_documents(docs, sort or [])
+
+    def _check_unique(self, key, doc: dict):
+        for index in self._indexes.values():
+            if index.conflict(key, doc):
+                values = {field: current_value(doc, field) for field, _ in index.keys}
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.database.name}.{self.name} "
+                    f"index: {index.name} dup key: {values}",
+                    11000,
+                    {"code": 11000, "keyPattern": dict(index.keys), "keyValue": values}
+                )
+
+    def _insert(self, document: dict) -> object:
+        if "_id" not in document:
+            # Like pymongo, the generated id is written back to the caller's dict
+            document["_id"] = ObjectId()
+        doc = to_bson(document)
+        key = hashable(doc["_id"])
+        self._check_unique(key, doc)
+        self._docs[key] = doc
+        for index in self._indexes.values():
+            index.add(key, doc)
+        return doc["_id"]
+
+    def _replace(self, key, old: dict, new: dict):
+        self._check_unique(key, new)
+        for index in self._indexes.values():
+            index.remove(key, old)
+        self._docs[key] = new
+        for index in self._indexes.values():
+            index.add(key, new)
+
+    def _remove(self, key):
+        doc = self._docs.pop(key)
+        for index in self._indexes.values():
+            index.remove(key, doc)
+
+    def _update(self, query: dict, update, upsert: bool, multi: bool, sort: Optional[list] = None) -> dict:
+        """Returns {"n", "nModified", "upserted"?, "before", "after"} like a server reply"""
+        now = utcnow()
+        targets = self._find(query, sort)
+        if not multi:
+            targets = targets[:1]
+        if not targets:
+            if not upsert:
+                return {"n": 0, "nModified": 0, "before": None, "after": None}
+            seed = upsert_seed(query)
+            if isinstance(update, dict) and update and not any(key.startswith("$") for key in update):
+                doc = {**to_bson(update), **({"_id": seed["_id"]} if "_id" in seed else {})}
+            else:
+                doc = apply_update(seed, update, query, True, now)
+            upserted_id = self._insert(doc)
+            return {"n": 1, "nModified": 0, "upserted": upserted_id, "before": None, "after": self._docs[hashable(upserted_id)]}
+        modified = 0
+        before = after = None
+        for doc in targets:
+            key = hashable(doc["_id"])
+            if isinstance(update, dict) and update and not any(field.startswith("$") for field in update):
+                new = {"_id": doc["_id"], **to_bson({k: v for k, v in update.items() if k != "_id"})}
+            else:
+                new = apply_update(doc, update, query, False, now)
+            if new != doc:
+                self._replace(key, doc, new)
+                modified += 1
+            before, after = doc, self._docs[key]
+        return {"n": len(targets), "nModified": modified, "before": before, "after": after}
+
+    # Motor interface
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None) -> MemoryCursor:
+        def produce(cursor: MemoryCursor) -> list:
+            self._command("find")
+            docs = self._find(filter, cursor._sort or normalize_sort(sort))
+            docs = docs[cursor._skip:]
+            if cursor._limit:
+                docs = docs[:cursor._limit]
+            return [project(doc, projection) for doc in docs]
+        return MemoryCursor(produce)
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        self._command("find")
+        docs = self._find(filter, normalize_sort(sort))
+        return project(docs[0], projection) if docs else None
+
+    async def insert_one(self, document: dict) -> InsertOneResult:
+        self._command("insert")
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents: list, ordered: bool = True) -> InsertManyResult:
+        self._command("insert")
+        inserted, errors = [], []
+        for position, document in enumerate(documents):
+            try:
+                inserted.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({"index": position, "code": 11000, "errmsg": str(e), "op": document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": len(inserted),
+                "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []
+            })
+        return InsertManyResult(inserted, True)
+
+    async def update_one(self, filter: dict, update, upsert: bool = False) -> UpdateResult:
+        self._command("update")
+        reply = self._update(filter, update, upsert, multi=False)
+        return UpdateResult({key: reply[key] for key in ("n", "nModified", "upserted") if key in reply}, True)
+
+    async def update_many(self, filter: dict, update, upsert: bool = False) -> UpdateResult:
+        self._command("update")
+        reply = self._update(filter, update, upsert, multi=True)
+        return UpdateResult({key: reply[key] for key in ("n", "nModified", "upserted") if key in reply}, True)
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False) -> UpdateResult:
+        self._command("update")
+        reply = self._update(filter, replacement, upsert, multi=False)
+        return UpdateResult({key: reply[key] for key in ("n", "nModified", "upserted") if key in reply}, True)
+
+    async def find_one_and_update(self, filter: dict, update, projection: Optional[dict] = None, sort=None,
+                                  upsert: bool = False, return_document: bool = ReturnDocument.BEFORE):
+        self._command("findAndModify")
+        reply = self._update(filter, update, upsert, multi=False, sort=normalize_sort(sort))
+        doc = reply["after"] if return_document == ReturnDocument.AFTER else reply["before"]
+        return project(doc, projection) if doc is not None else None
+
+    async def find_one_and_replace(self, filter: dict, replacement: dict, projection: Optional[dict] = None,
+                                   sort=None, upsert: bool = False,
+                                   return_document: bool = ReturnDocument.BEFORE):
+        return await self.find_one_and_update(filter, replacement, projection, sort, upsert, return_document)
+
+    async def find_one_and_delete(self, filter: dict, projection: Optional[dict] = None, sort=None):
+        self._command("findAndModify")
+        docs = self._find(filter, normalize_sort(sort))
+        if not docs:
+            return None
+        self._remove(hashable(docs[0]["_id"]))
+        return project(docs[0], projection)
+
+    async def delete_one(self, filter: dict) -> DeleteResult:
+        self._command("delete")
+        docs = self._find(filter)[:1]
+        for doc in docs:
+            self._remove(hashable(doc["_id"]))
+        return DeleteResult({"n": len(docs)}, True)
+
+    async def delete_many(self, filter: dict) -> DeleteResult:
+        self._command("delete")
+        docs = self._find(filter)
+        for doc in docs:
+            self._remove(hashable(doc["_id"]))
+        return DeleteResult({"n": len(docs)}, True)
+
+    async def count_documents(self, filter: dict, skip: int = 0, limit: int = 0) -> int:
+        self._command("aggregate")
+        docs = self._find(filter)[skip:]
+        return min(len(docs), limit) if limit else len(docs)
+
+    async def estimated_document_count(self) -> int:
+        self._command("count")
+        return len(self._docs)
+
+    async def distinct(self, key: str, filter: Optional[dict] = None) -> list:
+        self._command("distinct")
+        values = []
+        for doc in self._find(filter):
+            for value in expand(lookup(doc, key.split("."))):
+                if value is not MISSING and not isinstance(value, list) and not any(equal(value, seen) for seen in values):
+                    values.append(copy_value(value))
+        return values
+
+    def aggregate(self, pipeline: list) -> MemoryCursor:
+        def produce(cursor: MemoryCursor) -> list:
+            self._command("aggregate")
+            docs = run_aggregation(self._find(None), pipeline, utcnow())
+            return [copy_value(doc) for doc in docs]
+        return MemoryCursor(produce)
+
+    async def bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        self._command("bulkWrite")
+        result = {
+            "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+            "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []
+        }
+        for position, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                    if any(getattr(request, option, None) for option in ("_array_filters", "_collation", "_hint")):
+                        raise NotImplementedError(f"memory_db does not support the options of {request!r}")
+                    reply = self._update(
+                        request._filter, request._doc, request._upsert, multi=isinstance(request, UpdateMany)
+                    )
+                    if "upserted" in reply:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": position, "_id": reply["upserted"]})
+                    else:
+                        result["nMatched"] += reply["n"]
+                        result["nModified"] += reply["nModified"]
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    docs = self._find(request._filter)
+                    if isinstance(request, DeleteOne):
+                        docs = docs[:1]
+                    for doc in docs:
+                        self._remove(hashable(doc["_id"]))
+                    result["nRemoved"] += len(docs)
+                else:
+                    raise TypeError(f"{request!r} is not a valid request")
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": position, "code": 11000, "errmsg": str(e), "op": request})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    async def create_index(self, keys, unique: bool = False, sparse: bool = False,
+                           partialFilterExpression: Optional[dict] = None,
+                           expireAfterSeconds: Optional[float] = None, name: Optional[str] = None) -> str:
+        self._command("createIndexes")
+        index = Index(normalize_sort(keys), unique, sparse, partialFilterExpression, expireAfterSeconds)
+        if name:
+            index.name = name
+        existing = self._indexes.get(index.name)
+        if existing is not None:
+            if existing.options() != index.options():
+                raise OperationFailure(
+                    f"Index already exists with a different name or options: {index.name}", code=85
+                )
+            return index.name
+        for key, doc in self._docs.items():
+            self._check_unique_against(index, key, doc)
+            index.add(key, doc)
+        self._indexes[index.name] = index
+        return index.name
+
+    def _check_unique_against(self, index: Index, key, doc: dict):
+        if index.conflict(key, doc):
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.database.name}.{self.name} index: {index.name}",
+                11000
+            )
+
+    async def drop_index(self, index_or_name):
+        self._command("dropIndexes")
+        name = index_or_name if isinstance(index_or_name, str) else index_name(normalize_sort(index_or_name))
+        if name == "_id_" or name not in self._indexes:
+            raise OperationFailure(f"index not found with name [{name}]", code=27)
+        del self._indexes[name]
+
+    async def index_information(self) -> dict:
+        self._command("listIndexes")
+        return {
+            name: {"key": index.keys, **({"unique": True} if index.unique else {})}
+            for name, index in self._indexes.items()
+        }
+
+    async def drop(self):
+        self._command("drop")
+        self.database.drop_collection_now(self.name)
+
+    def explain_plan(self, query: Optional[dict], sort: Optional[list]) -> dict:
+        """Plan in the shape of MongoDB's queryPlanner output"""
+        indexed = {index.keys[0][0] for index in self._indexes.values()}
+
+        def uses_index(query: dict) -> bool:
+            if "$or" in query:
+                return all(uses_index(branch) for branch in query["$or"])
+            return any(
+                field in indexed and not (is_operator_dict(condition) and not {"$eq", "$in"} & set(condition))
+                for field, condition in query.items() if not field.startswith("$")
+            )
+
+        if (query and uses_index(query)) or (not query and sort and sort[0][0] in indexed):
+            return {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}
+        return {"stage": "COLLSCAN"}
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str) -> MemoryCollection:
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return [name for name, collection in self._collections.items() if collection._docs]
+
+    def drop_collection_now(self, name: str):
+        self._collections.pop(name, None)
+
+    async def drop_collection(self, name: str):
+        self.drop_collection_now(name)
+
+    async def command(self, command, value=None, verbosity: str = "queryPlanner") -> dict:
+        self.client.on_command(command if isinstance(command, str) else next(iter(command)))
+        if command == "ping":
+            return {"ok": 1.0}
+        if command == "explain" and isinstance(value, dict) and "find" in value:
+            if verbosity != "queryPlanner":
+                raise NotImplementedError("memory_db explains with queryPlanner verbosity only")
+            collection = self[value["find"]]
+            plan = collection.explain_plan(value.get("filter"), normalize_sort(value.get("sort")))
+            return {"queryPlanner": {"winningPlan": plan}, "ok": 1.0}
+        raise OperationFailure(f"no such command: '{command}'", code=59)
+
+class MemoryClient:
+    """Drop-in for AsyncIOMotorClient; `on_command` is called once per
+    operation, like a command listener's started()"""
+
+    def __init__(self, on_command: Optional[Callable[[str], None]] = None):
+        self.on_command = on_command or (lambda name: None)
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(self, name)
+        return self._databases[name]
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        return self[name]
+
+    def close(self):
+        pass
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+
+import pytest
+
+# server.py and its test tools live one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# server.py picks its storage and payment gateway at import time
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("PAYMENT_GATEWAY", "fake")
+os.environ.setdefault("FAKE_SQUARE_LATENCY_MS", "0")
+os.environ.setdefault("FAKE_SQUARE_JITTER_MS", "0")
+os.environ.setdefault("SQUARE_WEBHOOK_SIGNATURE_KEY", "test-signature-key")
+os.environ.setdefault("SQUARE_WEBHOOK_URL", "http://testserver/api/webhooks/square")
+
+from memory_db import MemoryClient  # noqa: E402
+
+MONGO_URL = os.environ.get("MONGO_URL")
+
+@pytest.fixture(params=["memory", "mongo"])
+def run(request):
+    """Run `scenario(db)` on a fresh database of each backend; the MongoDB
+    run needs MONGO_URL and is skipped without it"""
+    if request.param == "mongo" and not MONGO_URL:
+        pytest.skip("MONGO_URL is not set")
+
+    def runner(scenario):
+        async def main():
+            if request.param == "memory":
+                client = MemoryClient()
+            else:
+                from motor.motor_asyncio import AsyncIOMotorClient
+                client = AsyncIOMotorClient(MONGO_URL)
+            db = client[f"parity_{uuid.uuid4().hex[:12]}"]
+            try:
+                return await scenario(db)
+            finally:
+                if request.param == "mongo":
+                    await client.drop_database(db.name)
+                client.close()
+        return asyncio.run(main())
+    return runner
+
+@pytest.fixture
+def fresh_db(monkeypatch):
+    """Point server.py at an empty in-memory database for one scenario"""
+    import server
+    db = MemoryClient()["scenario"]
+
+    async def invalidate_catalog():
+        pass
+
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "invalidate_catalog", invalidate_catalog)
+    return db
+
+@pytest.fixture(scope="session")
+def api():
+    """TestClient over the whole app, on the in-memory store and fake Square"""
+    from fastapi.testclient import TestClient
+    import server
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def book(api):
+    """Make a charged booking of `passengers` on a departure with room for
+    it, and return the stored payment record"""
+    import server
+
+    def booking(passengers: int = 2) -> dict:
+        cruise, departure = next(
+            (cruise, availability)
+            for cruise in api.get("/api/cruises").json()
+            for availability in cruise["availabilities"]
+            if (availability.get("remaining_places") or 0) >= passengers
+            and availability["status_label"] != "ANNULÉ"
+        )
+        quote = api.post("/api/quotes", json={
+            "cruise_id": cruise["id"], "selected_date": departure["date_range"], "passengers": passengers
+        }).json()
+        response = api.post("/api/payments/create", json={
+            "source_id": "cnon:card-nonce-ok",
+            "amount": quote["amount"],
+            "cruise_id": cruise["id"],
+            "cruise_name": cruise["name_fr"],
+            "customer_email": "client@example.fr",
+            "customer_name": "Client Test",
+            "passengers": passengers,
+            "selected_date": departure["date_range"],
+        })
+        assert response.status_code == 202, response.text
+        payment_id = response.json()["payment_id"]
+        for _ in range(100):
+            if api.get(f"/api/payments/{payment_id}").json()["status"] != "PENDING":
+                return api.portal.call(server.db.payments.find_one, {"id": payment_id}, {"_id": 0})
+            time.sleep(0.02)
+        raise AssertionError(f"Payment {payment_id} still pending")
+    return booking
+
+@pytest.fixture
+def deliver(api):
+    """POST a Square event signed like Square does; returns the response"""
+    import fake_square
+    import server
+
+    def delivery(event: dict):
+        body = json.dumps(event).encode()
+        signature = fake_square.sign(server.SQUARE_WEBHOOK_SIGNATURE_KEY, server.SQUARE_WEBHOOK_URL, body)
+        return api.post("/api/webhooks/square", content=body, headers={"x-square-hmacsha256-signature": signature})
+    return delivery
@@ -0,0 +1,92 @@
+"""Cruise schema 2: legacy documents are upcast on read, compacted in place,
+and still served in the old shape to clients that ask for it"""
+import asyncio
+from datetime import datetime
+
+import server
+
+LEGACY_CRUISE = {
+    "id": "legacy-1",
+    "name_fr": "Tour de Corse",
+    "name_en": "Tour of Corsica",
+    "subtitle_fr": "",
+    "subtitle_en": "",
+    "description_fr": "",
+    "description_en": "",
+    "image_url": "",
+    "destination": "Corse",
+    "cruise_type": "both",
+    "duration": "8 jours / 7 nuits",
+    "departure_port": "Ajaccio",
+    "pricing": {"cabin_price": 1500, "private_price": 12000, "currency": "EUR"},
+    "available_dates": [
+        {"date": "2026-05-23", "status": "limited", "remaining_places": 4},
+        {"date": "bientôt", "status": "available"},
+    ],
+    "program_fr": ["Jour 1: Ajaccio - Îles Sanguinaires", "Escale libre"],
+    "program_en": ["Day 1: Ajaccio - Sanguinaires Islands"],
+    "updated_at": datetime(2025, 1, 1),
+}
+
+def test_upcast_fills_the_new_fields_and_drops_the_legacy_ones():
+    upcast = server.upcast_cruise(LEGACY_CRUISE)
+    assert upcast["schema_version"] == server.CRUISE_SCHEMA_VERSION
+    assert not set(server.LEGACY_CRUISE_FIELDS) & set(upcast)
+    # Unreadable dates are dropped
+    assert upcast["availabilities"] == [{
+        "date_range": "du 23 au 30 mai 2026", "price": 1500, "status": "limited", "remaining_places": 4
+    }]
+    assert upcast["detailed_program_fr"] == [
+        {"day": 1, "title": "Ajaccio - Îles Sanguinaires", "description": ""},
+        {"day": 2, "title": "Escale libre", "description": ""},
+    ]
+    # The stored document is left alone
+    assert "available_dates" in LEGACY_CRUISE
+
+def test_upcast_keeps_fields_already_filled():
+    availabilities = [{"date_range": "du 2 au 9 mai 2026", "price": 1400, "status": "available"}]
+    upcast = server.upcast_cruise({**LEGACY_CRUISE, "availabilities": availabilities})
+    assert upcast["availabilities"] == availabilities
+    current = server.upcast_cruise(upcast)
+    assert current is upcast
+
+def test_legacy_view_rebuilds_the_old_fields():
+    legacy = server.legacy_cruise(server.Cruise(**server.upcast_cruise(LEGACY_CRUISE)))
+    assert legacy.schema_version == 1
+    assert legacy.available_dates == [{"date": "2026-05-23", "status": "limited", "remaining_places": 4}]
+    assert legacy.program_fr == ["Jour 1: Ajaccio - Îles Sanguinaires", "Jour 2: Escale libre"]
+    assert legacy.program_en == ["Day 1: Ajaccio - Sanguinaires Islands"]
+
+def test_compaction_rewrites_legacy_documents_once(fresh_db):
+    availabilities = [{"date_range": "du 2 au 9 mai 2026", "price": 1400, "status": "limited", "remaining_places": 1}]
+
+    async def scenario():
+        await fresh_db.cruises.insert_many([
+            dict(LEGACY_CRUISE),
+            # Seats sold after the upcast filled availabilities are kept
+            {**LEGACY_CRUISE, "id": "legacy-2", "availabilities": availabilities},
+            {**server.upcast_cruise(LEGACY_CRUISE), "id": "current"},
+        ])
+        first = await server.compact_cruises()
+        again = await server.compact_cruises()
+        stored = {doc["id"]: doc for doc in await fresh_db.cruises.find({}, {"_id": 0}).to_list(None)}
+        return first, again, stored
+
+    first, again, stored = asyncio.run(scenario())
+    assert first == {"scanned": 2, "compacted": 2}
+    assert again == {"scanned": 0, "compacted": 0}
+    for doc in stored.values():
+        assert doc["schema_version"] == server.CRUISE_SCHEMA_VERSION
+        assert not set(server.LEGACY_CRUISE_FIELDS) & set(doc)
+    assert stored["legacy-1"]["availabilities"] == server.upcast_cruise(LEGACY_CRUISE)["availabilities"]
+    assert stored["legacy-2"]["availabilities"] == availabilities
+
+def test_clients_choose_the_schema_they_read(api):
+    cruise_id = api.get("/api/cruises").json()[0]["id"]
+    legacy = api.get(f"/api/cruises/{cruise_id}").json()
+    current = api.get(f"/api/cruises/{cruise_id}", params={"schema_version": server.CRUISE_SCHEMA_VERSION}).json()
+    assert (legacy["schema_version"], current["schema_version"]) == (1, server.CRUISE_SCHEMA_VERSION)
+    assert "available_dates" in legacy and "available_dates" not in current
+    assert legacy["availabilities"] == current["availabilities"]
+    too_new = api.get(f"/api/cruises/{cruise_id}", params={"schema_version": server.CRUISE_SCHEMA_VERSION + 1})
+    assert too_new.status_code == 422
@@ -0,0 +1,91 @@
+"""Seat holds during checkout: a hold keeps its seats from other buyers until
+it is paid, released or expired"""
+from datetime import datetime, timedelta
+
+import server
+
+def open_departure(api, seats: int):
+    return next(
+        (cruise, availability)
+        for cruise in api.get("/api/cruises").json()
+        if cruise["cruise_type"] in ("cabin", "both")
+        for availability in cruise["availabilities"]
+        if (availability.get("remaining_places") or 0) >= seats and availability["status_label"] != "ANNULÉ"
+    )
+
+def hold(api, cruise, availability, passengers: int):
+    return api.post("/api/holds", json={
+        "cruise_id": cruise["id"], "selected_date": availability["date_range"], "passengers": passengers
+    })
+
+def pay(api, cruise, availability, passengers: int, hold_id: str):
+    amount = api.post("/api/quotes", json={
+        "cruise_id": cruise["id"], "selected_date": availability["date_range"], "passengers": passengers
+    }).json()["amount"]
+    return api.post("/api/payments/create", json={
+        "source_id": "cnon:card-nonce-ok",
+        "amount": amount,
+        "cruise_id": cruise["id"],
+        "cruise_name": cruise["name_fr"],
+        "customer_email": "client@example.fr",
+        "customer_name": "Client Test",
+        "passengers": passengers,
+        "selected_date": availability["date_range"],
+        "hold_id": hold_id,
+    })
+
+def stored_departure(api, cruise, availability) -> dict:
+    stored = api.portal.call(server.db.cruises.find_one, {"id": cruise["id"]}, {"_id": 0})
+    return next(a for a in stored["availabilities"] if a["date_range"] == availability["date_range"])
+
+def expire(api, hold_id: str):
+    past = datetime.utcnow() - timedelta(minutes=1)
+    api.portal.call(server.db.seat_holds.update_one, {"id": hold_id}, {"$set": {"expires_at": past}})
+    api.portal.call(
+        server.db.cruises.update_one, {"availabilities.holds.id": hold_id},
+        [{"$set": {"availabilities": {"$map": {"input": "$availabilities", "as": "a", "in": {"$mergeObjects": ["$$a", {
+            "holds": {"$map": {"input": {"$ifNull": ["$$a.holds", []]}, "as": "h", "in": {"$cond": [
+                {"$eq": ["$$h.id", hold_id]}, {"$mergeObjects": ["$$h", {"expires_at": past}]}, "$$h"
+            ]}}}
+        }]}}}}}]
+    )
+
+def test_held_seats_are_not_sold_twice_then_paid(api):
+    cruise, availability = open_departure(api, 2)
+    seats = availability["remaining_places"]
+    held = hold(api, cruise, availability, seats)
+    assert held.status_code == 200, held.text
+    assert hold(api, cruise, availability, 1).status_code == 409
+    # Held, not sold: the catalog still shows the seats
+    assert stored_departure(api, cruise, availability)["remaining_places"] == seats
+
+    response = pay(api, cruise, availability, seats, held.json()["id"])
+    assert response.status_code == 202, response.text
+    departure = stored_departure(api, cruise, availability)
+    assert (departure["remaining_places"], departure["holds"]) == (0, [])
+    assert api.get(f"/api/holds/{held.json()['id']}").status_code == 404
+    # A hold is consumed once
+    assert pay(api, cruise, availability, seats, held.json()["id"]).status_code == 409
+
+def test_expired_hold_frees_its_seats_and_cannot_be_paid(api):
+    cruise, availability = open_departure(api, 2)
+    seats = availability["remaining_places"]
+    held = hold(api, cruise, availability, seats).json()
+    expire(api, held["id"])
+
+    assert api.get(f"/api/holds/{held['id']}").status_code == 404
+    assert pay(api, cruise, availability, seats, held["id"]).status_code == 409
+    again = hold(api, cruise, availability, seats)
+    assert again.status_code == 200, again.text
+    # The write that took the new hold pruned the expired one
+    assert [h["id"] for h in stored_departure(api, cruise, availability)["holds"]] == [again.json()["id"]]
+    assert api.delete(f"/api/holds/{again.json()['id']}").status_code == 200
+
+def test_released_hold_gives_its_seats_back(api):
+    cruise, availability = open_departure(api, 2)
+    seats = availability["remaining_places"]
+    held = hold(api, cruise, availability, seats).json()
+    assert api.delete(f"/api/holds/{held['id']}").status_code == 200
+    assert api.delete(f"/api/holds/{held['id']}").status_code == 404
+    assert stored_departure(api, cruise, availability)["holds"] == []
+    assert api.delete(f"/api/holds/{hold(api, cruise, availability, seats).json()['id']}").status_code == 200
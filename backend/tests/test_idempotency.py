@@ -0,0 +1,76 @@
+"""Idempotency-Key on /payments/create: a retry gets the first answer back
+without a second booking, and a key cannot be reused for another payment"""
+from datetime import datetime, timedelta
+
+import server
+
+def payment_request(api, passengers: int = 1) -> dict:
+    cruise, availability = next(
+        (cruise, availability)
+        for cruise in api.get("/api/cruises").json()
+        if cruise["cruise_type"] in ("cabin", "both")
+        for availability in cruise["availabilities"]
+        if (availability.get("remaining_places") or 0) >= passengers and availability["status_label"] != "ANNULÉ"
+    )
+    quote = api.post("/api/quotes", json={
+        "cruise_id": cruise["id"], "selected_date": availability["date_range"], "passengers": passengers
+    }).json()
+    return {
+        "source_id": "cnon:card-nonce-ok",
+        "amount": quote["amount"],
+        "cruise_id": cruise["id"],
+        "cruise_name": cruise["name_fr"],
+        "customer_email": "client@example.fr",
+        "customer_name": "Client Test",
+        "passengers": passengers,
+        "selected_date": availability["date_range"],
+    }
+
+def create(api, body: dict, key: str):
+    return api.post("/api/payments/create", json=body, headers={"Idempotency-Key": key})
+
+def seats_left(api, body: dict) -> int:
+    cruise = api.portal.call(server.db.cruises.find_one, {"id": body["cruise_id"]}, {"_id": 0})
+    return next(a for a in cruise["availabilities"] if a["date_range"] == body["selected_date"])["remaining_places"]
+
+def test_retry_replays_the_first_answer(api):
+    body = payment_request(api)
+    seats = seats_left(api, body)
+    first = create(api, body, "key-replay")
+    # A retry re-tokenizes the card: the nonce is not part of the payment
+    again = create(api, {**body, "source_id": "cnon:another-nonce"}, "key-replay")
+
+    assert (first.status_code, again.status_code) == (202, 202)
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert again.json() == first.json()
+    assert seats_left(api, body) == seats - 1
+    assert api.portal.call(server.db.payments.count_documents, {"idempotency_key": "key-replay"}) == 1
+
+def test_key_reused_for_another_payment(api):
+    body = payment_request(api)
+    assert create(api, body, "key-reused").status_code == 202
+    other = create(api, {**body, "customer_email": "autre@example.fr"}, "key-reused")
+    assert other.status_code == 422
+
+def test_refusal_is_replayed(api):
+    body = {**payment_request(api), "amount": 1}
+    first = create(api, body, "key-refused")
+    again = create(api, body, "key-refused")
+    assert (first.status_code, again.status_code) == (400, 400)
+    assert again.json() == first.json()
+    assert again.headers["Idempotent-Replayed"] == "true"
+
+def test_key_still_in_flight(api):
+    body = payment_request(api)
+    api.portal.call(server.db.payment_idempotency.insert_one, {
+        "key": "key-in-flight",
+        "fingerprint": server.payment_fingerprint(server.CreatePaymentRequest(**body)),
+        "status_code": None,
+        "body": None,
+        "created_at": datetime.utcnow(),
+        "expires_at": datetime.utcnow() + timedelta(hours=1),
+    })
+    assert create(api, body, "key-in-flight").status_code == 409
+
+def test_key_longer_than_square_accepts(api):
+    assert create(api, payment_request(api), "k" * 46).status_code == 400
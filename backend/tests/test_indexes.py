@@ -0,0 +1,22 @@
+"""Index registry: a changed index is reported at startup and only replaced
+on request"""
+import asyncio
+
+import server
+
+def test_changed_index_is_reported_then_rebuilt(fresh_db):
+    async def scenario():
+        # An earlier version created payments.square_payment_id without its options
+        await fresh_db.payments.create_index([("square_payment_id", 1)])
+        conflicts = await server.ensure_indexes()
+        kept = await fresh_db.payments.index_information()
+        rebuilt = await server.rebuild_indexes()
+        again = await server.ensure_indexes()
+        return conflicts, kept, rebuilt, again, await fresh_db.payments.index_information()
+
+    conflicts, kept, rebuilt, again, indexes = asyncio.run(scenario())
+    assert conflicts == ["payments [('square_payment_id', 1)]"]
+    assert not kept["square_payment_id_1"].get("unique")
+    assert rebuilt == {"rebuilt": conflicts}
+    assert again == []
+    assert indexes["square_payment_id_1"]["unique"] is True
@@ -0,0 +1,64 @@
+"""Like toggling: the counter follows the likes array, also under concurrent
+toggles, and a toggle that keeps losing its race gives up"""
+import asyncio
+
+import httpx
+
+import server
+
+def new_post(api) -> dict:
+    response = api.post("/api/posts", json={
+        "author_id": "member-like-0", "author_name": "Zero", "title": "Escale", "content": "Scandola", "category": "general"
+    })
+    assert response.status_code < 400, response.text
+    return response.json()
+
+def stored(api, post_id: str) -> dict:
+    return api.portal.call(server.db.posts.find_one, {"id": post_id}, {"_id": 0, "likes": 1, "likes_count": 1})
+
+def test_like_then_unlike(api):
+    post = new_post(api)
+    like = lambda member_id: api.post(f"/api/posts/{post['id']}/like", params={"member_id": member_id}).json()
+    assert like("member-like-1") == {"likes_count": 1, "liked": True}
+    assert like("member-like-2") == {"likes_count": 2, "liked": True}
+    assert like("member-like-1") == {"likes_count": 1, "liked": False}
+    assert stored(api, post["id"]) == {"likes": ["member-like-2"], "likes_count": 1}
+
+def test_concurrent_toggles_keep_the_counter_exact(api):
+    post = new_post(api)
+    # Members 0-9 like once, members 0-4 toggle twice more
+    members = [f"member-like-{n}" for n in range(10)] + [f"member-like-{n}" for n in range(5)] * 2
+
+    async def burst():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await asyncio.gather(*(
+                client.post(f"/api/posts/{post['id']}/like", params={"member_id": member_id})
+                for member_id in members
+            ))
+
+    responses = api.portal.call(burst)
+    assert {response.status_code for response in responses} <= {200, 409}
+    record = stored(api, post["id"])
+    assert record["likes_count"] == len(record["likes"]) == len(set(record["likes"]))
+    # A member ends up liking the post after an odd number of toggles
+    toggles = {}
+    for member_id, response in zip(members, responses):
+        toggles[member_id] = toggles.get(member_id, 0) + (response.status_code == 200)
+    assert sorted(record["likes"]) == sorted(m for m, count in toggles.items() if count % 2)
+
+def test_toggle_that_never_matches_gives_up(api, monkeypatch):
+    post = new_post(api)
+    attempts = []
+
+    async def always_raced(*args, **kwargs):
+        attempts.append(args[0])
+        return None
+
+    monkeypatch.setattr(server.db.posts, "find_one_and_update", always_raced)
+    response = api.post(f"/api/posts/{post['id']}/like", params={"member_id": "member-like-1"})
+    assert response.status_code == 409
+    assert len(attempts) == 2 * server.LIKE_TOGGLE_ATTEMPTS
+
+def test_like_on_a_missing_post(api):
+    assert api.post("/api/posts/no-such-post/like", params={"member_id": "member-like-1"}).status_code == 404
@@ -0,0 +1,206 @@
+"""The operations server.py issues, run against MemoryClient and, with
+MONGO_URL set, against MongoDB: both backends must give the same answers."""
+import asyncio
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+import server
+from memory_db import MemoryClient
+
+def test_find_filters_sort_and_projection(run):
+    async def scenario(db):
+        await db.items.insert_many([
+            {"n": 1, "tags": ["a", "b"], "kind": "x"},
+            {"n": 2, "tags": ["b"], "kind": "y", "extra": None},
+            {"n": 3, "tags": [], "kind": "x"},
+            {"n": 4, "kind": "z", "name": "Ajaccio"},
+        ])
+        found = lambda query, **options: db.items.find(query, {"_id": 0, "n": 1}, **options).to_list(None)
+        return {
+            "range": await found({"n": {"$gt": 1, "$lte": 3}}, sort=[("n", -1)]),
+            "in": await found({"kind": {"$in": ["x", "z"]}}, sort=[("n", 1)]),
+            "nin": await found({"kind": {"$nin": ["x"]}}, sort=[("n", 1)]),
+            "array": await found({"tags": "b"}, sort=[("n", 1)]),
+            "exists": await found({"extra": {"$exists": True}}),
+            "null": await found({"extra": None}, sort=[("n", 1)]),
+            "or": await found({"$or": [{"n": 1}, {"kind": "z"}]}, sort=[("n", 1)]),
+            "regex": await found({"name": {"$regex": "^aja", "$options": "i"}}),
+            "size": await found({"tags": {"$size": 0}}),
+            "page": await db.items.find({}, {"_id": 0, "n": 1}).sort("n", -1).skip(1).limit(2).to_list(None),
+            "count": await db.items.count_documents({"kind": "x"}),
+            "distinct": sorted(await db.items.distinct("kind")),
+        }
+
+    assert run(scenario) == {
+        "range": [{"n": 3}, {"n": 2}],
+        "in": [{"n": 1}, {"n": 3}, {"n": 4}],
+        "nin": [{"n": 2}, {"n": 4}],
+        "array": [{"n": 1}, {"n": 2}],
+        "exists": [{"n": 2}],
+        "null": [{"n": 1}, {"n": 2}, {"n": 3}, {"n": 4}],
+        "or": [{"n": 1}, {"n": 4}],
+        "regex": [{"n": 4}],
+        "size": [{"n": 3}],
+        "page": [{"n": 3}, {"n": 2}],
+        "count": 2,
+        "distinct": ["x", "y", "z"],
+    }
+
+def test_update_operators(run):
+    async def scenario(db):
+        await db.payments.insert_one({"id": "p1", "events": ["a"], "items": [{"k": 1, "v": 0}, {"k": 2, "v": 0}]})
+        await db.payments.update_one({"id": "p1"}, {"$addToSet": {"events": "a"}})
+        await db.payments.update_one({"id": "p1"}, {"$addToSet": {"events": "b"}, "$inc": {"count": 2}})
+        await db.payments.update_one({"id": "p1", "items.k": 2}, {"$set": {"items.$.v": 5}})
+        await db.payments.update_one({"id": "p1"}, {"$pull": {"items": {"k": 1}}})
+        await db.payments.update_one({"id": "p1"}, {"$push": {"log": {"$each": [1, 2]}}, "$unset": {"missing": ""}})
+        after = await db.payments.find_one_and_update(
+            {"id": "p1", "events": {"$ne": "c"}},
+            {"$addToSet": {"events": "c"}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        claimed_again = await db.payments.update_one({"id": "p1", "events": {"$ne": "c"}}, {"$addToSet": {"events": "c"}})
+        upserted = await db.rollups.update_one(
+            {"day": "2026-06-01", "cruise_id": "c1"},
+            {"$inc": {"bookings": 1}, "$setOnInsert": {"created": True}},
+            upsert=True
+        )
+        await db.rollups.update_one({"day": "2026-06-01", "cruise_id": "c1"}, {"$inc": {"bookings": 1}}, upsert=True)
+        rollups = await db.rollups.find({}, {"_id": 0}).to_list(None)
+        return after, claimed_again.modified_count, upserted.upserted_id is not None, rollups
+
+    after, claimed_again, upserted, rollups = run(scenario)
+    assert after == {"id": "p1", "events": ["a", "b", "c"], "items": [{"k": 2, "v": 5}], "count": 2, "log": [1, 2]}
+    assert claimed_again == 0
+    assert upserted
+    assert rollups == [{"day": "2026-06-01", "cruise_id": "c1", "bookings": 2, "created": True}]
+
+def test_seat_pipelines_match_mongodb(run):
+    """reserve_seats, holds and catalog edits are update pipelines"""
+    hold = {"id": "h1", "seats": 2, "expires_at": datetime.utcnow().replace(microsecond=0) + timedelta(minutes=10)}
+
+    async def scenario(db):
+        await db.cruises.insert_one({"id": "c1", "availabilities": [
+            {"date_range": "d1", "price": 100, "remaining_places": 8, "status_label": "Reste 8 places"},
+            {"date_range": "d2", "price": 100, "remaining_places": None},
+        ]})
+        reserve = lambda date_range, seats: db.cruises.update_one(
+            {"id": "c1", "$expr": server.departure_match_expr(date_range, {"$gte": [server.free_places_expr(), seats]})},
+            server.adjust_places_pipeline(date_range, -seats)
+        )
+        first = (await reserve("d1", 7)).modified_count
+        too_many = (await reserve("d1", 2)).modified_count
+        unset = (await reserve("d2", 3)).modified_count
+        await db.cruises.update_one({"id": "c1"}, server.adjust_places_pipeline("d2", add_hold=hold))
+        await db.cruises.update_one({"id": "c1"}, server.catalog_update_pipeline({"availabilities": [
+            {"date_range": "d1", "price": 120, "remaining_places": 99},
+            {"date_range": "d2", "price": 130, "remaining_places": 99, "status_label": "$price"},
+            {"date_range": "d3", "price": 140, "remaining_places": 8},
+        ], "name_fr": "$literal"}))
+        return (first, too_many, unset), await db.cruises.find_one({"id": "c1"}, {"_id": 0})
+
+    reserved, cruise = run(scenario)
+    assert reserved == (1, 0, 1)
+    assert cruise["name_fr"] == "$literal"
+    d1, d2, d3 = cruise["availabilities"]
+    assert (d1["price"], d1["remaining_places"], d1["status"], d1["status_label"]) == (120, 1, "limited", "Reste 1 place")
+    assert d1["holds"] == []
+    assert (d2["price"], d2["remaining_places"], d2["status_label"]) == (130, 5, "Reste 5 places")
+    assert [h["id"] for h in d2["holds"]] == ["h1"]
+    assert d3 == {"date_range": "d3", "price": 140, "remaining_places": 8}
+
+def test_unique_and_partial_indexes(run):
+    async def scenario(db):
+        await db.payments.create_index([("idempotency_key", 1)], unique=True, partialFilterExpression={
+            "idempotency_key": {"$type": "string"}
+        })
+        await db.payments.insert_many([{"id": 1}, {"id": 2}, {"id": 3, "idempotency_key": "k"}])
+        with pytest.raises(DuplicateKeyError):
+            await db.payments.insert_one({"id": 4, "idempotency_key": "k"})
+        with pytest.raises(BulkWriteError) as error:
+            await db.payments.bulk_write([
+                InsertOne({"id": 5, "idempotency_key": "k2"}),
+                InsertOne({"id": 6, "idempotency_key": "k"}),
+                InsertOne({"id": 7}),
+            ], ordered=False)
+        result = await db.payments.bulk_write([
+            UpdateOne({"id": 1}, {"$set": {"x": 1}}),
+            UpdateOne({"id": 99}, {"$set": {"x": 1}}, upsert=True),
+            DeleteOne({"id": 2}),
+        ])
+        return (
+            error.value.details["nInserted"],
+            (result.matched_count, result.modified_count, result.upserted_count, result.deleted_count),
+            await db.payments.count_documents({})
+        )
+
+    assert run(scenario) == (2, (1, 1, 1, 1), 5)
+
+def test_group_aggregation(run):
+    async def scenario(db):
+        await db.payments.insert_many([
+            {"cruise_id": "c1", "status": "COMPLETED", "amount": 100, "seats": 2, "created_at": datetime(2026, 6, 1, 9)},
+            {"cruise_id": "c1", "status": "COMPLETED", "amount": 50, "created_at": datetime(2026, 6, 1, 18)},
+            {"cruise_id": "c2", "status": "FAILED", "amount": 70, "seats": 1, "created_at": datetime(2026, 6, 2)},
+        ])
+        rows = await db.payments.aggregate([
+            {"$match": {"status": "COMPLETED"}},
+            {"$group": {
+                "_id": {"cruise_id": "$cruise_id", "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}},
+                "bookings": {"$sum": 1},
+                "revenue": {"$sum": "$amount"},
+                "seats": {"$sum": {"$ifNull": ["$seats", 0]}},
+            }},
+            {"$sort": {"revenue": -1}},
+        ]).to_list(None)
+        return rows
+
+    assert run(scenario) == [
+        {"_id": {"cruise_id": "c1", "day": "2026-06-01"}, "bookings": 2, "revenue": 150, "seats": 2}
+    ]
+
+def test_unknown_operators_fail_on_both(run):
+    async def scenario(db):
+        await db.items.insert_one({"n": 1})
+        with pytest.raises(OperationFailure):
+            await db.items.find_one({"n": {"$bogus": 1}})
+        with pytest.raises(OperationFailure):
+            await db.items.update_one({"n": 1}, {"$bogus": {"n": 2}})
+        with pytest.raises(OperationFailure):
+            await db.items.update_one({"n": 1}, [{"$set": {"n": {"$bogus": 1}}}])
+
+    run(scenario)
+
+@pytest.mark.parametrize("operation", [
+    lambda db: db.items.aggregate([{"$lookup": {"from": "other", "as": "x"}}]).to_list(None),
+    lambda db: db.items.aggregate([{"$unwind": {"path": "$tags", "preserveNullAndEmptyArrays": True}}]).to_list(None),
+    lambda db: db.items.update_one({}, {"$push": {"tags": {"$each": [1], "$slice": 1}}}),
+    lambda db: db.items.bulk_write([UpdateOne({}, {"$set": {"tags.$[t]": 1}}, array_filters=[{"t": 0}])]),
+])
+def test_memory_backend_rejects_what_it_does_not_emulate(operation):
+    async def scenario():
+        db = MemoryClient()["unsupported"]
+        await db.items.insert_one({"tags": [0]})
+        with pytest.raises(NotImplementedError):
+            await operation(db)
+
+    asyncio.run(scenario())
+
+def test_memory_backend_rejects_unknown_driver_options():
+    async def scenario():
+        db = MemoryClient()["unsupported"]
+        with pytest.raises(TypeError):
+            await db.items.update_one({}, {"$set": {"tags.$[t]": 1}}, array_filters=[{"t": 0}])
+
+    asyncio.run(scenario())
+
+def test_missing_test_tool_stops_the_server(monkeypatch):
+    """web-booking/backend does not ship memory_db.py or fake_square.py"""
+    monkeypatch.setitem(sys.modules, "memory_db", None)
+    with pytest.raises(RuntimeError, match="STORAGE_BACKEND=memory"):
+        server.import_test_tool("memory_db", "STORAGE_BACKEND=memory")
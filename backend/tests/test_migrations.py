@@ -0,0 +1,58 @@
+"""The migration runner on a fresh database, on one seeded before the runner
+existed, and forced again on a catalog with sold seats"""
+import asyncio
+
+import server
+
+def migrations(db) -> dict:
+    async def scenario():
+        return {
+            doc["_id"]: doc["baselined"]
+            for doc in await db.schema_migrations.find({}, {"baselined": 1}).to_list(None)
+        }
+    return asyncio.run(scenario())
+
+def test_fresh_database_runs_every_migration(fresh_db):
+    asyncio.run(server.run_migrations())
+    assert migrations(fresh_db) == {number: False for number in server.MIGRATIONS}
+
+def test_hand_seeded_database_holds_the_legacy_corrections(fresh_db):
+    asyncio.run(fresh_db.cruises.insert_one({"id": "c1", "name_fr": "Tour de Corse", "availabilities": []}))
+    asyncio.run(server.run_migrations())
+
+    applied = migrations(fresh_db)
+    assert applied[server.SEED_MIGRATION] is True
+    held = [number for number in server.MIGRATIONS if server.MIGRATIONS[number]["legacy"] and number != server.SEED_MIGRATION]
+    assert held and not set(held) & set(applied)
+    # Later migrations are not held back
+    assert all(applied[number] is False for number in server.MIGRATIONS if not server.MIGRATIONS[number]["legacy"])
+    # and a restart still leaves the legacy ones to the admin
+    asyncio.run(server.run_migrations())
+    assert migrations(fresh_db) == applied
+
+    listing = {entry["number"]: entry for entry in asyncio.run(server.get_migrations())}
+    assert [number for number in listing if listing[number]["held"]] == held
+    asyncio.run(server.baseline_migration(held[0]))
+    assert migrations(fresh_db)[held[0]] is True
+
+def test_forced_catalog_migration_keeps_sold_seats(fresh_db):
+    asyncio.run(server.run_migrations())
+
+    async def sell_and_reapply():
+        cruise = await fresh_db.cruises.find_one({"name_fr": "Tour de Corse"}, {"_id": 0})
+        date_range = cruise["availabilities"][0]["date_range"]
+        await fresh_db.cruises.update_one({"id": cruise["id"]}, server.adjust_places_pipeline(date_range, -3))
+        await server.MIGRATIONS[4]["fn"]()
+        cruise = await fresh_db.cruises.find_one({"id": cruise["id"]}, {"_id": 0})
+        return next(a for a in cruise["availabilities"] if a["date_range"] == date_range)
+
+    departure = asyncio.run(sell_and_reapply())
+    assert departure["remaining_places"] == server.CATAMARAN_CAPACITY - 3
+
+def test_2026_departures_reach_either_sardinia_spelling(fresh_db):
+    async def scenario():
+        await fresh_db.cruises.insert_one({"id": "c1", "name_fr": "Sardaigne et Corse du Sud", "availabilities": []})
+        await server.MIGRATIONS[3]["fn"]()
+        return await fresh_db.cruises.find_one({"id": "c1"}, {"_id": 0})
+
+    assert asyncio.run(scenario())["availabilities"]
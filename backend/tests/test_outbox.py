@@ -0,0 +1,120 @@
+"""Payment outbox: declines fail at once and give the seats back, transient
+errors are retried under the same Square idempotency key, and a record is
+only processed by whoever holds its lease"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+def stored(api, payment_id: str) -> dict:
+    return api.portal.call(server.db.payments.find_one, {"id": payment_id}, {"_id": 0})
+
+def seats_left(api, body: dict) -> int:
+    cruise = api.portal.call(server.db.cruises.find_one, {"id": body["cruise_id"]}, {"_id": 0})
+    return next(a for a in cruise["availabilities"] if a["date_range"] == body["selected_date"])["remaining_places"]
+
+def wait_for(api, payment_id: str, condition) -> dict:
+    for _ in range(100):
+        record = stored(api, payment_id)
+        if condition(record):
+            return record
+        time.sleep(0.02)
+    raise AssertionError(f"Payment {payment_id}: {stored(api, payment_id)}")
+
+@pytest.fixture
+def checkout(api):
+    """POST /payments/create for one passenger; returns the request body, the
+    payment id and the free places the departure had before"""
+    def create(source_id: str = "cnon:card-nonce-ok"):
+        cruise, availability = next(
+            (cruise, availability)
+            for cruise in api.get("/api/cruises").json()
+            if cruise["cruise_type"] in ("cabin", "both")
+            for availability in cruise["availabilities"]
+            if (availability.get("remaining_places") or 0) >= 1 and availability["status_label"] != "ANNULÉ"
+        )
+        body = {
+            "source_id": source_id,
+            "amount": api.post("/api/quotes", json={
+                "cruise_id": cruise["id"], "selected_date": availability["date_range"], "passengers": 1
+            }).json()["amount"],
+            "cruise_id": cruise["id"],
+            "cruise_name": cruise["name_fr"],
+            "customer_email": "client@example.fr",
+            "customer_name": "Client Test",
+            "passengers": 1,
+            "selected_date": availability["date_range"],
+        }
+        seats = seats_left(api, body)
+        response = api.post("/api/payments/create", json=body)
+        assert response.status_code == 202, response.text
+        return body, response.json()["payment_id"], seats
+    return create
+
+@pytest.fixture
+def square_down(monkeypatch):
+    """Square unreachable for the next `failures` charges"""
+    calls = []
+    create_payment = server.square_gateway.create_payment
+
+    def outage(failures: int):
+        async def flaky(**kwargs):
+            calls.append(kwargs["idempotency_key"])
+            if len(calls) <= failures:
+                raise ConnectionError("Square unreachable")
+            return await create_payment(**kwargs)
+        monkeypatch.setattr(server.square_gateway, "create_payment", flaky)
+        return calls
+    return outage
+
+def lease_expired(api, payment_id: str, **fields):
+    past = datetime.utcnow() - timedelta(seconds=1)
+    api.portal.call(server.db.payments.update_one, {"id": payment_id}, {"$set": {
+        "locked_until": past, "next_attempt_at": past, **fields
+    }})
+
+def test_declined_card_fails_and_gives_the_seats_back(api, checkout):
+    body, payment_id, seats = checkout("cnon:card-nonce-declined")
+    record = wait_for(api, payment_id, lambda record: record["status"] != "PENDING")
+    assert record["status"] == "FAILED"
+    assert "source_id" not in record
+    assert seats_left(api, body) == seats
+
+def test_transient_error_is_retried_with_the_same_key(api, checkout, square_down):
+    calls = square_down(1)
+    _, payment_id, _ = checkout()
+    record = wait_for(api, payment_id, lambda record: record.get("error_message"))
+    assert (record["status"], record["attempts"]) == ("PENDING", 1)
+    assert record["next_attempt_at"] > datetime.utcnow()
+
+    # What the recovery loop does once the retry is due
+    lease_expired(api, payment_id)
+    api.portal.call(server.payment_pipeline.process, payment_id)
+    record = stored(api, payment_id)
+    assert (record["status"], record["attempts"]) == ("COMPLETED", 2)
+    assert calls == [record["idempotency_key"]] * 2
+
+def test_gives_up_after_the_last_attempt(api, checkout, square_down):
+    square_down(server.PAYMENT_MAX_ATTEMPTS)
+    body, payment_id, seats = checkout()
+    wait_for(api, payment_id, lambda record: record.get("error_message"))
+    assert seats_left(api, body) == seats - 1
+
+    lease_expired(api, payment_id, attempts=server.PAYMENT_MAX_ATTEMPTS - 1)
+    api.portal.call(server.payment_pipeline.process, payment_id)
+    record = stored(api, payment_id)
+    assert record["status"] == "FAILED"
+    assert record["error_message"].startswith("Service de paiement indisponible")
+    assert seats_left(api, body) == seats
+
+def test_record_under_a_live_lease_is_left_alone(api, checkout, square_down):
+    calls = square_down(1)
+    _, payment_id, _ = checkout()
+    wait_for(api, payment_id, lambda record: record.get("error_message"))
+    # Another worker holds the lease until the retry is due
+    assert api.portal.call(server.payment_pipeline.claim, payment_id) is None
+    api.portal.call(server.payment_pipeline.process, payment_id)
+    assert len(calls) == 1
+    assert stored(api, payment_id)["status"] == "PENDING"
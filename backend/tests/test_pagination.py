@@ -0,0 +1,47 @@
+"""Keyset pages: following X-Next-Cursor visits every document once, ties on
+the timestamp included, and the admin cruise list is never cut off"""
+from datetime import datetime
+
+import server
+
+def all_pages(api, path: str, limit: int) -> list:
+    seen, cursor = [], None
+    while True:
+        response = api.get(path, params={"limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        page = response.json()
+        assert len(page) <= limit
+        seen += [doc["id"] for doc in page]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return seen
+
+def test_pages_cover_every_member_once(api):
+    created_at = datetime(2026, 3, 1, 12)
+    # Same timestamp for all: the id breaks the tie
+    api.portal.call(server.db.members.insert_many, [
+        {"id": f"member-page-{n:02d}", "email": f"page{n}@example.fr", "name": f"Page {n}",
+         "is_active": True, "created_at": created_at}
+        for n in range(7)
+    ])
+    expected = [
+        doc["id"] for doc in api.portal.call(
+            lambda: server.db.members.find({}, {"id": 1}).sort([("created_at", -1), ("id", -1)]).to_list(None)
+        )
+    ]
+    assert all_pages(api, "/api/admin/members", 3) == expected
+    assert all_pages(api, "/api/admin/members", 200) == expected
+
+def test_invalid_cursor(api):
+    assert api.get("/api/admin/members", params={"cursor": "not-a-cursor"}).status_code == 400
+
+def test_admin_cruise_list_is_not_capped(api):
+    count = api.portal.call(server.db.cruises.count_documents, {})
+    api.portal.call(server.db.cruises.insert_many, [
+        {"id": f"cruise-page-{n}", "name_fr": f"Croisière {n}", "order": 1000 + n, "is_active": False}
+        for n in range(101 - count)
+    ])
+    try:
+        assert len(api.get("/api/admin/cruises").json()) == 101
+    finally:
+        api.portal.call(server.db.cruises.delete_many, {"id": {"$regex": "^cruise-page-"}})
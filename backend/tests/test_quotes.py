@@ -0,0 +1,96 @@
+"""Server quotes: what they refuse, how much they remember, that payments
+must match them to the cent, and that the web booking page prices the same"""
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import server
+
+WEB_BOOKING_PAGE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "web-booking", "frontend", "index.html"
+)
+
+def departure(api, booking_type: str):
+    return next(
+        (cruise, availability)
+        for cruise in api.get("/api/cruises").json()
+        if cruise["cruise_type"] in (booking_type, "both")
+        for availability in cruise["availabilities"]
+        if (availability.get("remaining_places") or 0) >= 1 and availability["status_label"] != "ANNULÉ"
+    )
+
+def quote(api, cruise, availability, **fields):
+    return api.post("/api/quotes", json={
+        "cruise_id": cruise["id"], "selected_date": availability["date_range"], **fields
+    })
+
+@pytest.mark.parametrize("fields", [
+    {"passengers": 0},
+    {"passengers": server.CATAMARAN_CAPACITY + 1},
+    {"club_card": "platinum"},
+    {"club_card": "passion", "club_card_quantity": 3, "passengers": 2},
+    {"club_card": "passion", "club_card_quantity": -1},
+    {"booking_type": "yacht"},
+])
+def test_invalid_quotes_are_refused_and_not_memoized(api, fields):
+    cruise, availability = departure(api, "cabin")
+    memo = len(server.catalog_cache.quotes)
+    assert quote(api, cruise, availability, **fields).status_code == 400
+    assert len(server.catalog_cache.quotes) == memo
+
+def test_quote_memo_is_bounded(api, monkeypatch):
+    monkeypatch.setattr(server, "QUOTE_MEMO_SIZE", 3)
+    cruise, availability = departure(api, "cabin")
+    for passengers in range(1, 7):
+        assert quote(api, cruise, availability, passengers=passengers).status_code == 200
+    assert len(server.catalog_cache.quotes) <= 3
+
+def test_payment_must_match_the_quote_to_the_cent(api):
+    cruise, availability = departure(api, "cabin")
+    amount = quote(api, cruise, availability, passengers=1).json()["amount"]
+    response = api.post("/api/payments/create", json={
+        "source_id": "cnon:card-nonce-ok",
+        "amount": amount - 1,
+        "cruise_id": cruise["id"],
+        "cruise_name": cruise["name_fr"],
+        "customer_email": "client@example.fr",
+        "customer_name": "Client Test",
+        "passengers": 1,
+        "selected_date": availability["date_range"],
+    })
+    assert response.status_code == 400
+    assert str(amount) in response.json()["detail"]
+
+def web_booking_price(*args) -> dict:
+    """Run bookingPrice() from the web booking page with node"""
+    page = open(WEB_BOOKING_PAGE, encoding="utf-8").read()
+    start = page.index("function bookingPrice(")
+    depth, end = 0, page.index("{", start)
+    for end in range(end, len(page)):
+        depth += {"{": 1, "}": -1}.get(page[end], 0)
+        if depth == 0:
+            break
+    script = f"{page[start:end + 1]}\nconsole.log(JSON.stringify(bookingPrice(...{json.dumps(args)})));"
+    output = subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+@pytest.mark.parametrize("booking_type,passengers,club_card,cards", [
+    ("private", 3, "passion", 2),
+    ("private", 8, "prestige", 8),
+    ("private", 5, "decouverte", 1),
+    ("cabin", 4, "prestige", 3),
+])
+def test_web_booking_page_prices_like_the_server(api, booking_type, passengers, club_card, cards):
+    cruise, availability = departure(api, booking_type)
+    server_quote = quote(
+        api, cruise, availability, booking_type=booking_type, passengers=passengers,
+        club_card=club_card, club_card_quantity=cards
+    ).json()
+    web = web_booking_price(
+        availability["price"], booking_type, passengers, cards, server.CLUB_CARDS[club_card]["discount"]
+    )
+    assert (web["discount"], round(web["total"] * 100)) == (server_quote["discount"], server_quote["amount"])
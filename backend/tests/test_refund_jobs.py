@@ -0,0 +1,131 @@
+"""Departure cancellation: the refund job survives a Square outage and resumes
+where it stopped, without refunding a booking twice, and waits for payments
+still in the outbox"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+def open_departure(api, seats: int):
+    """A departure no other test has booked, so the job holds only ours"""
+    payments = server.db.payments.find({}, {"cruise_id": 1, "selected_date": 1})
+    booked = {(payment["cruise_id"], payment.get("selected_date")) for payment in api.portal.call(payments.to_list, None)}
+    return next(
+        (cruise, availability)
+        for cruise in api.get("/api/cruises").json()
+        if cruise["cruise_type"] in ("cabin", "both")
+        for availability in cruise["availabilities"]
+        if (availability.get("remaining_places") or 0) >= seats and availability["status_label"] != "ANNULÉ"
+        and (cruise["id"], availability["date_range"]) not in booked
+    )
+
+def pay(api, cruise, availability) -> str:
+    amount = api.post("/api/quotes", json={
+        "cruise_id": cruise["id"], "selected_date": availability["date_range"], "passengers": 1
+    }).json()["amount"]
+    response = api.post("/api/payments/create", json={
+        "source_id": "cnon:card-nonce-ok",
+        "amount": amount,
+        "cruise_id": cruise["id"],
+        "cruise_name": cruise["name_fr"],
+        "customer_email": "client@example.fr",
+        "customer_name": "Client Test",
+        "passengers": 1,
+        "selected_date": availability["date_range"],
+    })
+    assert response.status_code == 202, response.text
+    return response.json()["payment_id"]
+
+def stored(api, payment_id: str) -> dict:
+    return api.portal.call(server.db.payments.find_one, {"id": payment_id}, {"_id": 0})
+
+def wait_for(read, condition) -> dict:
+    for _ in range(100):
+        record = read()
+        if condition(record):
+            return record
+        time.sleep(0.02)
+    raise AssertionError(read())
+
+def cancel(api, cruise, availability) -> dict:
+    response = api.post("/api/admin/departures/cancel", json={
+        "cruise_id": cruise["id"], "selected_date": availability["date_range"], "reason": "Météo"
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def job(api, job_id: str) -> dict:
+    return api.get(f"/api/admin/refund-jobs/{job_id}").json()
+
+@pytest.fixture
+def square_refunds_down(monkeypatch):
+    """Square refuses refunds until the returned switch is flipped; records
+    the idempotency key of every call"""
+    calls = []
+    down = [True]
+    refund_payment = server.square_gateway.refund_payment
+
+    async def flaky(**kwargs):
+        calls.append(kwargs["idempotency_key"])
+        if down[0]:
+            raise server.CircuitOpen("Square unavailable")
+        return await refund_payment(**kwargs)
+
+    monkeypatch.setattr(server.square_gateway, "refund_payment", flaky)
+    return calls, down
+
+def test_interrupted_job_resumes_without_refunding_twice(api, square_refunds_down):
+    calls, down = square_refunds_down
+    cruise, availability = open_departure(api, 2)
+    payment_ids = [pay(api, cruise, availability) for _ in range(2)]
+    for payment_id in payment_ids:
+        wait_for(lambda: stored(api, payment_id), lambda record: record["status"] == "COMPLETED")
+
+    job_id = cancel(api, cruise, availability)["id"]
+    interrupted = wait_for(lambda: job(api, job_id), lambda record: record["status"] != "running")
+    assert (interrupted["status"], interrupted["total"], interrupted["refunded"]) == ("interrupted", 2, 0)
+    assert {item["status"] for item in interrupted["items"]} == {"pending"}
+    # The departure is off sale whatever happens to the refunds
+    departure = next(
+        a for a in api.get(f"/api/cruises/{cruise['id']}").json()["availabilities"]
+        if a["date_range"] == availability["date_range"]
+    )
+    assert (departure["status_label"], departure["remaining_places"]) == ("ANNULÉ", 0)
+    # Cancelling again hands back the same job
+    assert cancel(api, cruise, availability)["id"] == job_id
+
+    down[0] = False
+    assert api.post(f"/api/admin/refund-jobs/{job_id}/resume").status_code == 200
+    completed = wait_for(lambda: job(api, job_id), lambda record: record["status"] != "running")
+    assert (completed["status"], completed["refunded"], completed["failed"]) == ("completed", 2, 0)
+    assert all(stored(api, payment_id)["status"] == "REFUNDED" for payment_id in payment_ids)
+    # One refused and one accepted call per booking, both under its item id
+    assert sorted(calls) == sorted(item["id"] for item in completed["items"] for _ in range(2))
+
+    assert api.post(f"/api/admin/refund-jobs/{job_id}/resume").status_code == 409
+
+def test_job_waits_for_a_payment_still_in_the_outbox(api, monkeypatch):
+    async def unreachable(**kwargs):
+        raise ConnectionError("Square unreachable")
+
+    monkeypatch.setattr(server.square_gateway, "create_payment", unreachable)
+    cruise, availability = open_departure(api, 1)
+    payment_id = pay(api, cruise, availability)
+    wait_for(lambda: stored(api, payment_id), lambda record: record.get("error_message"))
+
+    job_id = cancel(api, cruise, availability)["id"]
+    waiting = wait_for(lambda: job(api, job_id), lambda record: record["items"][0]["waiting"])
+    assert waiting["status"] == "running"
+
+    # The retry finds the departure cancelled and fails without charging,
+    # which lets the job finish
+    past = datetime.utcnow() - timedelta(seconds=1)
+    api.portal.call(server.db.payments.update_one, {"id": payment_id}, {"$set": {
+        "locked_until": past, "next_attempt_at": past
+    }})
+    api.portal.call(server.payment_pipeline.process, payment_id)
+    assert stored(api, payment_id)["status"] == "FAILED"
+    done = wait_for(lambda: job(api, job_id), lambda record: record["status"] != "running")
+    assert (done["status"], done["skipped"], done["refunded"]) == ("completed", 1, 0)
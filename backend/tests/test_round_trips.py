@@ -0,0 +1,91 @@
+"""Round trips to the database per request on the hot endpoints, as reported
+by the X-DB-Round-Trips header. A new query on one of these paths must come
+with a raised budget here."""
+import pytest
+
+import server
+
+def round_trips(response) -> int:
+    assert response.status_code < 400, response.text
+    return int(response.headers["X-DB-Round-Trips"])
+
+@pytest.fixture
+def cruise(api):
+    return api.get("/api/cruises").json()[0]
+
+def test_catalog_reads_come_from_the_cache(api, cruise):
+    api.get("/api/cruises")
+    assert round_trips(api.get("/api/cruises")) == 0
+    assert round_trips(api.get("/api/cruises", params={"view": "summary"})) == 0
+    assert round_trips(api.get(f"/api/cruises/{cruise['id']}")) == 0
+
+def test_cruise_update_is_one_write(api, cruise):
+    # The write, then the version bump and the reload of the catalog
+    response = api.put(f"/api/admin/cruises/{cruise['id']}", json={"order": cruise["order"]})
+    assert round_trips(response) == 4
+
+def test_payment_lookup_is_one_query(api, book):
+    payment = book()
+    assert round_trips(api.get(f"/api/payments/{payment['id']}")) == 1
+    assert round_trips(api.get(f"/api/payments/{payment['square_payment_id']}")) == 1
+
+def test_payment_create_round_trips(api, cruise):
+    departure = next(a for a in cruise["availabilities"] if (a.get("remaining_places") or 0) >= 1)
+    quote = api.post("/api/quotes", json={
+        "cruise_id": cruise["id"], "selected_date": departure["date_range"], "passengers": 1
+    })
+    assert round_trips(quote) == 0
+    response = api.post("/api/payments/create", json={
+        "source_id": "cnon:card-nonce-ok",
+        "amount": quote.json()["amount"],
+        "cruise_id": cruise["id"],
+        "cruise_name": cruise["name_fr"],
+        "customer_email": "client@example.fr",
+        "customer_name": "Client Test",
+        "passengers": 1,
+        "selected_date": departure["date_range"],
+    })
+    # The seat reservation, its catalog version bump and the outbox record;
+    # Square is called in the background
+    assert round_trips(response) == 3
+
+def test_messages(api):
+    message = {
+        "sender_id": "member-rt-1", "sender_name": "Un",
+        "receiver_id": "member-rt-2", "receiver_name": "Deux",
+        "content": "Bonjour"
+    }
+    # The message, then the conversation upserted in place
+    assert round_trips(api.post("/api/messages", json=message)) == 2
+    assert round_trips(api.post("/api/messages", json=message)) == 2
+    assert round_trips(api.get("/api/messages/conversations/member-rt-1")) == 1
+    # The page, then the read receipts
+    assert round_trips(api.get("/api/messages/member-rt-2/member-rt-1")) == 2
+
+    conversations = api.get("/api/messages/conversations/member-rt-1").json()
+    assert [(c["id"], c["unread_count"], c["participant_names"]) for c in conversations] == [
+        ("member-rt-1-member-rt-2", 2, ["Un", "Deux"])
+    ]
+
+def test_comment_is_one_write(api):
+    post = api.post("/api/posts", json={
+        "author_id": "member-rt-1", "author_name": "Un", "title": "Escale", "content": "Girolata", "category": "general"
+    })
+    assert post.status_code < 400, post.text
+    comment = api.post(f"/api/posts/{post.json()['id']}/comments", json={
+        "author_id": "member-rt-2", "author_name": "Deux", "content": "Superbe"
+    })
+    # The write, then the posts version bump
+    assert round_trips(comment) == 2
+
+def test_posts_revalidation_reads_the_shared_version(api):
+    first = api.get("/api/posts")
+    # The posts version, then the page
+    assert round_trips(first) == 2
+    revalidated = api.get("/api/posts", headers={"If-None-Match": first.headers["etag"]})
+    assert (revalidated.status_code, round_trips(revalidated)) == (304, 1)
+
+    # Another worker's write, which this one has not polled yet
+    api.portal.call(server.db.versions.update_one, {"_id": "posts"}, {"$inc": {"version": 1}})
+    changed = api.get("/api/posts", headers={"If-None-Match": first.headers["etag"]})
+    assert changed.status_code == 200
@@ -0,0 +1,62 @@
+"""Seat inventory: concurrent bookings never oversell a departure, and a seat
+write re-renders only what shows seats"""
+import asyncio
+import time
+
+import server
+
+def open_departure(api, seats: int):
+    return next(
+        (cruise, availability)
+        for cruise in api.get("/api/cruises").json()
+        for availability in cruise["availabilities"]
+        if (availability.get("remaining_places") or 0) >= seats and availability["status_label"] != "ANNULÉ"
+    )
+
+def test_concurrent_reservations_never_oversell(api):
+    cruise, departure = open_departure(api, 1)
+    free = departure["remaining_places"]
+
+    async def rush():
+        return await asyncio.gather(*(
+            server.reserve_seats(cruise["id"], departure["date_range"], 1) for _ in range(free + 4)
+        ))
+
+    results = api.portal.call(rush)
+    assert results.count(True) == free
+    stored = api.portal.call(server.db.cruises.find_one, {"id": cruise["id"]}, {"_id": 0})
+    left = next(a for a in stored["availabilities"] if a["date_range"] == departure["date_range"])
+    assert (left["remaining_places"], left["status_label"]) == (0, "COMPLET")
+
+    for _ in range(free):
+        api.portal.call(server.release_seats, cruise["id"], departure["date_range"], 1)
+    stored = api.portal.call(server.db.cruises.find_one, {"id": cruise["id"]}, {"_id": 0})
+    assert next(
+        a for a in stored["availabilities"] if a["date_range"] == departure["date_range"]
+    )["remaining_places"] == free
+
+def test_seat_write_rerenders_only_the_cruise_it_touched(api):
+    cruise, departure = open_departure(api, 1)
+    other = next(c for c in api.get("/api/cruises").json() if c["id"] != cruise["id"])
+    etag = lambda path, **params: api.get(path, params=params).headers["etag"]
+    before = {
+        "list": etag("/api/cruises"),
+        "summary": etag("/api/cruises", view="summary"),
+        "detail": etag(f"/api/cruises/{cruise['id']}"),
+        "other": etag(f"/api/cruises/{other['id']}"),
+    }
+    version = server.catalog_cache.version
+    quotes = server.catalog_cache.quotes
+
+    assert api.portal.call(server.reserve_seats, cruise["id"], departure["date_range"], 1)
+    for _ in range(50):
+        if etag("/api/cruises") != before["list"]:
+            break
+        time.sleep(0.02)
+
+    assert etag(f"/api/cruises/{cruise['id']}") != before["detail"]
+    assert etag("/api/cruises", view="summary") == before["summary"]
+    assert etag(f"/api/cruises/{other['id']}") == before["other"]
+    assert server.catalog_cache.version == version
+    assert server.catalog_cache.quotes is quotes
+    api.portal.call(server.release_seats, cruise["id"], departure["date_range"], 1)
@@ -0,0 +1,141 @@
+"""Square webhooks: redelivery, batching and events arriving out of order"""
+import asyncio
+import copy
+import json
+import uuid
+
+import httpx
+
+import fake_square
+import server
+
+def stored(api, payment_id: str) -> dict:
+    return api.portal.call(server.db.payments.find_one, {"id": payment_id}, {"_id": 0})
+
+def remaining_places(api, payment: dict) -> int:
+    cruise = api.get(f"/api/cruises/{payment['cruise_id']}").json()
+    return next(
+        availability["remaining_places"] for availability in cruise["availabilities"]
+        if availability["date_range"] == payment["selected_date"]
+    )
+
+def rollup_totals(api, payment: dict) -> dict:
+    return api.get("/api/admin/analytics", params={"cruise_id": payment["cruise_id"]}).json()["totals"]
+
+def redelivered(event: dict, **refund) -> dict:
+    """Another event about the same refund, e.g. an older status update"""
+    event = copy.deepcopy(event)
+    event["event_id"] = str(uuid.uuid4())
+    event["data"]["object"]["refund"].update(refund)
+    return event
+
+def test_redelivered_refund_is_settled_once(api, book, deliver):
+    payment = book()
+    seats_before = remaining_places(api, payment)
+    totals_before = rollup_totals(api, payment)
+    event = fake_square.make_event("refund.updated", payment["square_payment_id"], payment["amount"])
+
+    assert deliver(event).status_code == 200
+    assert deliver(event).status_code == 200
+
+    record = stored(api, payment["id"])
+    assert record["status"] == "REFUNDED"
+    assert record["square_event_ids"].count(event["event_id"]) == 1
+    assert remaining_places(api, payment) == seats_before + payment["seats"]
+    totals = rollup_totals(api, payment)
+    assert totals["refunds"] == totals_before["refunds"] + 1
+    assert totals["refunded_amount"] == totals_before["refunded_amount"] + payment["amount"]
+
+def test_invalid_signature_is_rejected(api, book):
+    payment = book()
+    event = fake_square.make_event("refund.updated", payment["square_payment_id"], payment["amount"])
+    response = api.post(
+        "/api/webhooks/square", content=json.dumps(event).encode(),
+        headers={"x-square-hmacsha256-signature": "forged"}
+    )
+    assert response.status_code == 403
+    assert stored(api, payment["id"])["status"] == "COMPLETED"
+
+def test_burst_is_written_in_one_batch(api, book, monkeypatch):
+    payment = book(passengers=1)
+    events = [
+        fake_square.make_event("dispute.state.updated", payment["square_payment_id"], payment["amount"], status="INQUIRY")
+        for _ in range(5)
+    ]
+    # The same event twice in one burst is dropped before MongoDB
+    events.append(events[0])
+    writes = []
+    bulk_write = server.db.payments.bulk_write
+
+    async def counted_bulk_write(operations, **options):
+        writes.append(len(operations))
+        return await bulk_write(operations, **options)
+
+    monkeypatch.setattr(server.db.payments, "bulk_write", counted_bulk_write)
+
+    async def burst():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await asyncio.gather(*(
+                client.post("/api/webhooks/square", content=body, headers={
+                    "x-square-hmacsha256-signature": fake_square.sign(
+                        server.SQUARE_WEBHOOK_SIGNATURE_KEY, server.SQUARE_WEBHOOK_URL, body
+                    )
+                })
+                for body in (json.dumps(event).encode() for event in events)
+            ))
+
+    responses = api.portal.call(burst)
+    assert [response.status_code for response in responses] == [200] * len(events)
+    assert len(writes) == 1
+    record = stored(api, payment["id"])
+    assert sorted(record["square_event_ids"]) == sorted({event["event_id"] for event in events})
+
+def test_older_refund_status_does_not_overwrite_a_final_one(api, book, deliver):
+    payment = book()
+    completed = fake_square.make_event("refund.updated", payment["square_payment_id"], payment["amount"])
+    refund_id = completed["data"]["object"]["refund"]["id"]
+
+    assert deliver(completed).status_code == 200
+    seats = remaining_places(api, payment)
+    assert deliver(redelivered(completed, status="PENDING")).status_code == 200
+
+    record = stored(api, payment["id"])
+    assert record["refunds"][refund_id]["status"] == "COMPLETED"
+    assert record["status"] == "REFUNDED"
+    assert remaining_places(api, payment) == seats
+
+def test_refund_event_before_payment_event(api, book, deliver):
+    """A refund notification can overtake the one that completes the charge:
+    it is settled when the payment event arrives"""
+    payment = book()
+    record = {
+        **payment,
+        "id": str(uuid.uuid4()),
+        "square_payment_id": f"sq_{uuid.uuid4().hex[:16]}",
+        "idempotency_key": str(uuid.uuid4()),
+        "status": "PENDING",
+        "rollup_events": [],
+        "square_event_ids": [],
+        # Held by a live outbox worker, so only the webhooks settle it
+        "locked_until": server.datetime.utcnow() + server.timedelta(minutes=10),
+    }
+    for field in ("seats_released", "square_status", "refunds"):
+        record.pop(field, None)
+    api.portal.call(server.db.payments.insert_one, record)
+    totals_before = rollup_totals(api, payment)
+
+    refund = fake_square.make_event("refund.updated", record["square_payment_id"], record["amount"])
+    charge = fake_square.make_event(
+        "payment.updated", record["square_payment_id"], record["amount"], reference_id=record["id"]
+    )
+    assert deliver(refund).status_code == 200
+    assert stored(api, record["id"])["status"] == "PENDING"
+    assert deliver(charge).status_code == 200
+
+    settled = stored(api, record["id"])
+    assert settled["status"] == "REFUNDED"
+    assert settled["seats_released"] is True
+    totals = rollup_totals(api, payment)
+    assert totals["bookings"] == totals_before["bookings"] + 1
+    assert totals["refunds"] == totals_before["refunds"] + 1
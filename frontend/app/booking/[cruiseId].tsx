@@ -13,7 +13,7 @@ import {
 import { useLocalSearchParams, useRouter } from 'expo-router';
 import { Ionicons, MaterialCommunityIcons } from '@expo/vector-icons';
 import { SafeAreaView } from 'react-native-safe-area-context';
-import { cruiseApi, Cruise } from '../../src/services/api';
+import { cruiseApi, holdApi, Cruise } from '../../src/services/api';
 
 // Design tokens
 const COLORS = {
@@ -186,7 +186,7 @@ export default function BookingScreen() {
     return calculatePriceDetails().total;
   };
 
-  const handleProceedToPayment = () => {
+  const handleProceedToPayment = async () => {
     if (!cruise) return;
     
     if (!chosenDate) {
@@ -194,12 +194,31 @@ export default function BookingScreen() {
       return;
     }
     
+    // Hold the seats while the customer fills in the payment form
+    let holdId = '';
+    try {
+      const hold = await holdApi.create({
+        cruise_id: cruise.id,
+        selected_date: chosenDate,
+        booking_type: bookingType,
+        passengers,
+      });
+      holdId = hold.id;
+    } catch (error: any) {
+      if (error?.response?.status === 409) {
+        Alert.alert('Complet', 'Plus assez de places disponibles pour ce départ');
+        return;
+      }
+      console.error('Error creating seat hold:', error);
+    }
+    
     const totalAmount = calculateTotal() * 100; // Convert to cents for Square
     
     router.push({
       pathname: `/payment/${cruise.id}`,
       params: {
         cruiseId: cruise.id,
+        holdId,
         selectedDate: chosenDate,
         bookingType: bookingType,
         passengers: String(passengers),
@@ -176,14 +176,14 @@ export default function ClubScreen() {
   const fetchPosts = useCallback(async () => {
     try {
       setLoading(true);
-      const data = await postApi.getAll(selectedCategory === 'all' ? undefined : selectedCategory);
+      const data = await postApi.getAll(selectedCategory === 'all' ? undefined : selectedCategory, currentUser.id);
       setPosts(data);
     } catch (error) {
       console.error('Error fetching posts:', error);
     } finally {
       setLoading(false);
     }
-  }, [selectedCategory]);
+  }, [selectedCategory, currentUser.id]);
 
   const fetchCaptainInfo = useCallback(async () => {
     try {
@@ -243,8 +243,10 @@ export default function ClubScreen() {
 
   const handleLikePost = async (postId: string) => {
     try {
-      await postApi.toggleLike(postId, currentUser.id);
-      fetchPosts();
+      const { likes_count, liked } = await postApi.toggleLike(postId, currentUser.id);
+      setPosts((current) =>
+        current.map((post) => (post.id === postId ? { ...post, likes_count, liked_by_me: liked } : post))
+      );
     } catch (error) {
       console.error('Error liking post:', error);
     }
@@ -430,11 +432,11 @@ export default function ClubScreen() {
                   onPress={() => handleLikePost(item.id)}
                 >
                   <Ionicons 
-                    name={item.likes.includes(currentUser.id) ? "heart" : "heart-outline"} 
+                    name={item.liked_by_me ? "heart" : "heart-outline"} 
                     size={20} 
-                    color={item.likes.includes(currentUser.id) ? COLORS.error : COLORS.textSecondary} 
+                    color={item.liked_by_me ? COLORS.error : COLORS.textSecondary} 
                   />
-                  <Text style={styles.postActionText}>{item.likes.length}</Text>
+                  <Text style={styles.postActionText}>{item.likes_count}</Text>
                 </TouchableOpacity>
                 <View style={styles.postAction}>
                   <Ionicons name="chatbubble-outline" size={20} color={COLORS.textSecondary} />
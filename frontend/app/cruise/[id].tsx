@@ -91,9 +91,9 @@ export default function CruiseDetailScreen() {
     try {
       const data = await cruiseApi.getById(id);
       setCruise(data);
-      const firstAvailable = data.available_dates.find(d => d.status !== 'full');
+      const firstAvailable = data.availabilities?.find(a => a.status !== 'full');
       if (firstAvailable) {
-        setSelectedDate(firstAvailable.date);
+        setSelectedDate(firstAvailable.date_range);
       }
     } catch (error) {
       console.error('Error loading cruise:', error);
@@ -133,16 +133,6 @@ export default function CruiseDetailScreen() {
     }
   };
 
-  const formatDate = (dateStr: string) => {
-    const date = new Date(dateStr);
-    return date.toLocaleDateString(language === 'fr' ? 'fr-FR' : 'en-US', {
-      weekday: 'long',
-      day: 'numeric',
-      month: 'long',
-      year: 'numeric',
-    });
-  };
-
   const getBoardingCardImage = (cruiseData: Cruise) => {
     // Use the boarding_pass_image from the database if available
     if (cruiseData.boarding_pass_image) {
@@ -179,7 +169,6 @@ export default function CruiseDetailScreen() {
   const subtitle = language === 'fr' ? cruise.subtitle_fr : cruise.subtitle_en;
   const description = language === 'fr' ? cruise.description_fr : cruise.description_en;
   const highlights = language === 'fr' ? cruise.highlights_fr : cruise.highlights_en;
-  const program = language === 'fr' ? cruise.program_fr : cruise.program_en;
   const detailedProgram = language === 'fr' ? cruise.detailed_program_fr : cruise.detailed_program_en;
   const included = language === 'fr' ? getIncludedFR(cruise.duration) : getIncludedEN(cruise.duration);
   const notIncluded = language === 'fr' ? NOT_INCLUDED_FR : NOT_INCLUDED_EN;
@@ -310,10 +299,10 @@ export default function CruiseDetailScreen() {
             </View>
           </View>
 
-          {/* Program - Use detailed if available */}
+          {/* Program */}
           <View style={styles.section}>
             <Text style={styles.sectionTitle}>{t('program')}</Text>
-            {hasDetailedProgram ? (
+            {hasDetailedProgram && (
               // NEW: Detailed program with day, title, description
               detailedProgram.map((dayInfo, index) => (
                 <View key={index} style={styles.programDetailedItem}>
@@ -326,21 +315,13 @@ export default function CruiseDetailScreen() {
                   </View>
                 </View>
               ))
-            ) : (
-              // Legacy: Simple program list
-              program.map((day, index) => (
-                <View key={index} style={styles.programItem}>
-                  <View style={styles.programDot} />
-                  <Text style={styles.programText}>{day}</Text>
-                </View>
-              ))
             )}
           </View>
 
-          {/* Available Dates - Use detailed availabilities if available */}
+          {/* Available Dates */}
           <View style={styles.section}>
             <Text style={styles.sectionTitle}>{t('availableDates')}</Text>
-            {hasDetailedAvailabilities ? (
+            {hasDetailedAvailabilities && (
               // NEW: Detailed availabilities with date range, price, status
               cruise.availabilities!.map((avail, index) => (
                 <TouchableOpacity 
@@ -393,42 +374,6 @@ export default function CruiseDetailScreen() {
                   )}
                 </TouchableOpacity>
               ))
-            ) : (
-              // Legacy: Old available_dates format
-              cruise.available_dates.map((dateInfo, index) => (
-                <TouchableOpacity 
-                  key={index} 
-                  style={[
-                    styles.dateItem,
-                    selectedDate === dateInfo.date && styles.dateItemSelected
-                  ]}
-                  onPress={() => dateInfo.status !== 'full' && setSelectedDate(dateInfo.date)}
-                >
-                  <View
-                    style={[
-                      styles.dateStatus,
-                      { backgroundColor: getAvailabilityColor(dateInfo.status) },
-                    ]}
-                  />
-                  <View style={styles.dateInfo}>
-                    <Text style={[
-                      styles.dateText,
-                      selectedDate === dateInfo.date && styles.dateTextSelected
-                    ]}>
-                      {formatDate(dateInfo.date)}
-                    </Text>
-                    <Text style={styles.dateStatusText}>
-                      {getAvailabilityLabel(dateInfo.status)}
-                      {dateInfo.status === 'limited' &&
-                        dateInfo.remaining_places &&
-                        ` - ${dateInfo.remaining_places} ${t('remainingPlaces')}`}
-                    </Text>
-                  </View>
-                  {selectedDate === dateInfo.date && (
-                    <Ionicons name="checkmark-circle" size={24} color={COLORS.accent} />
-                  )}
-                </TouchableOpacity>
-              ))
             )}
           </View>
 
@@ -58,22 +58,12 @@ export default function CruisesScreen() {
   };
 
   const getNextAvailableDate = (cruise: Cruise) => {
-    const availableDate = cruise.available_dates.find(
-      (d) => d.status === 'available' || d.status === 'limited'
+    const availableDate = cruise.availabilities?.find(
+      (a) => a.status === 'available' || a.status === 'limited'
     );
     return availableDate;
   };
 
-  const formatDate = (dateStr: string) => {
-    const date = new Date(dateStr);
-    const options: Intl.DateTimeFormatOptions = {
-      day: 'numeric',
-      month: 'short',
-      year: 'numeric',
-    };
-    return date.toLocaleDateString(language === 'fr' ? 'fr-FR' : 'en-US', options);
-  };
-
   if (loading) {
     return (
       <SafeAreaView style={styles.container} edges={['top']}>
@@ -178,7 +168,7 @@ export default function CruisesScreen() {
                       ]}
                     />
                     <Text style={styles.availabilityText}>
-                      {formatDate(nextDate.date)}
+                      {nextDate.date_range}
                       {nextDate.status === 'limited' &&
                         nextDate.remaining_places &&
                         ` - ${nextDate.remaining_places} ${t('remainingPlaces')}`}
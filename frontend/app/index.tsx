@@ -15,7 +15,7 @@ import { useRouter } from 'expo-router';
 import { COLORS, SPACING, FONT_SIZES, BORDER_RADIUS, SHADOWS } from '../src/constants/theme';
 import { useTranslation } from '../src/hooks/useTranslation';
 import { useAppStore } from '../src/store/appStore';
-import { cruiseApi, Cruise, seedDatabase } from '../src/services/api';
+import { cruiseApi, CruiseSummary } from '../src/services/api';
 
 const { width } = Dimensions.get('window');
 
@@ -207,7 +207,7 @@ export default function HomeScreen() {
   const { t, language } = useTranslation();
   const router = useRouter();
   const { setLanguage } = useAppStore();
-  const [cruises, setCruises] = useState<Cruise[]>([]);
+  const [cruises, setCruises] = useState<CruiseSummary[]>([]);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -216,10 +216,7 @@ export default function HomeScreen() {
 
   const loadData = async () => {
     try {
-      try {
-        await seedDatabase();
-      } catch (e) {}
-      const data = await cruiseApi.getAll();
+      const data = await cruiseApi.getSummaries();
       setCruises(data);
     } catch (error) {
       console.error('Error loading cruises:', error);
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { 
   View, 
   Text, 
@@ -70,8 +70,27 @@ interface PaymentConfig {
   environment: string;
 }
 
+interface PaymentStatus {
+  status: 'PENDING' | 'COMPLETED' | 'FAILED' | 'REFUNDED';
+  receipt_url?: string;
+  error_message?: string;
+}
+
+// Poll a queued payment until Square has answered (or we give up waiting)
+const waitForPayment = async (backendUrl: string, paymentId: string): Promise<PaymentStatus> => {
+  let payment: PaymentStatus = { status: 'PENDING' };
+  for (let attempt = 0; attempt < 60 && payment.status === 'PENDING'; attempt++) {
+    await new Promise(resolve => setTimeout(resolve, 1000));
+    const response = await fetch(`${backendUrl}/api/payments/${paymentId}`);
+    if (response.ok) {
+      payment = await response.json();
+    }
+  }
+  return payment;
+};
+
 export default function PaymentScreen() {
-  const { cruiseId, bookingType, passengers, selectedDate, amount } = useLocalSearchParams();
+  const { cruiseId, bookingType, passengers, selectedDate, amount, holdId, clubCardId, clubCardQuantity } = useLocalSearchParams();
   const router = useRouter();
   
   const [cruise, setCruise] = useState<Cruise | null>(null);
@@ -92,6 +111,10 @@ export default function PaymentScreen() {
   const [cardCvv, setCardCvv] = useState('');
   
   const [errors, setErrors] = useState<{[key: string]: string}>({});
+  
+  // Reused until the server answers, so a retry after a network failure
+  // cannot charge the card twice
+  const idempotencyKey = useRef<string | null>(null);
 
   useEffect(() => {
     loadData();
@@ -163,9 +186,16 @@ export default function PaymentScreen() {
           : cruise.pricing.cabin_price * parseInt(passengers as string || '2') * 100
       );
       
+      if (!idempotencyKey.current) {
+        idempotencyKey.current = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 14)}`;
+      }
+      
       const response = await fetch(`${backendUrl}/api/payments/create`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: {
+          'Content-Type': 'application/json',
+          'Idempotency-Key': idempotencyKey.current,
+        },
         body: JSON.stringify({
           source_id: testNonce,
           amount: paymentAmount,
@@ -177,17 +207,30 @@ export default function PaymentScreen() {
           passengers: parseInt(passengers as string) || 2,
           selected_date: selectedDate || null,
           booking_type: bookingType || 'cabin',
+          hold_id: holdId || null,
+          club_card: clubCardId || 'none',
+          club_card_quantity: parseInt(clubCardQuantity as string) || 0,
           note: `Téléphone: ${customerPhone}`
         })
       });
       
       const result = await response.json();
+      idempotencyKey.current = null;
+      
+      if (!result.success) {
+        Alert.alert('Erreur de paiement', result.detail || 'Le paiement a échoué');
+        return;
+      }
       
-      if (result.success) {
+      // The charge runs in the background: follow the payment until it is final
+      const payment = await waitForPayment(backendUrl, result.payment_id);
+      if (payment.status === 'COMPLETED') {
         setPaymentSuccess(true);
-        setReceiptUrl(result.receipt_url);
+        setReceiptUrl(payment.receipt_url);
+      } else if (payment.status === 'FAILED') {
+        Alert.alert('Erreur de paiement', payment.error_message || 'Le paiement a échoué');
       } else {
-        Alert.alert('Erreur de paiement', result.detail || 'Le paiement a échoué');
+        Alert.alert('Paiement en cours', 'Votre paiement est en cours de traitement. Vous recevrez une confirmation par email.');
       }
     } catch (error) {
       console.error('Payment error:', error);
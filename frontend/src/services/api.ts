@@ -11,30 +11,40 @@ const getBaseUrl = () => {
 
 const BASE_URL = getBaseUrl();
 
+// Last body and ETag seen for each GET endpoint, replayed on 304 Not Modified
+const etagCache = new Map<string, { etag: string; data: unknown }>();
+
 async function fetchApi<T>(endpoint: string, options?: RequestInit): Promise<T> {
+  const isGet = !options?.method || options.method === 'GET';
+  const cached = isGet ? etagCache.get(endpoint) : undefined;
+
   const response = await fetch(`${BASE_URL}${endpoint}`, {
+    ...options,
     headers: {
       'Content-Type': 'application/json',
+      ...(cached ? { 'If-None-Match': cached.etag } : {}),
       ...options?.headers,
     },
-    ...options,
   });
-  
+
+  if (response.status === 304 && cached) {
+    return cached.data as T;
+  }
+
   if (!response.ok) {
     const errorData = await response.json().catch(() => ({}));
     throw { response: { status: response.status, data: errorData } };
   }
-  
-  return response.json();
-}
 
-// Cruise types
-export interface CruiseDate {
-  date: string;
-  status: 'available' | 'limited' | 'full';
-  remaining_places?: number;
+  const data = await response.json();
+  const etag = response.headers.get('ETag');
+  if (isGet && etag) {
+    etagCache.set(endpoint, { etag, data });
+  }
+  return data;
 }
 
+// Cruise types
 // NEW: Detailed availability with date range, price, and status
 export interface CruiseAvailability {
   date_range: string;  // e.g., "du 23 mai au 6 juin 2026"
@@ -78,16 +88,31 @@ export interface Cruise {
   // NEW: Detailed program day by day
   detailed_program_fr?: ProgramDay[];
   detailed_program_en?: ProgramDay[];
-  // Legacy fields
-  available_dates: CruiseDate[];
-  program_fr: string[];
-  program_en: string[];
   // Boarding pass image from database
   boarding_pass_image?: string;
   is_active: boolean;
   order: number;
+  schema_version: number;
 }
 
+// Slim cruise returned by /cruises?view=summary for list screens
+export type CruiseSummary = Pick<
+  Cruise,
+  | 'id'
+  | 'name_fr'
+  | 'name_en'
+  | 'subtitle_fr'
+  | 'subtitle_en'
+  | 'image_url'
+  | 'destination'
+  | 'cruise_type'
+  | 'duration'
+  | 'departure_port'
+  | 'pricing'
+  | 'is_active'
+  | 'order'
+>;
+
 // Member types
 export interface Member {
   id: string;
@@ -119,20 +144,28 @@ export interface CommunityPost {
   content: string;
   image_url?: string;
   category: 'general' | 'trip_report' | 'tips' | 'meetup';
-  likes: string[];
+  likes_count: number;
+  liked_by_me: boolean;  // For the member passed to getAll / getById
   comments: PostComment[];
   created_at: string;
   updated_at: string;
 }
 
+// Cruise schema this app reads; older versions get the legacy fields too
+const CRUISE_SCHEMA_VERSION = 2;
+
 // API functions
 export const cruiseApi = {
   getAll: async (): Promise<Cruise[]> => {
-    return fetchApi<Cruise[]>('/cruises');
+    return fetchApi<Cruise[]>(`/cruises?schema_version=${CRUISE_SCHEMA_VERSION}`);
+  },
+  
+  getSummaries: async (): Promise<CruiseSummary[]> => {
+    return fetchApi<CruiseSummary[]>('/cruises?view=summary');
   },
   
   getById: async (id: string): Promise<Cruise> => {
-    return fetchApi<Cruise>(`/cruises/${id}`);
+    return fetchApi<Cruise>(`/cruises/${id}?schema_version=${CRUISE_SCHEMA_VERSION}`);
   },
 };
 
@@ -158,13 +191,16 @@ export const memberApi = {
 };
 
 export const postApi = {
-  getAll: async (category?: string): Promise<CommunityPost[]> => {
-    const endpoint = category ? `/posts?category=${category}` : '/posts';
-    return fetchApi<CommunityPost[]>(endpoint);
+  getAll: async (category?: string, memberId?: string): Promise<CommunityPost[]> => {
+    const params = new URLSearchParams();
+    if (category) params.append('category', category);
+    if (memberId) params.append('member_id', memberId);
+    const query = params.toString();
+    return fetchApi<CommunityPost[]>(query ? `/posts?${query}` : '/posts');
   },
   
-  getById: async (id: string): Promise<CommunityPost> => {
-    return fetchApi<CommunityPost>(`/posts/${id}`);
+  getById: async (id: string, memberId?: string): Promise<CommunityPost> => {
+    return fetchApi<CommunityPost>(memberId ? `/posts/${id}?member_id=${memberId}` : `/posts/${id}`);
   },
   
   create: async (data: {
@@ -201,10 +237,33 @@ export const postApi = {
   },
 };
 
-export const seedDatabase = async (): Promise<{ message: string }> => {
-  return fetchApi<{ message: string }>('/seed', {
-    method: 'POST',
-  });
+// Seat holds keep seats reserved while the customer pays
+export interface SeatHold {
+  id: string;
+  cruise_id: string;
+  selected_date: string;
+  booking_type: string;
+  passengers: number;
+  seats: number;
+  expires_at: string;
+}
+
+export const holdApi = {
+  create: async (data: {
+    cruise_id: string;
+    selected_date: string;
+    booking_type: string;
+    passengers: number;
+  }): Promise<SeatHold> => {
+    return fetchApi<SeatHold>('/holds', {
+      method: 'POST',
+      body: JSON.stringify(data),
+    });
+  },
+
+  release: async (holdId: string): Promise<void> => {
+    await fetchApi<void>(`/holds/${holdId}`, { method: 'DELETE' });
+  },
 };
 
 // Direct Messaging types
@@ -1,41 +1,136 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteMany, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import os
+import asyncio
+import base64
+import bisect
+import csv
+import functools
+import gzip
+import hashlib
+import hmac
+import importlib
+import io
+import json
 import logging
+import random
+import re
+import time
 from pathlib import Path
+from contextvars import Context, ContextVar
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
 import uuid
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from enum import Enum
 
+# Optional: brotli-compressed catalog responses when the package is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Square Payment SDK
 from square import Square
 from square.environment import SquareEnvironment
+from square.core.api_error import ApiError
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Round trips to MongoDB made while serving the current request, reported in
+# the X-DB-Round-Trips response header. The counter is a mutable list so that
+# increments made on Motor's executor threads (which run in a copy of the
+# request context) are seen by the request.
+db_round_trips: ContextVar[Optional[list]] = ContextVar("db_round_trips", default=None)
+
+def count_round_trip(command_name: str = None):
+    counter = db_round_trips.get()
+    if counter is not None:
+        counter[0] += 1
+
+class RoundTripCounter(monitoring.CommandListener):
+    def started(self, event):
+        count_round_trip(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# "mongo" (default), or "memory" for the in-process store in memory_db.py,
+# which runs the whole API without a database for tests and benchmarks.
+# memory_db.py and fake_square.py are test tools kept in backend/ only; the
+# web-booking deployment does not ship them.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo').strip()
+
+def import_test_tool(module: str, setting: str):
+    """Import memory_db or fake_square, refusing to start where they are not shipped"""
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise RuntimeError(
+            f"{setting} needs {module}.py, a test tool shipped with backend/ only: "
+            f"run this deployment against MongoDB and Square"
+        ) from None
+
+if STORAGE_BACKEND == 'memory':
+    MemoryClient = import_test_tool("memory_db", "STORAGE_BACKEND=memory").MemoryClient
+    client = MemoryClient(on_command=count_round_trip)
+    db = client[os.environ.get('DB_NAME', 'sognudimare')]
+else:
+    # MongoDB connection
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[RoundTripCounter()])
+    db = client[os.environ['DB_NAME']]
 
 # Square Payment client
 square_client = None
 square_location_id = os.environ.get('SQUARE_LOCATION_ID', '').strip()
+# Per-call HTTP timeout, and how many Square calls may be in flight per worker
+SQUARE_TIMEOUT_SECONDS = float(os.environ.get('SQUARE_TIMEOUT_SECONDS', '15'))
+SQUARE_MAX_CONCURRENCY = int(os.environ.get('SQUARE_MAX_CONCURRENCY', '8'))
+# Quick retries of transient Square errors, and when to stop calling Square at all
+SQUARE_MAX_RETRIES = int(os.environ.get('SQUARE_MAX_RETRIES', '2'))
+SQUARE_BREAKER_THRESHOLD = int(os.environ.get('SQUARE_BREAKER_THRESHOLD', '5'))
+SQUARE_BREAKER_RESET_SECONDS = float(os.environ.get('SQUARE_BREAKER_RESET_SECONDS', '30'))
+
+# "square" (default), "fake" for the in-process fake, or the URL of a fake
+# Square server (python fake_square.py serve) for offline load tests
+PAYMENT_GATEWAY = os.environ.get('PAYMENT_GATEWAY', 'square').strip()
+
+if PAYMENT_GATEWAY == 'fake':
+    FakeSquareClient = import_test_tool("fake_square", "PAYMENT_GATEWAY=fake").FakeSquareClient
 
 def get_square_client():
     global square_client
     if square_client is None:
+        if PAYMENT_GATEWAY == 'fake':
+            square_client = FakeSquareClient.from_env()
+            return square_client
         access_token = os.environ.get('SQUARE_ACCESS_TOKEN', '').strip()
         environment = os.environ.get('SQUARE_ENVIRONMENT', 'sandbox').strip()
         env = SquareEnvironment.SANDBOX if environment == 'sandbox' else SquareEnvironment.PRODUCTION
+        options = {}
+        if PAYMENT_GATEWAY.startswith('http'):
+            # The fake server accepts any token
+            options["base_url"] = PAYMENT_GATEWAY.rstrip('/')
+            access_token = access_token or 'fake'
         square_client = Square(
             token=access_token,
-            environment=env
+            environment=env,
+            timeout=SQUARE_TIMEOUT_SECONDS,
+            **options
         )
     return square_client
 
@@ -51,6 +146,10 @@ class CruiseType(str, Enum):
     PRIVATE = "private"
     BOTH = "both"
 
+class CruiseView(str, Enum):
+    FULL = "full"
+    SUMMARY = "summary"
+
 class AvailabilityStatus(str, Enum):
     AVAILABLE = "available"
     LIMITED = "limited"
@@ -58,6 +157,13 @@ class AvailabilityStatus(str, Enum):
 
 # ============= MODELS =============
 
+# Version 2 dropped available_dates and program_fr/en, which duplicated
+# availabilities and detailed_program_fr/en
+CRUISE_SCHEMA_VERSION = 2
+
+# Seats on the catamaran; a private booking takes all of them
+CATAMARAN_CAPACITY = 8
+
 # Cruise Models - NEW DETAILED STRUCTURE
 class CruiseAvailability(BaseModel):
     """Detailed availability with date range, price, and status"""
@@ -99,17 +205,37 @@ class Cruise(BaseModel):
     # NEW: Detailed program day by day
     detailed_program_fr: List[ProgramDay] = []
     detailed_program_en: List[ProgramDay] = []
-    # Legacy fields (kept for backward compatibility)
-    available_dates: List[dict] = []
-    program_fr: List[str] = []
-    program_en: List[str] = []
     # Boarding pass image for each cruise
     boarding_pass_image: Optional[str] = None
     is_active: bool = True
     order: int = 0
+    schema_version: int = CRUISE_SCHEMA_VERSION
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class LegacyCruise(Cruise):
+    """Cruise as served to app versions that predate schema 2, with the
+    legacy fields rebuilt from availabilities and the detailed programs"""
+    available_dates: List[dict] = []
+    program_fr: List[str] = []
+    program_en: List[str] = []
+
+class CruiseSummary(BaseModel):
+    """Slim cruise representation for list screens (no programs, dates or descriptions)"""
+    id: str
+    name_fr: str
+    name_en: str
+    subtitle_fr: str
+    subtitle_en: str
+    image_url: str
+    destination: str
+    cruise_type: CruiseType
+    duration: str
+    departure_port: str
+    pricing: CruisePricing
+    is_active: bool = True
+    order: int = 0
+
 class CruiseCreate(BaseModel):
     name_fr: str
     name_en: str
@@ -128,6 +254,7 @@ class CruiseCreate(BaseModel):
     availabilities: List[CruiseAvailability] = []
     detailed_program_fr: List[ProgramDay] = []
     detailed_program_en: List[ProgramDay] = []
+    # Legacy fields, still accepted and upcast on create
     available_dates: List[dict] = []
     program_fr: List[str] = []
     program_en: List[str] = []
@@ -152,9 +279,6 @@ class CruiseUpdate(BaseModel):
     availabilities: Optional[List[CruiseAvailability]] = None
     detailed_program_fr: Optional[List[ProgramDay]] = None
     detailed_program_en: Optional[List[ProgramDay]] = None
-    available_dates: Optional[List[dict]] = None
-    program_fr: Optional[List[str]] = None
-    program_en: Optional[List[str]] = None
     is_active: Optional[bool] = None
     order: Optional[int] = None
 
@@ -194,11 +318,25 @@ class CommunityPost(BaseModel):
     content: str
     image_url: Optional[str] = None
     category: str = "general"  # general, trip_report, tips, meetup
-    likes: List[str] = []
+    likes_count: int = 0
+    liked_by_me: bool = False  # For the member_id passed to the request
     comments: List[PostComment] = []
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Who liked a post stays in the stored `likes` array; the API only returns
+# the likes_count kept next to it
+POST_PUBLIC_PROJECTION = {"likes": 0}
+
+def post_document(post: CommunityPost) -> dict:
+    return {**post.dict(exclude={"liked_by_me"}), "likes": []}
+
+async def liked_post_ids(post_ids: List[str], member_id: Optional[str]) -> set:
+    """Which of these posts the member liked, in one query"""
+    if not member_id or not post_ids:
+        return set()
+    return set(await db.posts.distinct("id", {"id": {"$in": post_ids}, "likes": member_id}))
+
 class CommunityPostCreate(BaseModel):
     author_id: str
     author_name: str
@@ -213,56 +351,748 @@ class CommentCreate(BaseModel):
     author_name: str
     content: str
 
+# ============= BACKGROUND TASKS =============
+
+# Strong references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+def spawn(coro) -> asyncio.Task:
+    # Run outside the request's context, so its queries are not counted in
+    # the request's X-DB-Round-Trips
+    task = asyncio.create_task(coro, context=Context())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# ============= SHARED VERSIONS =============
+
+# Writers bump a per-collection counter in db.versions; every worker polls the
+# counters and uses them to invalidate its caches and to build ETags.
+VERSION_SYNC_INTERVAL = float(os.environ.get('VERSION_SYNC_INTERVAL', '2'))
+
+shared_versions: Dict[str, dict] = {}
+
+async def get_shared_version(name: str) -> dict:
+    doc = await db.versions.find_one({"_id": name})
+    return doc or {"_id": name, "version": 0, "updated_at": None}
+
+async def bump_version(name: str, key: Optional[str] = None):
+    """Call after any write to a versioned collection (cruises, posts, seats);
+    `key` also counts the write against one document, e.g. a cruise id"""
+    increments = {"version": 1}
+    if key:
+        increments[f"keys.{key}"] = 1
+    shared_versions[name] = await db.versions.find_one_and_update(
+        {"_id": name},
+        {"$inc": increments, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+async def sync_shared_versions():
+    docs = await db.versions.find().to_list(None)
+    for doc in docs:
+        shared_versions[doc["_id"]] = doc
+    await catalog_cache.sync()
+
+async def version_sync_loop():
+    while True:
+        await asyncio.sleep(VERSION_SYNC_INTERVAL)
+        try:
+            await sync_shared_versions()
+        except Exception as e:
+            logger.warning(f"Version sync failed: {str(e)}")
+
+# ============= CONDITIONAL GET =============
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+def validator_headers(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.replace(microsecond=0, tzinfo=timezone.utc), usegmt=True
+        )
+    return headers
+
+def not_modified_response(request: Request, etag: str, last_modified: Optional[datetime]) -> Optional[Response]:
+    """Return a 304 if the client's cached copy matches, None otherwise"""
+    headers = validator_headers(etag, last_modified)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match uses weak comparison, so ignore any W/ prefix
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in candidates or etag in candidates:
+            return Response(status_code=304, headers=headers)
+        return None
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return None
+        if since.tzinfo:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        if last_modified.replace(microsecond=0) <= since:
+            return Response(status_code=304, headers=headers)
+    return None
+
+def set_validators(response: Response, etag: str, last_modified: Optional[datetime]):
+    response.headers.update(validator_headers(etag, last_modified))
+
+# ============= PRE-RENDERED RESPONSES =============
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 512
+# Best compression for the bodies rendered at startup; bodies re-rendered
+# while serving, e.g. after a booking, favour speed
+GZIP_LEVEL = 9
+GZIP_LEVEL_FAST = 5
+BROTLI_QUALITY_FAST = 5
+
+def negotiate_encoding(accept_encoding: str, available) -> str:
+    """Pick the best precompressed variant the client accepts"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    for coding in ("br", "gzip"):
+        if coding in available and accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return "identity"
+
+class RenderedBody:
+    """JSON body serialized once, with precompressed variants and validators"""
+
+    def __init__(self, content, last_modified: Optional[datetime], fast: bool = False):
+        # Same encoding as FastAPI's JSONResponse
+        body = json.dumps(
+            jsonable_encoder(content), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.last_modified = last_modified
+        self.encoded = {"identity": body}
+        if len(body) >= COMPRESS_MIN_SIZE:
+            self.encoded["gzip"] = gzip.compress(body, compresslevel=GZIP_LEVEL_FAST if fast else GZIP_LEVEL, mtime=0)
+            if brotli is not None:
+                self.encoded["br"] = brotli.compress(body, quality=BROTLI_QUALITY_FAST) if fast else brotli.compress(body)
+
+    def response(self, request: Request) -> Response:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""), self.encoded)
+        # Each encoding is a different byte sequence, so it gets its own strong ETag
+        etag = self.etag if encoding == "identity" else f'{self.etag[:-1]}-{encoding}"'
+        not_modified = not_modified_response(request, etag, self.last_modified)
+        if not_modified:
+            not_modified.headers["Vary"] = "Accept-Encoding"
+            return not_modified
+        
+        headers = validator_headers(etag, self.last_modified)
+        headers["Vary"] = "Accept-Encoding"
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=self.encoded[encoding], media_type="application/json", headers=headers)
+
+# ============= DEPARTURE INDEX =============
+
+FRENCH_MONTHS = {
+    "janvier": 1, "fevrier": 2, "février": 2, "mars": 3, "avril": 4, "mai": 5, "juin": 6,
+    "juillet": 7, "aout": 8, "août": 8, "septembre": 9, "octobre": 10, "novembre": 11,
+    "decembre": 12, "décembre": 12,
+}
+
+# "du 23 mai au 6 juin 2026", "du 1er au 8 août 2026", "du 26 décembre 2026 au 2 janvier 2027"
+DATE_RANGE_PATTERN = re.compile(
+    r"^\s*du\s+(\d{1,2})(?:er)?(?:\s+([^\W\d_]+))?(?:\s+(\d{4}))?"
+    r"\s+au\s+(\d{1,2})(?:er)?\s+([^\W\d_]+)\s+(\d{4})\s*$",
+    re.IGNORECASE
+)
+
+def parse_date_range(date_range: str) -> Optional[tuple]:
+    """Parse a French availability label into (start_date, end_date), None if unrecognised"""
+    match = DATE_RANGE_PATTERN.match(date_range)
+    if not match:
+        return None
+    start_day, start_month_name, start_year, end_day, end_month_name, end_year = match.groups()
+    end_month = FRENCH_MONTHS.get(end_month_name.lower())
+    start_month = FRENCH_MONTHS.get(start_month_name.lower()) if start_month_name else end_month
+    if not start_month or not end_month:
+        return None
+    if start_year:
+        year = int(start_year)
+    else:
+        # "du 28 décembre au 4 janvier 2027" starts the year before
+        year = int(end_year) - 1 if start_month > end_month else int(end_year)
+    try:
+        return date(year, start_month, int(start_day)), date(int(end_year), end_month, int(end_day))
+    except ValueError:
+        return None
+
+class Departure(BaseModel):
+    """One dated departure of a cruise, as stored in the departure index"""
+    cruise_id: str
+    cruise_name_fr: str
+    cruise_name_en: str
+    destination: str
+    cruise_type: CruiseType
+    departure_port: str
+    date_range: str
+    start_date: date
+    end_date: date
+    price: float
+    status: AvailabilityStatus
+    remaining_places: Optional[int] = None
+    status_label: Optional[str] = None
+
+def cruise_type_matches(offered: CruiseType, wanted: CruiseType) -> bool:
+    """A cruise sold as BOTH matches cabin and private searches"""
+    return offered == wanted or (offered == CruiseType.BOTH and wanted != CruiseType.BOTH)
+
+class DepartureIndex:
+    """Departures of active cruises sorted by start date for window searches"""
+
+    def __init__(self, cruises: List[Cruise]):
+        departures = []
+        for cruise in cruises:
+            if not cruise.is_active:
+                continue
+            for availability in cruise.availabilities:
+                dates = parse_date_range(availability.date_range)
+                if not dates:
+                    logger.warning(f"Unparseable date range for {cruise.name_fr}: {availability.date_range!r}")
+                    continue
+                departures.append(Departure(
+                    cruise_id=cruise.id,
+                    cruise_name_fr=cruise.name_fr,
+                    cruise_name_en=cruise.name_en,
+                    destination=cruise.destination,
+                    cruise_type=cruise.cruise_type,
+                    departure_port=cruise.departure_port,
+                    date_range=availability.date_range,
+                    start_date=dates[0],
+                    end_date=dates[1],
+                    price=availability.price,
+                    status=availability.status,
+                    remaining_places=availability.remaining_places,
+                    status_label=availability.status_label
+                ))
+        departures.sort(key=lambda departure: (departure.start_date, departure.price))
+        self.departures = departures
+        self.start_dates = [departure.start_date for departure in departures]
+
+    def search(
+        self,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        min_seats: Optional[int] = None,
+        max_price: Optional[float] = None,
+        destination: Optional[str] = None,
+        cruise_type: Optional[CruiseType] = None,
+        limit: int = 50
+    ) -> List[Departure]:
+        # Binary search narrows to departures starting inside the window
+        lo = bisect.bisect_left(self.start_dates, date_from) if date_from else 0
+        hi = bisect.bisect_right(self.start_dates, date_to) if date_to else len(self.departures)
+        results = []
+        for departure in self.departures[lo:hi]:
+            if date_to and departure.end_date > date_to:
+                continue
+            if departure.status == AvailabilityStatus.FULL:
+                continue
+            if min_seats and departure.remaining_places is not None and departure.remaining_places < min_seats:
+                continue
+            if max_price is not None and departure.price > max_price:
+                continue
+            if destination and departure.destination != destination:
+                continue
+            if cruise_type and not cruise_type_matches(departure.cruise_type, cruise_type):
+                continue
+            results.append(departure)
+            if len(results) >= limit:
+                break
+        return results
+
+# ============= CRUISE SCHEMA =============
+
+LEGACY_CRUISE_FIELDS = ("available_dates", "program_fr", "program_en")
+CRUISE_COMPACTION_BATCH = 100
+
+FRENCH_MONTH_NAMES = [
+    "janvier", "février", "mars", "avril", "mai", "juin",
+    "juillet", "août", "septembre", "octobre", "novembre", "décembre",
+]
+
+# "Jour 1: Ajaccio - Îles Sanguinaires", "JOUR 1 : AJACCIO & ANSE DE CACALU", "Day 1: ..."
+LEGACY_PROGRAM_PATTERN = re.compile(r"^\s*(?:jour|day)\s+(\d+)\s*:\s*(.*)$", re.IGNORECASE)
+
+def format_date_range(start: date, end: date) -> str:
+    """French availability label that parse_date_range reads back ("du 2 au 9 mai 2026")"""
+    def day(d: date) -> str:
+        return "1er" if d.day == 1 else str(d.day)
+    if start.year != end.year:
+        start_label = f"{day(start)} {FRENCH_MONTH_NAMES[start.month - 1]} {start.year}"
+    elif start.month != end.month:
+        start_label = f"{day(start)} {FRENCH_MONTH_NAMES[start.month - 1]}"
+    else:
+        start_label = day(start)
+    return f"du {start_label} au {day(end)} {FRENCH_MONTH_NAMES[end.month - 1]} {end.year}"
+
+def cruise_length_days(duration: str) -> int:
+    """Nights aboard: 7 for "8 jours / 7 nuits", 14 for "2 semaines", else one week"""
+    nights = re.search(r"(\d+)\s*nuits?", duration, re.IGNORECASE)
+    if nights:
+        return int(nights.group(1))
+    weeks = re.search(r"(\d+)\s*semaines?", duration, re.IGNORECASE)
+    return 7 * int(weeks.group(1)) if weeks else 7
+
+def upcast_program(program: List[str]) -> List[dict]:
+    days = []
+    for index, line in enumerate(program):
+        match = LEGACY_PROGRAM_PATTERN.match(line)
+        if match:
+            days.append({"day": int(match.group(1)), "title": match.group(2).strip(), "description": ""})
+        else:
+            days.append({"day": index + 1, "title": line.strip(), "description": ""})
+    return days
+
+def upcast_available_dates(available_dates: List[dict], duration: str, pricing: dict) -> List[dict]:
+    """Legacy {date, status} entries as availabilities priced at the cabin price"""
+    price = pricing.get("cabin_price") or (pricing.get("private_price") or 0) / CATAMARAN_CAPACITY
+    if not price:
+        return []
+    length = timedelta(days=cruise_length_days(duration))
+    availabilities = []
+    for entry in available_dates:
+        try:
+            start = date.fromisoformat(entry["date"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        availabilities.append({
+            "date_range": format_date_range(start, start + length),
+            "price": price,
+            "status": entry.get("status", AvailabilityStatus.AVAILABLE.value),
+            "remaining_places": entry.get("remaining_places")
+        })
+    return availabilities
+
+def upcast_cruise(doc: dict) -> dict:
+    """Bring a cruise document to CRUISE_SCHEMA_VERSION. Legacy fields only
+    fill the new ones when those are empty, and are dropped either way."""
+    if doc.get("schema_version", 1) >= CRUISE_SCHEMA_VERSION:
+        return doc
+    doc = dict(doc)
+    available_dates = doc.pop("available_dates", None) or []
+    if available_dates and not doc.get("availabilities"):
+        doc["availabilities"] = upcast_available_dates(
+            available_dates, doc.get("duration") or "", doc.get("pricing") or {}
+        )
+    for language in ("fr", "en"):
+        program = doc.pop(f"program_{language}", None) or []
+        if program and not doc.get(f"detailed_program_{language}"):
+            doc[f"detailed_program_{language}"] = upcast_program(program)
+    doc["schema_version"] = CRUISE_SCHEMA_VERSION
+    return doc
+
+def legacy_cruise(cruise: Cruise) -> LegacyCruise:
+    """Downcast for clients that still read available_dates and program_fr/en"""
+    available_dates = []
+    for availability in cruise.availabilities:
+        dates = parse_date_range(availability.date_range)
+        if not dates:
+            continue
+        entry = {"date": dates[0].isoformat(), "status": availability.status.value}
+        if availability.remaining_places is not None:
+            entry["remaining_places"] = availability.remaining_places
+        available_dates.append(entry)
+    return LegacyCruise(
+        **{**cruise.dict(), "schema_version": 1},
+        available_dates=available_dates,
+        program_fr=[f"Jour {day.day}: {day.title}" for day in cruise.detailed_program_fr],
+        program_en=[f"Day {day.day}: {day.title}" for day in cruise.detailed_program_en]
+    )
+
+async def compact_cruises() -> dict:
+    """Rewrite cruises stored below CRUISE_SCHEMA_VERSION and drop their legacy fields"""
+    query = {"schema_version": {"$not": {"$gte": CRUISE_SCHEMA_VERSION}}}
+    scanned = compacted = 0
+    operations = []
+    async for doc in db.cruises.find(query, {"_id": 0}):
+        scanned += 1
+        upcast = upcast_cruise(doc)
+        # Only the fields the upcaster rewrote are set, so seat updates to
+        # availabilities running meanwhile are kept; an admin edit in between
+        # changes updated_at and the document is left for the next run.
+        guard = {"id": doc["id"], "updated_at": doc.get("updated_at"), **query}
+        fields = {"schema_version": CRUISE_SCHEMA_VERSION}
+        for key in ("detailed_program_fr", "detailed_program_en"):
+            if upcast.get(key) != doc.get(key):
+                fields[key] = upcast[key]
+        if upcast.get("availabilities") != doc.get("availabilities"):
+            fields["availabilities"] = upcast["availabilities"]
+            guard["availabilities.0"] = {"$exists": False}
+        operations.append(UpdateOne(guard, {
+            "$set": fields,
+            "$unset": {field: "" for field in LEGACY_CRUISE_FIELDS}
+        }))
+        if len(operations) >= CRUISE_COMPACTION_BATCH:
+            compacted += (await db.cruises.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        compacted += (await db.cruises.bulk_write(operations, ordered=False)).modified_count
+    if compacted:
+        await invalidate_catalog()
+    return {"scanned": scanned, "compacted": compacted}
+
+async def compact_cruises_in_background():
+    try:
+        result = await compact_cruises()
+    except Exception as e:
+        logger.warning(f"Cruise compaction failed: {str(e)}")
+        return
+    if result["compacted"]:
+        logger.info(f"Compacted {result['compacted']} cruises to schema {CRUISE_SCHEMA_VERSION}")
+
+# ============= CATALOG CACHE =============
+
+class CatalogCache:
+    """In-memory cruise catalog, reloaded when the shared version changes.
+    Seat writes bump the separate `seats` version, keyed by cruise: only
+    those cruises are read again and only the bodies that show seats are
+    re-rendered."""
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        # Time of the last catalog write, deletes included
+        self.changed_at: Optional[datetime] = None
+        self.seats_version: Optional[int] = None
+        self.seats_changed_at: Optional[datetime] = None
+        # Seat writes counted per cruise id, as of the cruises we hold
+        self.seat_versions: Dict[str, int] = {}
+        self.cruises: List[Cruise] = []
+        self.summaries: List[CruiseSummary] = []
+        self.legacy_cruises: List[LegacyCruise] = []
+        self.by_id: Dict[str, Cruise] = {}
+        self.list_bodies: Dict[tuple, RenderedBody] = {}
+        self.detail_bodies: Dict[str, RenderedBody] = {}
+        self.departures = DepartureIndex([])
+        self.quotes: OrderedDict = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    async def reload(self):
+        async with self._lock:
+            await self._load()
+
+    async def _load(self):
+        # Read the versions before the documents: a write landing in between
+        # leaves us with newer data and an older version, so the next sync
+        # simply reloads again.
+        versions = {
+            doc["_id"]: doc
+            for doc in await db.versions.find({"_id": {"$in": ["cruises", "seats"]}}).to_list(None)
+        }
+        shared = versions.get("cruises", {})
+        seats = versions.get("seats", {})
+        docs = await db.cruises.find().sort("order", 1).to_list(None)
+        # Only the startup render takes the time to compress at best
+        fast = self.version is not None
+        self.changed_at = shared.get("updated_at")
+        self._set_seats_version(seats)
+        # Documents not compacted yet are upcast here, on read
+        self.cruises = [Cruise(**upcast_cruise(doc)) for doc in docs]
+        # Summaries are cut from the same documents rather than a second
+        # projected query, so both views always come from one snapshot.
+        self.summaries = [CruiseSummary(**cruise.dict()) for cruise in self.cruises]
+        self.legacy_cruises = [legacy_cruise(cruise) for cruise in self.cruises]
+        self.by_id = {cruise.id: cruise for cruise in self.cruises}
+        # Render every response body now so requests only pick bytes
+        self.list_bodies = {
+            (active_only, view, legacy): self._render_list(active_only, view, legacy, fast)
+            for active_only in (True, False)
+            for view in CruiseView
+            for legacy in (False, True)
+        }
+        self.detail_bodies = {}
+        for cruise, legacy in zip(self.cruises, self.legacy_cruises):
+            self._render_detail(cruise, legacy, fast)
+        self.departures = DepartureIndex(self.cruises)
+        # Quotes are memoized per catalog snapshot
+        self.quotes = OrderedDict()
+        self.version = shared.get("version", 0)
+
+    async def _load_seats(self, seats: dict):
+        """Read again the cruises whose seats changed and re-render the bodies
+        that show seats; summaries and quotes do not depend on them"""
+        changed = [
+            cruise_id for cruise_id, count in seats.get("keys", {}).items()
+            if cruise_id in self.by_id and self.seat_versions.get(cruise_id) != count
+        ]
+        self._set_seats_version(seats)
+        if changed:
+            docs = await db.cruises.find({"id": {"$in": changed}}).to_list(None)
+            fresh = {doc["id"]: Cruise(**upcast_cruise(doc)) for doc in docs}
+            for position, cruise in enumerate(self.cruises):
+                if cruise.id in fresh:
+                    cruise = self.cruises[position] = self.by_id[cruise.id] = fresh[cruise.id]
+                    self.legacy_cruises[position] = legacy_cruise(cruise)
+                    self._render_detail(cruise, self.legacy_cruises[position], fast=True)
+        for active_only in (True, False):
+            for legacy in (False, True):
+                self.list_bodies[(active_only, CruiseView.FULL, legacy)] = self._render_list(
+                    active_only, CruiseView.FULL, legacy, fast=True
+                )
+        self.departures = DepartureIndex(self.cruises)
+
+    def _set_seats_version(self, seats: dict):
+        self.seats_version = seats.get("version", 0)
+        self.seats_changed_at = seats.get("updated_at")
+        self.seat_versions = dict(seats.get("keys", {}))
+
+    def _last_modified(self, *times: Optional[datetime]) -> Optional[datetime]:
+        return max((time for time in times if time), default=None)
+
+    def _render_detail(self, cruise: Cruise, legacy: LegacyCruise, fast: bool):
+        # A seat write leaves updated_at alone, so a cruise with seat writes
+        # is dated by the latest one at most
+        seats_changed_at = self.seats_changed_at if cruise.id in self.seat_versions else None
+        last_modified = self._last_modified(cruise.updated_at, seats_changed_at)
+        self.detail_bodies[(cruise.id, False)] = RenderedBody(cruise, last_modified, fast)
+        self.detail_bodies[(cruise.id, True)] = RenderedBody(legacy, last_modified, fast)
+
+    def _select(self, active_only: bool, view: CruiseView = CruiseView.FULL, legacy: bool = False) -> list:
+        if view == CruiseView.SUMMARY:
+            cruises = self.summaries
+        else:
+            cruises = self.legacy_cruises if legacy else self.cruises
+        if active_only:
+            return [cruise for cruise in cruises if cruise.is_active]
+        return list(cruises)
+
+    def _render_list(self, active_only: bool, view: CruiseView, legacy: bool, fast: bool) -> RenderedBody:
+        cruises = self._select(active_only, view, legacy)
+        # A list also changes when a cruise leaves it, which no remaining
+        # updated_at records, so it is dated by the catalog version bump
+        last_modified = self.changed_at or max(
+            (self.by_id[cruise.id].updated_at for cruise in cruises), default=None
+        )
+        if view == CruiseView.FULL:
+            # Full lists show seats
+            last_modified = self._last_modified(last_modified, self.seats_changed_at)
+        return RenderedBody(cruises, last_modified, fast)
+
+    async def ensure_loaded(self):
+        if self.version is None:
+            await self.reload()
+
+    async def get_all(self, active_only: bool = True, view: CruiseView = CruiseView.FULL) -> list:
+        await self.ensure_loaded()
+        return self._select(active_only, view)
+
+    async def get(self, cruise_id: str) -> Optional[Cruise]:
+        await self.ensure_loaded()
+        return self.by_id.get(cruise_id)
+
+    async def get_list_body(
+        self,
+        active_only: bool = True,
+        view: CruiseView = CruiseView.FULL,
+        legacy: bool = False
+    ) -> RenderedBody:
+        await self.ensure_loaded()
+        return self.list_bodies[(active_only, view, legacy)]
+
+    async def get_detail_body(self, cruise_id: str, legacy: bool = False) -> Optional[RenderedBody]:
+        await self.ensure_loaded()
+        return self.detail_bodies.get((cruise_id, legacy))
+
+    async def get_departures(self) -> DepartureIndex:
+        await self.ensure_loaded()
+        return self.departures
+
+    async def quote(self, quote_request: "QuoteRequest") -> "Quote":
+        await self.ensure_loaded()
+        key = (
+            quote_request.cruise_id, quote_request.selected_date, quote_request.booking_type,
+            quote_request.passengers, quote_request.club_card, quote_request.club_card_quantity
+        )
+        quote = self.quotes.get(key)
+        if quote is not None:
+            self.quotes.move_to_end(key)
+            return quote
+        cruise = self.by_id.get(quote_request.cruise_id)
+        if not cruise:
+            raise HTTPException(status_code=404, detail="Cruise not found")
+        # Invalid requests raise here, so only valid keys are kept
+        quote = self.quotes[key] = compute_quote(cruise, quote_request)
+        if len(self.quotes) > QUOTE_MEMO_SIZE:
+            self.quotes.popitem(last=False)
+        return quote
+
+    async def sync(self):
+        """Reload if the catalog changed since our last load"""
+        # Checked under the lock so a burst of syncs collapses into one reload
+        async with self._lock:
+            version = shared_versions.get("cruises", {}).get("version", 0)
+            seats = shared_versions.get("seats", {})
+            if version != self.version:
+                await self._load()
+            elif seats.get("version", 0) != self.seats_version:
+                await self._load_seats(seats)
+
+catalog_cache = CatalogCache()
+
+async def invalidate_catalog():
+    """Call after any write to db.cruises"""
+    await bump_version("cruises")
+    await catalog_cache.reload()
+
+async def touch_catalog(cruise_id: str):
+    """Call after a seat inventory write: every worker re-reads that cruise,
+    off the request path"""
+    await bump_version("seats", cruise_id)
+    spawn(catalog_cache.sync())
+
 # ============= CRUISE ROUTES =============
 
 @api_router.get("/")
 async def root():
     return {"message": "Bienvenue sur l'API Sognudimare!"}
 
-@api_router.get("/cruises", response_model=List[Cruise])
-async def get_cruises(active_only: bool = True):
-    query = {"is_active": True} if active_only else {}
-    cruises = await db.cruises.find(query).sort("order", 1).to_list(100)
-    return [Cruise(**cruise) for cruise in cruises]
+@api_router.get("/cruises", response_model=Union[List[Cruise], List[LegacyCruise], List[CruiseSummary]])
+async def get_cruises(
+    request: Request,
+    active_only: bool = True,
+    view: CruiseView = CruiseView.FULL,
+    schema_version: int = Query(1, ge=1, le=CRUISE_SCHEMA_VERSION)
+):
+    """List cruises; view=summary returns only the fields list screens display.
+    Without schema_version=2 the legacy fields are included for older apps."""
+    body = await catalog_cache.get_list_body(active_only, view, schema_version < CRUISE_SCHEMA_VERSION)
+    return body.response(request)
 
-@api_router.get("/cruises/{cruise_id}", response_model=Cruise)
-async def get_cruise(cruise_id: str):
-    cruise = await db.cruises.find_one({"id": cruise_id})
-    if not cruise:
+@api_router.get("/cruises/{cruise_id}", response_model=Union[Cruise, LegacyCruise])
+async def get_cruise(
+    cruise_id: str,
+    request: Request,
+    schema_version: int = Query(1, ge=1, le=CRUISE_SCHEMA_VERSION)
+):
+    body = await catalog_cache.get_detail_body(cruise_id, schema_version < CRUISE_SCHEMA_VERSION)
+    if not body:
         raise HTTPException(status_code=404, detail="Cruise not found")
-    return Cruise(**cruise)
+    return body.response(request)
 
 @api_router.post("/cruises", response_model=Cruise)
 async def create_cruise(cruise_data: CruiseCreate):
-    cruise = Cruise(**cruise_data.dict())
+    cruise = Cruise(**upcast_cruise(cruise_data.dict()))
     await db.cruises.insert_one(cruise.dict())
+    await invalidate_catalog()
     return cruise
 
 @api_router.put("/cruises/{cruise_id}", response_model=Cruise)
 async def update_cruise(cruise_id: str, cruise_data: CruiseUpdate):
-    existing = await db.cruises.find_one({"id": cruise_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Cruise not found")
-    
     update_data = {k: v for k, v in cruise_data.dict().items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
     
-    await db.cruises.update_one({"id": cruise_id}, {"$set": update_data})
-    updated = await db.cruises.find_one({"id": cruise_id})
-    return Cruise(**updated)
+    updated = await db.cruises.find_one_and_update(
+        {"id": cruise_id},
+        catalog_update_pipeline(update_data),
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Cruise not found")
+    await invalidate_catalog()
+    return Cruise(**upcast_cruise(updated))
 
 @api_router.delete("/cruises/{cruise_id}")
 async def delete_cruise(cruise_id: str):
     result = await db.cruises.delete_one({"id": cruise_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cruise not found")
+    await invalidate_catalog()
     return {"message": "Cruise deleted successfully"}
 
+# ============= DEPARTURE ROUTES =============
+
+@api_router.get("/departures/search", response_model=List[Departure])
+async def search_departures(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    min_seats: Optional[int] = Query(None, ge=1),
+    max_price: Optional[float] = Query(None, ge=0),
+    destination: Optional[str] = None,
+    cruise_type: Optional[CruiseType] = None,
+    limit: int = Query(50, ge=1, le=500)
+):
+    """Search departures within a date window, ordered by start date"""
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must be before date_to")
+    departures = await catalog_cache.get_departures()
+    return departures.search(
+        date_from=date_from,
+        date_to=date_to,
+        min_seats=min_seats,
+        max_price=max_price,
+        destination=destination,
+        cruise_type=cruise_type,
+        limit=limit
+    )
+
+# ============= PAGINATION =============
+
+# Lists are paged on (created_at, id) (or another timestamp) with an opaque
+# cursor instead of skip/offset: each page is one range scan on a compound
+# index, however deep it is. The cursor of the next page is returned in the
+# X-Next-Cursor header so response bodies keep their shape.
+PAGE_SIZE_MAX = 200
+
+def encode_cursor(doc: dict, field: str) -> str:
+    value = doc[field].isoformat() if isinstance(doc[field], datetime) else doc[field]
+    return base64.urlsafe_b64encode(json.dumps([value, doc["id"]]).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(value), last_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def fetch_page(collection, query: dict, limit: int, cursor: Optional[str] = None,
+                     field: str = "created_at", direction: int = -1, projection: Optional[dict] = None):
+    """One page of `collection` in (field, id) order; returns (docs, next cursor)"""
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        after = "$lt" if direction < 0 else "$gt"
+        query = {"$and": [query, {"$or": [
+            {field: {after: value}},
+            {field: value, "id": {after: last_id}}
+        ]}]}
+    # One extra document tells whether there is a next page
+    docs = await collection.find(query, projection).sort([(field, direction), ("id", direction)]).to_list(limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1], field) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
 # ============= CLUB MEMBER ROUTES =============
 
 @api_router.get("/members", response_model=List[ClubMember])
-async def get_members():
-    members = await db.members.find({"is_active": True}).to_list(1000)
+async def get_members(
+    response: Response,
+    limit: int = Query(100, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
+    members, next_cursor = await fetch_page(db.members, {"is_active": True}, limit, cursor)
+    set_next_cursor(response, next_cursor)
     return [ClubMember(**member) for member in members]
 
 @api_router.get("/members/{member_id}", response_model=ClubMember)
@@ -293,55 +1123,96 @@ async def get_member_by_email(email: str):
 # ============= COMMUNITY POSTS ROUTES =============
 
 @api_router.get("/posts", response_model=List[CommunityPost])
-async def get_posts(category: Optional[str] = None, limit: int = 50):
+async def get_posts(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    member_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
+    # Validators come from the shared posts version, so a matching client
+    # gets its 304 without touching db.posts. The version is read here
+    # rather than from the periodic sync: another worker may have taken a
+    # like or a comment since, and the member must see it.
+    posts_version = shared_versions["posts"] = await get_shared_version("posts")
+    etag = make_etag("posts", posts_version["version"], posts_version["updated_at"], category, member_id, limit, cursor)
+    not_modified = not_modified_response(request, etag, posts_version["updated_at"])
+    if not_modified:
+        return not_modified
+    set_validators(response, etag, posts_version["updated_at"])
+    
     query = {"category": category} if category else {}
-    posts = await db.posts.find(query).sort("created_at", -1).to_list(limit)
-    return [CommunityPost(**post) for post in posts]
+    posts, next_cursor = await fetch_page(db.posts, query, limit, cursor, projection=POST_PUBLIC_PROJECTION)
+    set_next_cursor(response, next_cursor)
+    liked = await liked_post_ids([post["id"] for post in posts], member_id)
+    return [CommunityPost(**post, liked_by_me=post["id"] in liked) for post in posts]
 
 @api_router.get("/posts/{post_id}", response_model=CommunityPost)
-async def get_post(post_id: str):
-    post = await db.posts.find_one({"id": post_id})
+async def get_post(post_id: str, member_id: Optional[str] = None):
+    post = await db.posts.find_one({"id": post_id}, POST_PUBLIC_PROJECTION)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
-    return CommunityPost(**post)
+    liked = await liked_post_ids([post_id], member_id)
+    return CommunityPost(**post, liked_by_me=post_id in liked)
 
 @api_router.post("/posts", response_model=CommunityPost)
 async def create_post(post_data: CommunityPostCreate):
     post = CommunityPost(**post_data.dict())
-    await db.posts.insert_one(post.dict())
+    await db.posts.insert_one(post_document(post))
+    await bump_version("posts")
     return post
 
+# Attempts before a toggle that keeps racing another one gives up with 409
+LIKE_TOGGLE_ATTEMPTS = 3
+
 @api_router.post("/posts/{post_id}/like")
 async def toggle_like(post_id: str, member_id: str = Query(...)):
-    post = await db.posts.find_one({"id": post_id})
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-    
-    likes = post.get("likes", [])
-    if member_id in likes:
-        likes.remove(member_id)
+    """Like or unlike. Each branch is one atomic update whose filter only
+    matches in its own state, so the counter moves with the array and
+    concurrent toggles never overwrite each other."""
+    for _ in range(LIKE_TOGGLE_ATTEMPTS):
+        post = await db.posts.find_one_and_update(
+            {"id": post_id, "likes": {"$ne": member_id}},
+            {"$addToSet": {"likes": member_id}, "$inc": {"likes_count": 1}},
+            projection={"likes_count": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        liked = post is not None
+        if not liked:
+            post = await db.posts.find_one_and_update(
+                {"id": post_id, "likes": member_id},
+                {"$pull": {"likes": member_id}, "$inc": {"likes_count": -1}},
+                projection={"likes_count": 1},
+                return_document=ReturnDocument.AFTER
+            )
+        if post is not None:
+            break
+        # Neither state matched: the post is gone, or another request by
+        # the same member toggled it in between
+        if not await db.posts.find_one({"id": post_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Post not found")
     else:
-        likes.append(member_id)
+        raise HTTPException(status_code=409, detail="Like en cours de mise à jour, veuillez réessayer")
     
-    await db.posts.update_one({"id": post_id}, {"$set": {"likes": likes}})
-    return {"likes_count": len(likes), "liked": member_id in likes}
+    await bump_version("posts")
+    return {"likes_count": post["likes_count"], "liked": liked}
 
 @api_router.post("/posts/{post_id}/comments", response_model=CommunityPost)
 async def add_comment(post_id: str, comment_data: CommentCreate):
-    post = await db.posts.find_one({"id": post_id})
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-    
     comment = PostComment(**comment_data.dict())
-    await db.posts.update_one(
+    updated = await db.posts.find_one_and_update(
         {"id": post_id},
         {
             "$push": {"comments": comment.dict()},
             "$set": {"updated_at": datetime.utcnow()}
-        }
+        },
+        projection=POST_PUBLIC_PROJECTION,
+        return_document=ReturnDocument.AFTER
     )
-    
-    updated = await db.posts.find_one({"id": post_id})
+    if not updated:
+        raise HTTPException(status_code=404, detail="Post not found")
+    await bump_version("posts")
     return CommunityPost(**updated)
 
 @api_router.delete("/posts/{post_id}")
@@ -349,6 +1220,7 @@ async def delete_post(post_id: str):
     result = await db.posts.delete_one({"id": post_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Post not found")
+    await bump_version("posts")
     return {"message": "Post deleted successfully"}
 
 # ============= DIRECT MESSAGING =============
@@ -386,22 +1258,36 @@ CAPTAIN_ID = "captain-sognudimare"
 CAPTAIN_NAME = "Capitaine Sognudimare"
 
 @api_router.get("/messages/conversations/{user_id}")
-async def get_conversations(user_id: str):
-    """Get all conversations for a user"""
-    conversations = await db.conversations.find({
-        "participant_ids": user_id
-    }).sort("last_message_at", -1).to_list(50)
+async def get_conversations(
+    user_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
+    """Get all conversations for a user, most recently active first"""
+    conversations, next_cursor = await fetch_page(
+        db.conversations, {"participant_ids": user_id}, limit, cursor,
+        field="last_message_at", projection={"_id": 0}
+    )
+    set_next_cursor(response, next_cursor)
     return conversations
 
 @api_router.get("/messages/{user_id}/{other_user_id}")
-async def get_messages(user_id: str, other_user_id: str):
-    """Get messages between two users"""
-    messages = await db.messages.find({
+async def get_messages(
+    user_id: str,
+    other_user_id: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
+    """Get messages between two users, oldest first"""
+    messages, next_cursor = await fetch_page(db.messages, {
         "$or": [
             {"sender_id": user_id, "receiver_id": other_user_id},
             {"sender_id": other_user_id, "receiver_id": user_id}
         ]
-    }).sort("created_at", 1).to_list(100)
+    }, limit, cursor, direction=1, projection={"_id": 0})
+    set_next_cursor(response, next_cursor)
     
     # Mark messages as read
     await db.messages.update_many(
@@ -417,31 +1303,27 @@ async def send_message(message_data: DirectMessageCreate):
     message = DirectMessage(**message_data.dict())
     await db.messages.insert_one(message.dict())
     
-    # Update or create conversation
+    # Update or create the conversation in one upsert
     conversation_id = "-".join(sorted([message_data.sender_id, message_data.receiver_id]))
-    existing_conv = await db.conversations.find_one({"id": conversation_id})
-    
-    if existing_conv:
-        await db.conversations.update_one(
-            {"id": conversation_id},
-            {
-                "$set": {
-                    "last_message": message_data.content[:50],
-                    "last_message_at": datetime.utcnow()
-                },
-                "$inc": {"unread_count": 1}
-            }
-        )
-    else:
-        conv = Conversation(
-            id=conversation_id,
-            participant_ids=[message_data.sender_id, message_data.receiver_id],
-            participant_names=[message_data.sender_name, message_data.receiver_name],
-            last_message=message_data.content[:50],
-            last_message_at=datetime.utcnow(),
-            unread_count=1
-        )
-        await db.conversations.insert_one(conv.dict())
+    conversation = Conversation(
+        id=conversation_id,
+        participant_ids=[message_data.sender_id, message_data.receiver_id],
+        participant_names=[message_data.sender_name, message_data.receiver_name]
+    )
+    await db.conversations.update_one(
+        {"id": conversation_id},
+        {
+            "$set": {
+                "last_message": message_data.content[:50],
+                "last_message_at": datetime.utcnow()
+            },
+            "$inc": {"unread_count": 1},
+            "$setOnInsert": conversation.dict(
+                include={"participant_ids", "participant_names", "created_at"}
+            )
+        },
+        upsert=True
+    )
     
     return message.dict()
 
@@ -473,9 +1355,14 @@ async def admin_login(credentials: AdminCredentials):
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
 @api_router.get("/admin/posts")
-async def admin_get_all_posts():
+async def admin_get_all_posts(
+    response: Response,
+    limit: int = Query(100, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
     """Get all posts for moderation"""
-    posts = await db.posts.find().sort("created_at", -1).to_list(100)
+    posts, next_cursor = await fetch_page(db.posts, {}, limit, cursor, projection=POST_PUBLIC_PROJECTION)
+    set_next_cursor(response, next_cursor)
     return [
         {**post, "_id": str(post["_id"])} if "_id" in post else post 
         for post in posts
@@ -487,6 +1374,7 @@ async def admin_delete_post(post_id: str):
     result = await db.posts.delete_one({"id": post_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Post not found")
+    await bump_version("posts")
     return {"message": "Post deleted by admin"}
 
 @api_router.delete("/admin/posts/{post_id}/comments/{comment_id}")
@@ -498,12 +1386,18 @@ async def admin_delete_comment(post_id: str, comment_id: str):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Comment not found")
+    await bump_version("posts")
     return {"message": "Comment deleted by admin"}
 
 @api_router.get("/admin/members")
-async def admin_get_all_members():
+async def admin_get_all_members(
+    response: Response,
+    limit: int = Query(100, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
     """Get all members for moderation"""
-    members = await db.members.find().to_list(100)
+    members, next_cursor = await fetch_page(db.members, {}, limit, cursor)
+    set_next_cursor(response, next_cursor)
     return [
         {**member, "_id": str(member["_id"])} if "_id" in member else member 
         for member in members
@@ -532,9 +1426,14 @@ async def admin_unban_member(member_id: str):
     return {"message": "Member unbanned"}
 
 @api_router.get("/admin/messages")
-async def admin_get_all_messages():
+async def admin_get_all_messages(
+    response: Response,
+    limit: int = Query(200, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
     """Get all messages for moderation"""
-    messages = await db.messages.find().sort("created_at", -1).to_list(200)
+    messages, next_cursor = await fetch_page(db.messages, {}, limit, cursor, projection={"_id": 0})
+    set_next_cursor(response, next_cursor)
     return messages
 
 @api_router.delete("/admin/messages/{message_id}")
@@ -549,27 +1448,30 @@ async def admin_delete_message(message_id: str):
 
 @api_router.get("/admin/cruises")
 async def admin_get_all_cruises():
-    """Get all cruises for admin"""
-    cruises = await db.cruises.find().sort("order", 1).to_list(100)
+    """Get all cruises for admin, inactive ones included, in one list: the
+    admin screen reorders them as a whole"""
+    cruises = await db.cruises.find().sort("order", 1).to_list(None)
     # Convert MongoDB documents to proper format
     return [
-        {**cruise, "_id": str(cruise["_id"])} if "_id" in cruise else cruise 
+        upcast_cruise({**cruise, "_id": str(cruise["_id"])} if "_id" in cruise else cruise)
         for cruise in cruises
     ]
 
 @api_router.put("/admin/cruises/{cruise_id}")
 async def admin_update_cruise(cruise_id: str, cruise_data: CruiseUpdate):
     """Admin update cruise"""
-    existing = await db.cruises.find_one({"id": cruise_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Cruise not found")
-    
     update_data = {k: v for k, v in cruise_data.dict().items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
     
-    await db.cruises.update_one({"id": cruise_id}, {"$set": update_data})
-    updated = await db.cruises.find_one({"id": cruise_id})
-    return Cruise(**updated)
+    updated = await db.cruises.find_one_and_update(
+        {"id": cruise_id},
+        catalog_update_pipeline(update_data),
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Cruise not found")
+    await invalidate_catalog()
+    return Cruise(**upcast_cruise(updated))
 
 @api_router.delete("/admin/cruises/{cruise_id}")
 async def admin_delete_cruise(cruise_id: str):
@@ -577,19 +1479,158 @@ async def admin_delete_cruise(cruise_id: str):
     result = await db.cruises.delete_one({"id": cruise_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cruise not found")
+    await invalidate_catalog()
     return {"message": "Cruise deleted"}
 
-# ============= SEED DATA =============
+@api_router.post("/admin/cruises/compact")
+async def admin_compact_cruises():
+    """Rewrite legacy cruise documents to the current schema now"""
+    return await compact_cruises()
 
-@api_router.post("/seed")
-async def seed_database():
-    """Seed the database with initial cruise data"""
-    
-    # Check if already seeded
-    existing = await db.cruises.find_one()
-    if existing:
-        return {"message": "Database already seeded"}
-    
+# ============= MIGRATIONS =============
+
+# Catalog data changes ship as numbered migrations, applied once and in order
+# at startup. Applied numbers are recorded in schema_migrations, and a lease in
+# db.locks makes sure only one gunicorn worker runs them; the others wait for
+# the lease and then find nothing pending.
+MIGRATION_LOCK_ID = "migrations"
+MIGRATION_LOCK_SECONDS = 300
+MIGRATION_LOCK_POLL_SECONDS = 1
+
+SEED_MIGRATION = 1
+
+MIGRATIONS: Dict[int, dict] = {}
+
+def migration(number: int, name: str, legacy: bool = False):
+    """Register a migration. Legacy migrations replace the old one-off
+    /seed, /apply-corrections and /update-detailed-data endpoints. A database
+    that already held a catalog when the runner arrived was seeded by hand, so
+    the seed is baselined; whether it also got the corrections by hand cannot
+    be told, so the other legacy migrations are held for an admin to apply or
+    baseline from /admin/migrations."""
+    def register(fn):
+        if number in MIGRATIONS:
+            raise RuntimeError(f"Duplicate migration number {number}")
+        MIGRATIONS[number] = {"name": name, "legacy": legacy, "fn": fn}
+        return fn
+    return register
+
+async def acquire_lock(lock_id: str, owner: str, seconds: int) -> bool:
+    """Take the lease `lock_id` in db.locks unless another owner holds it"""
+    now = datetime.utcnow()
+    try:
+        lock = await db.locks.find_one_and_update(
+            {"_id": lock_id, "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # The lock exists and has not expired: the upsert collided with it
+        return False
+    return lock is not None
+
+async def release_lock(lock_id: str, owner: str):
+    await db.locks.delete_one({"_id": lock_id, "owner": owner})
+
+async def record_migration(number: int, baselined: bool, duration_ms: int):
+    await db.schema_migrations.update_one(
+        {"_id": number},
+        {"$set": {
+            "name": MIGRATIONS[number]["name"],
+            "baselined": baselined,
+            "applied_at": datetime.utcnow(),
+            "duration_ms": duration_ms
+        }},
+        upsert=True
+    )
+
+async def apply_migration(number: int):
+    started = time.monotonic()
+    await MIGRATIONS[number]["fn"]()
+    duration_ms = int((time.monotonic() - started) * 1000)
+    await record_migration(number, False, duration_ms)
+    logger.info(f"Migration {number} ({MIGRATIONS[number]['name']}) applied in {duration_ms} ms")
+
+async def run_migrations():
+    """Apply pending migrations, holding the lock for the whole run"""
+    owner = str(uuid.uuid4())
+    while not await acquire_lock(MIGRATION_LOCK_ID, owner, MIGRATION_LOCK_SECONDS):
+        await asyncio.sleep(MIGRATION_LOCK_POLL_SECONDS)
+    try:
+        applied = {
+            doc["_id"]: doc.get("baselined", False)
+            for doc in await db.schema_migrations.find({}, {"baselined": 1}).to_list(None)
+        }
+        if not applied and await db.cruises.find_one({}, {"_id": 1}) is not None:
+            await record_migration(SEED_MIGRATION, True, 0)
+            applied[SEED_MIGRATION] = True
+            logger.info(f"Migration {SEED_MIGRATION} ({MIGRATIONS[SEED_MIGRATION]['name']}) baselined")
+        hand_seeded = applied.get(SEED_MIGRATION, False)
+        changed = False
+        for number in sorted(MIGRATIONS):
+            if number in applied:
+                continue
+            if hand_seeded and MIGRATIONS[number]["legacy"]:
+                logger.warning(
+                    f"Migration {number} ({MIGRATIONS[number]['name']}) is held: "
+                    f"apply or baseline it from /api/admin/migrations"
+                )
+                continue
+            await apply_migration(number)
+            changed = True
+        if changed:
+            await invalidate_catalog()
+    finally:
+        await release_lock(MIGRATION_LOCK_ID, owner)
+
+@api_router.get("/admin/migrations")
+async def get_migrations():
+    """Every registered migration with the date it was applied, if it was"""
+    applied = {doc["_id"]: doc for doc in await db.schema_migrations.find().to_list(None)}
+    hand_seeded = applied.get(SEED_MIGRATION, {}).get("baselined", False)
+    return [
+        {
+            "number": number,
+            "name": MIGRATIONS[number]["name"],
+            "applied": number in applied,
+            "held": number not in applied and hand_seeded and MIGRATIONS[number]["legacy"],
+            "baselined": applied.get(number, {}).get("baselined", False),
+            "applied_at": applied.get(number, {}).get("applied_at"),
+            "duration_ms": applied.get(number, {}).get("duration_ms")
+        }
+        for number in sorted(MIGRATIONS)
+    ]
+
+@api_router.post("/admin/migrations/{number}/apply")
+async def reapply_migration(number: int):
+    """Run one migration again, or a held one. Catalog migrations go through
+    catalog_update_pipeline, so sold seats and holds are kept"""
+    if number not in MIGRATIONS:
+        raise HTTPException(status_code=404, detail="Migration not found")
+    owner = str(uuid.uuid4())
+    if not await acquire_lock(MIGRATION_LOCK_ID, owner, MIGRATION_LOCK_SECONDS):
+        raise HTTPException(status_code=409, detail="Another migration is running")
+    try:
+        await apply_migration(number)
+    finally:
+        await release_lock(MIGRATION_LOCK_ID, owner)
+    await invalidate_catalog()
+    return {"message": f"Migration {number} applied"}
+
+@api_router.post("/admin/migrations/{number}/baseline")
+async def baseline_migration(number: int):
+    """Record a held migration as applied without running it, once its
+    changes are known to be in the database already"""
+    if number not in MIGRATIONS:
+        raise HTTPException(status_code=404, detail="Migration not found")
+    if await db.schema_migrations.find_one({"_id": number}, {"_id": 1}):
+        raise HTTPException(status_code=409, detail="Migration already applied")
+    await record_migration(number, True, 0)
+    return {"message": f"Migration {number} baselined"}
+
+@migration(1, "seed catalog and sample posts", legacy=True)
+async def seed_catalog():
     cruises = [
         {
             "id": str(uuid.uuid4()),
@@ -869,9 +1910,6 @@ async def seed_database():
         }
     ]
     
-    await db.cruises.insert_many(cruises)
-    
-    # Add some sample community posts
     sample_posts = [
         {
             "id": str(uuid.uuid4()),
@@ -903,36 +1941,15 @@ async def seed_database():
         }
     ]
     
+    await db.cruises.insert_many(cruises)
     await db.posts.insert_many(sample_posts)
-    
-    return {"message": "Database seeded successfully", "cruises_count": len(cruises), "posts_count": len(sample_posts)}
 
-# ============= APPLY CORRECTIONS =============
-
-@api_router.post("/apply-corrections")
-async def apply_cruise_corrections():
-    """Apply all corrections: programs, IMAGES, prices"""
-    
-    results = {
-        "programs_updated": [],
-        "images_updated": [],
-        "prices_updated": [],
-        "cruises_deleted": [],
-        "errors": []
-    }
-    
-    # 1. Delete Greece and Grenadines
-    try:
-        delete_result = await db.cruises.delete_many({
-            "name_fr": {"$in": ["Grèce Authentique", "Îles Grenadines"]}
-        })
-        results["cruises_deleted"].append(f"Deleted {delete_result.deleted_count} cruises")
-    except Exception as e:
-        results["errors"].append(f"Error deleting cruises: {str(e)}")
-    
-    # 2. Update Tour de Corse
-    try:
-        result = await db.cruises.update_one(
+@migration(2, "catalog corrections: programs, images, prices", legacy=True)
+async def apply_catalog_corrections():
+    await db.cruises.bulk_write([
+        # Greece and the Grenadines are no longer sold
+        DeleteMany({"name_fr": {"$in": ["Grèce Authentique", "Îles Grenadines"]}}),
+        UpdateOne(
             {"name_fr": "Tour de Corse"},
             {"$set": {
                 "program_fr": [
@@ -957,16 +1974,8 @@ async def apply_cruise_corrections():
                 "boarding_pass_image": "https://static.wixstatic.com/media/ce6ce7_170fb96af2764aecb7eb7c526a48eb27~mv2.png/v1/fill/w_400,h_267,al_c,q_85,enc_avif,quality_auto/croisiere%20catamaran%20le%20tour%20de%20Corse%20sognudimare.png",
                 "updated_at": datetime.utcnow()
             }}
-        )
-        if result.modified_count > 0:
-            results["programs_updated"].append("Tour de Corse")
-            results["images_updated"].append("Tour de Corse")
-    except Exception as e:
-        results["errors"].append(f"Error updating Tour de Corse: {str(e)}")
-    
-    # 3. Update Ouest Corse
-    try:
-        result = await db.cruises.update_one(
+        ),
+        UpdateOne(
             {"name_fr": "Ouest Corse"},
             {"$set": {
                 "program_fr": [
@@ -983,16 +1992,8 @@ async def apply_cruise_corrections():
                 "boarding_pass_image": "https://static.wixstatic.com/media/ce6ce7_bdc5406402ea4be3b94eeeb747d2da1a~mv2.png/v1/fill/w_400,h_267,al_c,q_85,enc_avif,quality_auto/croisiere%20catamaran%20ouest%20corse%20sognudimare.png",
                 "updated_at": datetime.utcnow()
             }}
-        )
-        if result.modified_count > 0:
-            results["programs_updated"].append("Ouest Corse")
-            results["images_updated"].append("Ouest Corse")
-    except Exception as e:
-        results["errors"].append(f"Error updating Ouest Corse: {str(e)}")
-    
-    # 4. Update Corse du Sud
-    try:
-        result = await db.cruises.update_one(
+        ),
+        UpdateOne(
             {"name_fr": "Corse du Sud"},
             {"$set": {
                 "program_fr": [
@@ -1009,16 +2010,8 @@ async def apply_cruise_corrections():
                 "boarding_pass_image": "https://static.wixstatic.com/media/ce6ce7_2c02fe160efb49b6930f0c695a53e34f~mv2.png/v1/fill/w_400,h_267,al_c,q_85,enc_avif,quality_auto/croisiere%20catamaran%20la%20corse%20du%20sud%20sognudimare.png",
                 "updated_at": datetime.utcnow()
             }}
-        )
-        if result.modified_count > 0:
-            results["programs_updated"].append("Corse du Sud")
-            results["images_updated"].append("Corse du Sud")
-    except Exception as e:
-        results["errors"].append(f"Error updating Corse du Sud: {str(e)}")
-    
-    # 5. Update Sardaigne
-    try:
-        result = await db.cruises.update_one(
+        ),
+        UpdateOne(
             {"name_fr": {"$in": ["Sardaigne & Corse du Sud", "Sardaigne et Corse du Sud"]}},
             {"$set": {
                 "program_fr": [
@@ -1036,27 +2029,102 @@ async def apply_cruise_corrections():
                 "updated_at": datetime.utcnow()
             }}
         )
-        if result.modified_count > 0:
-            results["programs_updated"].append("Sardaigne & Corse du Sud")
-            results["images_updated"].append("Sardaigne & Corse du Sud")
-    except Exception as e:
-        results["errors"].append(f"Error updating Sardaigne: {str(e)}")
-    
-    return {
-        "success": len(results["errors"]) == 0,
-        "message": "Corrections applied successfully" if len(results["errors"]) == 0 else "Some errors occurred",
-        "details": results
-    }
-
-# ============= UPDATE WITH DETAILED DATA (FÉVRIER 2026) =============
+    ])
 
-@api_router.post("/update-detailed-data")
-async def update_cruises_with_detailed_data():
-    """Update cruises with detailed availability, pricing and contact info - Feb 2026"""
+@migration(3, "2026 departures and day-by-day program", legacy=True)
+async def add_2026_departures():
+    tour_de_corse_availabilities = [
+        {"date_range": "du 23 mai au 6 juin 2026", "price": 2560, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 13 au 27 juin 2026", "price": 2560, "status": "limited", "remaining_places": 4, "status_label": "Reste 4 places"},
+        {"date_range": "du 27 juin au 11 juillet 2026", "price": 3150, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 11 au 25 juillet 2026", "price": 3150, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 25 juillet au 8 août 2026", "price": 3450, "status": "full", "remaining_places": 0, "status_label": "COMPLET"},
+        {"date_range": "du 8 au 22 août 2026", "price": 3450, "status": "full", "remaining_places": 0, "status_label": "COMPLET"},
+        {"date_range": "du 22 août au 5 septembre 2026", "price": 3450, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 5 au 19 septembre 2026", "price": 3150, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 19 septembre au 3 octobre 2026", "price": 2660, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+    ]
+    
+    tour_de_corse_program = [
+        {"day": 1, "title": "Embarquement Ajaccio & Îles Sanguinaires", "description": "Embarquement au port Tino Rossi à partir de 15h30. Navigation vers les Îles Sanguinaires, site maritime classé offrant un refuge paisible à diverses espèces d'oiseaux marins."},
+        {"day": 2, "title": "Cargèse", "description": "Découvrez la charmante commune de Cargèse. Flânez dans les ruelles pavées, découvrez les églises aux influences grecques et latines qui témoignent du passé singulier de ce village."},
+        {"day": 3, "title": "Calanques de Piana & Golfe de Porto", "description": "Admirez les falaises impressionnantes des Calanques de Piana avec leurs teintes rougeâtres. Le Golfe de Porto, classé au patrimoine mondial de l'UNESCO, offre une beauté naturelle à son apogée."},
+        {"day": 4, "title": "Village de Girolata", "description": "Découverte du charmant village de Girolata, accessible uniquement par bateau. Laissez-vous séduire par ses maisons de pierre aux toits de lauze et son atmosphère paisible."},
+        {"day": 5, "title": "Réserve de Scandola & Galéria", "description": "Navigation jusqu'au cap le plus à l'ouest de la Corse. La réserve naturelle de Scandola, unique en son genre, englobe des environnements marins et terrestres avec une palette exceptionnelle de couleurs."},
+        {"day": 6, "title": "Golfe de la Revelatta & Calvi", "description": "Snorkeling et paddle dans les eaux cristallines du Golfe de la Revelatta. Arrivée au port de Calvi avec la vue majestueuse de sa citadelle."},
+        {"day": 7, "title": "Plages de Saleccia & Saint-Florent", "description": "Les plages de Saleccia, parmi les plus belles de la Méditerranée. Sable blanc bordé d'eaux turquoises. Direction le port de Saint-Florent."},
+        {"day": 8, "title": "Plage de Nonza & Port de Centuri", "description": "Plage de Nonza réputée pour son sable noir et ses falaises imposantes. Découverte du pittoresque port de Centuri, petit port de pêche traditionnel."},
+        {"day": 9, "title": "Cap Corse, Erbalunga & Bastia", "description": "Périple le long du Cap Corse, péninsule sauvage et préservée. Visite d'Erbalunga, charmant village de pêcheurs, puis Bastia avec sa citadelle génoise."},
+        {"day": 10, "title": "Solenzara", "description": "Solenzara, réputée pour ses plages de sable fin et ses eaux turquoises. Paddle, snorkeling et exploration du charmant centre-ville."},
+        {"day": 11, "title": "Porto-Vecchio & Santa Giulia", "description": "Porto-Vecchio, ville emblématique avec ses plages de sable blanc et criques isolées. Promenade dans le centre historique avec ses ruelles pittoresques."},
+        {"day": 12, "title": "Bonifacio", "description": "Bonifacio, ville fascinante perchée au sommet de falaises calcaires spectaculaires. Découverte de l'Escalier du Roi d'Aragon et de la citadelle médiévale."},
+        {"day": 13, "title": "Plage de Roccapina & Tizzano", "description": "Plage de Roccapina, étendue de sable doré bordée par des falaises de granit rose. Déjeuner à Tizzano avec ses spécialités de fruits de mer."},
+        {"day": 14, "title": "Retour Ajaccio via Cala di Conca", "description": "Arrêt à la plage de Cala di Conca, crique sauvage aux eaux turquoises. Dernière nuit à bord au port de Tino Rossi à Ajaccio."},
+        {"day": 15, "title": "Débarquement Ajaccio", "description": "Dernier petit-déjeuner à bord. Débarquement à 8h30 au port de Tino Rossi."},
+    ]
+    
+    corse_sud_availabilities = [
+        {"date_range": "du 2 au 9 mai 2026", "price": 1470, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 9 au 16 mai 2026", "price": 1470, "status": "full", "remaining_places": 0, "status_label": "COMPLET"},
+        {"date_range": "du 6 au 13 juin 2026", "price": 1670, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 27 juin au 4 juillet 2026", "price": 1970, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 4 au 11 juillet 2026", "price": 1970, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 11 au 18 juillet 2026", "price": 1970, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 25 juillet au 1er août 2026", "price": 2070, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 1er au 8 août 2026", "price": 2070, "status": "limited", "remaining_places": 4, "status_label": "Reste 4 places"},
+        {"date_range": "du 8 au 15 août 2026", "price": 2070, "status": "full", "remaining_places": 0, "status_label": "COMPLET"},
+        {"date_range": "du 15 au 22 août 2026", "price": 2170, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 22 au 29 août 2026", "price": 2170, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 29 août au 5 septembre 2026", "price": 2070, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 5 au 12 septembre 2026", "price": 1870, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 12 au 19 septembre 2026", "price": 1770, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 19 au 26 septembre 2026", "price": 1770, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+        {"date_range": "du 26 septembre au 3 octobre 2026", "price": 1470, "status": "available", "remaining_places": 8, "status_label": "Reste 8 places"},
+    ]
     
-    results = {"updated": [], "errors": []}
+    ouest_corse_availabilities = corse_sud_availabilities.copy()
     
-    # Tour de Corse - Availabilities 2026
+    sardaigne_availabilities = corse_sud_availabilities.copy()
+    
+    await db.cruises.bulk_write([
+        UpdateOne(
+            {"name_fr": "Tour de Corse"},
+            catalog_update_pipeline({
+                "availabilities": tour_de_corse_availabilities,
+                "detailed_program_fr": tour_de_corse_program,
+                "pricing": {"cabin_price": 2560, "private_price": 12900, "currency": "EUR"},
+                "updated_at": datetime.utcnow()
+            })
+        ),
+        UpdateOne(
+            {"name_fr": "Corse du Sud"},
+            catalog_update_pipeline({
+                "availabilities": corse_sud_availabilities,
+                "pricing": {"cabin_price": 1470, "private_price": 11900, "currency": "EUR"},
+                "updated_at": datetime.utcnow()
+            })
+        ),
+        UpdateOne(
+            {"name_fr": "Ouest Corse"},
+            catalog_update_pipeline({
+                "availabilities": ouest_corse_availabilities,
+                "pricing": {"cabin_price": 1470, "private_price": 11900, "currency": "EUR"},
+                "updated_at": datetime.utcnow()
+            })
+        ),
+        UpdateOne(
+            {"name_fr": {"$in": ["Sardaigne & Corse du Sud", "Sardaigne et Corse du Sud"]}},
+            catalog_update_pipeline({
+                "availabilities": sardaigne_availabilities,
+                "pricing": {"cabin_price": 1470, "private_price": 11900, "currency": "EUR"},
+                "updated_at": datetime.utcnow()
+            })
+        )
+    ])
+
+@migration(4, "February 2026 pricing: privatisation = cabin price x 8", legacy=True)
+async def update_pricing_february_2026():
+    # Formerly only in the web-booking copy of /update-detailed-data
     tour_de_corse_availabilities = [
         {"date_range": "du 23 mai au 6 juin 2026", "price": 2560, "status": "available", "remaining_places": 8, "status_label": "Disponible"},
         {"date_range": "du 13 au 27 juin 2026", "price": 2560, "status": "limited", "remaining_places": 4, "status_label": "Quelques places"},
@@ -1069,7 +2137,6 @@ async def update_cruises_with_detailed_data():
         {"date_range": "du 19 septembre au 3 octobre 2026", "price": 2660, "status": "available", "remaining_places": 8, "status_label": "Disponible"},
     ]
     
-    # Ouest Corse / Corse du Sud / Sardaigne - Availabilities 2026 (same dates)
     cruises_8_days_availabilities = [
         {"date_range": "du 2 au 9 mai 2026", "price": 1470, "status": "available", "remaining_places": 8, "status_label": "Disponible"},
         {"date_range": "du 9 au 16 mai 2026", "price": 1470, "status": "full", "remaining_places": 0, "status_label": "COMPLET"},
@@ -1089,67 +2156,47 @@ async def update_cruises_with_detailed_data():
         {"date_range": "du 26 septembre au 3 octobre 2026", "price": 1470, "status": "available", "remaining_places": 8, "status_label": "Disponible"},
     ]
     
-    # Update Tour de Corse with correct pricing (privatisation = price × 8)
-    try:
-        await db.cruises.update_one(
+    await db.cruises.bulk_write([
+        UpdateOne(
             {"name_fr": "Tour de Corse"},
-            {"$set": {
+            catalog_update_pipeline({
                 "availabilities": tour_de_corse_availabilities,
                 "pricing": {"cabin_price": 2560, "private_price": 20480, "currency": "EUR"},
                 "updated_at": datetime.utcnow()
-            }}
-        )
-        results["updated"].append("Tour de Corse")
-    except Exception as e:
-        results["errors"].append(f"Tour de Corse: {str(e)}")
-    
-    # Update Corse du Sud
-    try:
-        await db.cruises.update_one(
+            })
+        ),
+        UpdateOne(
             {"name_fr": "Corse du Sud"},
-            {"$set": {
+            catalog_update_pipeline({
                 "availabilities": cruises_8_days_availabilities,
                 "pricing": {"cabin_price": 1470, "private_price": 11760, "currency": "EUR"},
                 "updated_at": datetime.utcnow()
-            }}
-        )
-        results["updated"].append("Corse du Sud")
-    except Exception as e:
-        results["errors"].append(f"Corse du Sud: {str(e)}")
-    
-    # Update Ouest Corse
-    try:
-        await db.cruises.update_one(
+            })
+        ),
+        UpdateOne(
             {"name_fr": "Ouest Corse"},
-            {"$set": {
+            catalog_update_pipeline({
                 "availabilities": cruises_8_days_availabilities,
                 "pricing": {"cabin_price": 1470, "private_price": 11760, "currency": "EUR"},
                 "updated_at": datetime.utcnow()
-            }}
-        )
-        results["updated"].append("Ouest Corse")
-    except Exception as e:
-        results["errors"].append(f"Ouest Corse: {str(e)}")
-    
-    # Update Sardaigne & Corse du Sud
-    try:
-        await db.cruises.update_one(
+            })
+        ),
+        UpdateOne(
             {"name_fr": {"$in": ["Sardaigne & Corse du Sud", "Sardaigne et Corse du Sud"]}},
-            {"$set": {
+            catalog_update_pipeline({
                 "availabilities": cruises_8_days_availabilities,
                 "pricing": {"cabin_price": 1470, "private_price": 11760, "currency": "EUR"},
                 "updated_at": datetime.utcnow()
-            }}
+            })
         )
-        results["updated"].append("Sardaigne & Corse du Sud")
-    except Exception as e:
-        results["errors"].append(f"Sardaigne: {str(e)}")
-    
-    return {
-        "success": len(results["errors"]) == 0,
-        "message": "Data updated successfully" if len(results["errors"]) == 0 else "Some errors occurred",
-        "details": results
-    }
+    ])
+
+@migration(5, "denormalized likes_count on posts")
+async def count_post_likes():
+    await db.posts.update_many(
+        {"likes_count": {"$exists": False}},
+        [{"$set": {"likes_count": {"$size": {"$ifNull": ["$likes", []]}}}}]
+    )
 
 # ============= CONTACT INFO =============
 
@@ -1185,9 +2232,12 @@ class CreatePaymentRequest(BaseModel):
     cruise_name: str
     customer_email: str
     customer_name: str
-    passengers: int = 2
+    passengers: int = Field(2, ge=1, le=CATAMARAN_CAPACITY)
     selected_date: Optional[str] = None
     booking_type: str = "cabin"  # "cabin" or "private"
+    hold_id: Optional[str] = None  # From POST /api/holds, consumed by the payment
+    club_card: str = "none"  # Key of CLUB_CARDS
+    club_card_quantity: int = 0
     note: Optional[str] = None
 
 class PaymentRecord(BaseModel):
@@ -1206,9 +2256,734 @@ class PaymentRecord(BaseModel):
     note: Optional[str] = None
     receipt_url: Optional[str] = None
     error_message: Optional[str] = None
+    seats: int = 0  # Seats taken on the departure, given back on failure or full refund
+    idempotency_key: Optional[str] = None  # Also sent to Square, so retried charges are deduped
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    locked_until: datetime = Field(default_factory=lambda: datetime(1970, 1, 1))
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Never returned by the API: the card nonce waiting in the outbox
+PAYMENT_PUBLIC_PROJECTION = {"source_id": 0}
+
+# ============= SQUARE GATEWAY =============
+
+class GatewayTimeout(Exception):
+    """Square did not answer within SQUARE_TIMEOUT_SECONDS"""
+
+class CircuitOpen(Exception):
+    """Square has been failing; calls are refused until the breaker resets"""
+
+# Answer for callers while Square is unavailable; never the exception text
+GATEWAY_UNAVAILABLE = "Le service de paiement est temporairement indisponible, veuillez réessayer dans quelques instants"
+
+def is_retryable(error: Exception) -> bool:
+    """Timeouts, network errors, throttling and 5xx; not declines or bad requests"""
+    if isinstance(error, ApiError):
+        return error.status_code is None or error.status_code == 429 or error.status_code >= 500
+    return True
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures, then lets a single probe
+    through once `reset_timeout` has passed"""
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    @property
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0
+        return max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self.probing):
+            raise CircuitOpen(f"Square circuit open, retry in {self.retry_after:.0f}s")
+        if state == "half_open":
+            self.probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            if self.opened_at is None or self.probing:
+                logger.warning(f"Square circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+class GatewayStats:
+    """Per-operation counters and recent latencies"""
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=200)
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.latencies)
+        def percentile(p):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000) if ordered else None
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)}
+        }
+
+class SquareGateway:
+    """Async facade over the blocking Square SDK.
+
+    Calls run on a bounded thread pool so an HTTPS round trip to Square never
+    blocks the event loop; catalog and messaging requests on the same worker
+    keep being served while payments are in flight. Transient errors are
+    retried with jittered backoff (every call carries an idempotency key or is
+    a read), and a circuit breaker refuses calls outright while Square keeps
+    failing so requests do not queue behind timeouts."""
+
+    def __init__(self, max_workers: int, timeout: float, max_retries: int, breaker: CircuitBreaker):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="square")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = breaker
+        self.stats: Dict[str, GatewayStats] = {}
+
+    async def _call_once(self, fn, timeout: float, **kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, functools.partial(fn, **kwargs))
+        try:
+            # The SDK has its own HTTP timeout; this also bounds time spent
+            # queued for a pool thread
+            return await asyncio.wait_for(future, timeout + 1)
+        except asyncio.TimeoutError:
+            raise GatewayTimeout(f"Square call timed out after {timeout}s")
+
+    async def _call(self, operation: str, fn, timeout: Optional[float] = None, **kwargs):
+        stats = self.stats.setdefault(operation, GatewayStats())
+        timeout = timeout or self.timeout
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.breaker.allow()
+            except CircuitOpen:
+                stats.rejected += 1
+                raise
+            stats.calls += 1
+            started = time.monotonic()
+            try:
+                result = await self._call_once(fn, timeout, **kwargs)
+            except Exception as e:
+                stats.latencies.append(time.monotonic() - started)
+                if not is_retryable(e):
+                    # Square answered: a decline says nothing about its health
+                    self.breaker.record_success()
+                    raise
+                stats.failures += 1
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+                stats.retries += 1
+                # Full jitter: spread retries from concurrent requests apart
+                await asyncio.sleep(random.uniform(0, min(4.0, 0.25 * 2 ** attempt)))
+                continue
+            stats.latencies.append(time.monotonic() - started)
+            self.breaker.record_success()
+            return result
+
+    async def create_payment(self, **kwargs):
+        return await self._call("create_payment", get_square_client().payments.create, **kwargs)
+
+    async def refund_payment(self, **kwargs):
+        return await self._call("refund_payment", get_square_client().refunds.refund_payment, **kwargs)
+
+    async def list_payments(self, **kwargs) -> List[dict]:
+        """Every payment in a time window, following Square's cursor pages"""
+        def list_all(**kwargs):
+            payments = []
+            for page in get_square_client().payments.list(**kwargs).iter_pages():
+                for payment in page.items or []:
+                    payments.append({
+                        "id": payment.id,
+                        "status": payment.status,
+                        "amount": payment.amount_money.amount if payment.amount_money else 0,
+                        "refunded": payment.refunded_money.amount if payment.refunded_money else 0,
+                        "reference_id": payment.reference_id,
+                        "created_at": payment.created_at
+                    })
+            return payments
+        # Several pages per window, so allow more than a single call
+        return await self._call("list_payments", list_all, timeout=self.timeout * 4, **kwargs)
+
+    def status(self) -> dict:
+        return {
+            "breaker": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures,
+                "retry_after_seconds": round(self.breaker.retry_after, 1)
+            },
+            "operations": {name: stats.snapshot() for name, stats in self.stats.items()}
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+square_gateway = SquareGateway(
+    SQUARE_MAX_CONCURRENCY,
+    SQUARE_TIMEOUT_SECONDS,
+    SQUARE_MAX_RETRIES,
+    CircuitBreaker(SQUARE_BREAKER_THRESHOLD, SQUARE_BREAKER_RESET_SECONDS)
+)
+
+# ============= SEAT INVENTORY =============
+
+# At or below this many free places a departure shows as "limited"
+LIMITED_PLACES_THRESHOLD = 4
+# status_label of a departure taken off sale by /admin/departures/cancel;
+# seat writes never touch it again
+CANCELLED_DEPARTURE_LABEL = "ANNULÉ"
+
+def seats_for_booking(booking_type: str, passengers: int) -> int:
+    return CATAMARAN_CAPACITY if booking_type == CruiseType.PRIVATE.value else passengers
+
+def find_availability(cruise: Cruise, date_range: str) -> Optional[CruiseAvailability]:
+    return next((a for a in cruise.availabilities if a.date_range == date_range), None)
+
+def active_holds_expr(exclude_hold_id: Optional[str] = None) -> dict:
+    """Holds on the current departure ($$a) that have not expired yet"""
+    condition = {"$gt": ["$$h.expires_at", "$$NOW"]}
+    if exclude_hold_id:
+        condition = {"$and": [condition, {"$ne": ["$$h.id", exclude_hold_id]}]}
+    return {"$filter": {"input": {"$ifNull": ["$$a.holds", []]}, "as": "h", "cond": condition}}
+
+def free_places_expr() -> dict:
+    """remaining_places minus the seats held by unexpired holds, for $$a"""
+    held = {"$sum": {"$map": {"input": active_holds_expr(), "as": "h", "in": "$$h.seats"}}}
+    return {"$subtract": [{"$ifNull": ["$$a.remaining_places", CATAMARAN_CAPACITY]}, held]}
+
+def departure_match_expr(date_range: str, condition: dict) -> dict:
+    """$expr true when the departure `date_range` satisfies `condition` (over $$a)"""
+    return {"$anyElementTrue": [{"$map": {
+        "input": "$availabilities",
+        "as": "a",
+        "in": {"$and": [{"$eq": ["$$a.date_range", date_range]}, condition]}
+    }}]}
+
+def adjust_places_pipeline(
+    date_range: str,
+    delta: int = 0,
+    add_hold: Optional[dict] = None,
+    remove_hold_id: Optional[str] = None
+) -> list:
+    """Update pipeline for one departure: add delta to remaining_places,
+    recompute status and status_label, add or drop a hold, and prune
+    expired holds, all in the same write"""
+    remaining = {"$max": [0, {"$min": [CATAMARAN_CAPACITY, {"$add": [{"$ifNull": ["$$a.remaining_places", CATAMARAN_CAPACITY]}, delta]}]}]}
+    holds = active_holds_expr(remove_hold_id)
+    if add_hold:
+        holds = {"$concatArrays": [holds, [{"$literal": add_hold}]]}
+    adjusted = {"$let": {
+        "vars": {"left": remaining},
+        "in": {"$mergeObjects": ["$$a", {
+            "remaining_places": "$$left",
+            "status": {"$switch": {
+                "branches": [
+                    {"case": {"$lte": ["$$left", 0]}, "then": AvailabilityStatus.FULL.value},
+                    {"case": {"$lte": ["$$left", LIMITED_PLACES_THRESHOLD]}, "then": AvailabilityStatus.LIMITED.value}
+                ],
+                "default": AvailabilityStatus.AVAILABLE.value
+            }},
+            "status_label": {"$switch": {
+                "branches": [
+                    {"case": {"$lte": ["$$left", 0]}, "then": "COMPLET"},
+                    {"case": {"$eq": ["$$left", 1]}, "then": "Reste 1 place"}
+                ],
+                "default": {"$concat": ["Reste ", {"$toString": "$$left"}, " places"]}
+            }},
+            "holds": holds
+        }]}
+    }}
+    update = {
+        "availabilities": {"$map": {
+            "input": "$availabilities",
+            "as": "a",
+            "in": {"$cond": [
+                {"$and": [
+                    {"$eq": ["$$a.date_range", date_range]},
+                    {"$ne": ["$$a.status_label", CANCELLED_DEPARTURE_LABEL]}
+                ]},
+                adjusted,
+                "$$a"
+            ]}
+        }}
+    }
+    if delta:
+        update["updated_at"] = "$$NOW"
+    return [{"$set": update}]
+
+# Per-departure fields owned by the seat writes above; catalog edits keep
+# the stored values for departures that already exist
+INVENTORY_FIELDS = ("remaining_places", "status", "status_label", "holds")
+
+def catalog_update_pipeline(update_data: dict) -> list:
+    """Update pipeline for a catalog edit. A new availabilities list is merged
+    with the stored inventory of each matching departure in the same write,
+    so holds and seats taken concurrently are not overwritten."""
+    update = {k: {"$literal": v} for k, v in update_data.items()}
+    if "availabilities" in update_data:
+        stored = {"$arrayElemAt": [{"$filter": {
+            "input": {"$ifNull": ["$availabilities", []]},
+            "as": "a",
+            "cond": {"$eq": ["$$a.date_range", "$$n.date_range"]}
+        }}, 0]}
+        update["availabilities"] = {"$map": {
+            "input": {"$literal": update_data["availabilities"]},
+            "as": "n",
+            "in": {"$let": {
+                "vars": {"old": stored},
+                "in": {"$mergeObjects": ["$$n", {field: f"$$old.{field}" for field in INVENTORY_FIELDS}]}
+            }}
+        }}
+    return [{"$set": update}]
+
+async def reserve_seats(cruise_id: str, date_range: str, seats: int) -> bool:
+    """Take seats on a departure; False if fewer than `seats` are free.
+    The availability check and the decrement are one conditional write."""
+    if seats < 1:
+        return False
+    result = await db.cruises.update_one(
+        {
+            "id": cruise_id,
+            "$expr": departure_match_expr(date_range, {"$gte": [free_places_expr(), seats]})
+        },
+        adjust_places_pipeline(date_range, -seats)
+    )
+    if result.modified_count == 0:
+        return False
+    await touch_catalog(cruise_id)
+    return True
+
+async def release_seats(cruise_id: str, date_range: str, seats: int):
+    """Give seats back after a failed payment or a refund"""
+    result = await db.cruises.update_one(
+        {"id": cruise_id, "availabilities.date_range": date_range},
+        adjust_places_pipeline(date_range, seats)
+    )
+    if result.modified_count:
+        await touch_catalog(cruise_id)
+
+# ============= SEAT HOLDS =============
+
+# How long checkout may keep seats before they go back on sale
+SEAT_HOLD_MINUTES = int(os.environ.get('SEAT_HOLD_MINUTES', '10'))
+
+class SeatHoldCreate(BaseModel):
+    cruise_id: str
+    selected_date: str
+    booking_type: str = "cabin"
+    passengers: int = Field(2, ge=1, le=CATAMARAN_CAPACITY)
+
+class SeatHold(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    cruise_id: str
+    selected_date: str
+    booking_type: str
+    passengers: int
+    seats: int
+    expires_at: datetime
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+# A hold lives in two places: an entry in the departure's `holds` array,
+# which the conditional writes above use for exact seat accounting, and a
+# db.seat_holds document for lookup by id. Expired entries are ignored by
+# every seat check and pruned by the next write to that departure; the
+# seat_holds TTL index removes the lookup documents. No sweeper is needed.
+
+async def create_seat_hold(hold_data: SeatHoldCreate) -> Optional[SeatHold]:
+    """Hold seats for SEAT_HOLD_MINUTES; None if not enough are free"""
+    seats = seats_for_booking(hold_data.booking_type, hold_data.passengers)
+    if seats < 1:
+        return None
+    hold = SeatHold(
+        **hold_data.dict(),
+        seats=seats,
+        expires_at=datetime.utcnow() + timedelta(minutes=SEAT_HOLD_MINUTES)
+    )
+    result = await db.cruises.update_one(
+        {
+            "id": hold.cruise_id,
+            "$expr": departure_match_expr(hold.selected_date, {"$gte": [free_places_expr(), seats]})
+        },
+        adjust_places_pipeline(
+            hold.selected_date,
+            add_hold={"id": hold.id, "seats": seats, "expires_at": hold.expires_at}
+        )
+    )
+    if result.modified_count == 0:
+        return None
+    await db.seat_holds.insert_one(hold.dict())
+    return hold
+
+async def consume_seat_hold(hold_id: str, cruise_id: str, date_range: str,
+                            booking_type: str, passengers: int) -> Optional[int]:
+    """Turn an unexpired hold into sold seats; returns the seat count, None if
+    the hold is unknown, expired, or not for this departure and party"""
+    hold = await db.seat_holds.find_one({
+        "id": hold_id,
+        "cruise_id": cruise_id,
+        "selected_date": date_range,
+        "booking_type": booking_type,
+        "passengers": passengers
+    })
+    if not hold:
+        return None
+    result = await db.cruises.update_one(
+        {
+            "id": cruise_id,
+            "$expr": departure_match_expr(date_range, {"$and": [
+                {"$ne": ["$$a.status_label", CANCELLED_DEPARTURE_LABEL]},
+                {"$in": [hold_id, {"$map": {"input": active_holds_expr(), "as": "h", "in": "$$h.id"}}]}
+            ]})
+        },
+        adjust_places_pipeline(date_range, -hold["seats"], remove_hold_id=hold_id)
+    )
+    if result.modified_count == 0:
+        return None
+    await db.seat_holds.delete_one({"id": hold_id})
+    await touch_catalog(cruise_id)
+    return hold["seats"]
+
+async def cancel_seat_hold(hold_id: str) -> bool:
+    hold = await db.seat_holds.find_one_and_delete({"id": hold_id})
+    if not hold:
+        return False
+    await db.cruises.update_one(
+        {"id": hold["cruise_id"], "availabilities.date_range": hold["selected_date"]},
+        adjust_places_pipeline(hold["selected_date"], remove_hold_id=hold_id)
+    )
+    return True
+
+@api_router.post("/holds", response_model=SeatHold)
+async def create_hold(hold_data: SeatHoldCreate):
+    """Hold seats on a departure while the customer pays"""
+    cruise = await catalog_cache.get(hold_data.cruise_id)
+    if not cruise:
+        raise HTTPException(status_code=404, detail="Cruise not found")
+    if not find_availability(cruise, hold_data.selected_date):
+        raise HTTPException(status_code=400, detail="Unknown departure date")
+    hold = await create_seat_hold(hold_data)
+    if not hold:
+        raise HTTPException(status_code=409, detail="Plus assez de places disponibles pour ce départ")
+    return hold
+
+@api_router.get("/holds/{hold_id}", response_model=SeatHold)
+async def get_hold(hold_id: str):
+    hold = await db.seat_holds.find_one({"id": hold_id, "expires_at": {"$gt": datetime.utcnow()}})
+    if not hold:
+        raise HTTPException(status_code=404, detail="Hold not found or expired")
+    return SeatHold(**hold)
+
+@api_router.delete("/holds/{hold_id}")
+async def delete_hold(hold_id: str):
+    """Release a hold early, e.g. when the customer leaves checkout"""
+    if not await cancel_seat_hold(hold_id):
+        raise HTTPException(status_code=404, detail="Hold not found")
+    return {"message": "Hold released"}
+
+# ============= QUOTES =============
+
+# Club cards: discount percentage per discounted passenger, and the price of a
+# card bought with the booking (cards sold on the web page are already owned).
+CLUB_CARDS = {
+    "none": {"discount": 0, "price": 0},
+    "12months": {"discount": 10, "price": 90},
+    "24months": {"discount": 15, "price": 150},
+    "36months": {"discount": 20, "price": 140},
+    "decouverte": {"discount": 5, "price": 0},
+    "passion": {"discount": 10, "price": 0},
+    "prestige": {"discount": 15, "price": 0},
+}
+
+# Quotes memoized per worker and catalog snapshot, least recently used first out
+QUOTE_MEMO_SIZE = 1024
+
+class QuoteRequest(BaseModel):
+    cruise_id: str
+    selected_date: Optional[str] = None
+    booking_type: str = "cabin"
+    passengers: int = 2
+    club_card: str = "none"
+    club_card_quantity: int = 0
+
+class Quote(BaseModel):
+    cruise_id: str
+    selected_date: Optional[str] = None
+    booking_type: str
+    passengers: int
+    price_per_person: float
+    base_price: float
+    discount: float
+    club_card_total: float
+    total: float
+    amount: int  # Amount in cents, as sent to Square
+    currency: str = "EUR"
+
+def compute_quote(cruise: Cruise, quote_request: QuoteRequest) -> Quote:
+    """Price a booking from the cached catalog; raises 400 for invalid bookings"""
+    booking_type = quote_request.booking_type
+    if booking_type not in (CruiseType.CABIN.value, CruiseType.PRIVATE.value):
+        raise HTTPException(status_code=400, detail="booking_type must be 'cabin' or 'private'")
+    if not cruise_type_matches(cruise.cruise_type, CruiseType(booking_type)):
+        raise HTTPException(status_code=400, detail=f"This cruise cannot be booked as {booking_type}")
+    if not 1 <= quote_request.passengers <= CATAMARAN_CAPACITY:
+        raise HTTPException(status_code=400, detail=f"passengers must be between 1 and {CATAMARAN_CAPACITY}")
+    card = CLUB_CARDS.get(quote_request.club_card)
+    if card is None:
+        raise HTTPException(status_code=400, detail="Unknown club card")
+    # One card per discounted passenger, for cabin and private bookings alike
+    if not 0 <= quote_request.club_card_quantity <= quote_request.passengers:
+        raise HTTPException(status_code=400, detail="club_card_quantity must be between 0 and passengers")
+    
+    price_per_person = cruise.pricing.cabin_price
+    if quote_request.selected_date:
+        availability = find_availability(cruise, quote_request.selected_date)
+        if availability:
+            price_per_person = availability.price
+        elif cruise.availabilities:
+            raise HTTPException(status_code=400, detail="Unknown departure date")
+    
+    if booking_type == CruiseType.PRIVATE.value:
+        if price_per_person:
+            base_price = price_per_person * CATAMARAN_CAPACITY
+        else:
+            base_price = cruise.pricing.private_price
+    else:
+        base_price = price_per_person * quote_request.passengers if price_per_person else None
+    if not base_price:
+        raise HTTPException(status_code=400, detail="No price available for this booking")
+    
+    per_person = price_per_person or base_price / CATAMARAN_CAPACITY
+    # Round half up to the euro, like the booking screens
+    discount = float(int(per_person * quote_request.club_card_quantity * card["discount"] / 100 + 0.5))
+    club_card_total = float(card["price"] * quote_request.club_card_quantity)
+    total = base_price - discount + club_card_total
+    return Quote(
+        cruise_id=cruise.id,
+        selected_date=quote_request.selected_date,
+        booking_type=booking_type,
+        passengers=quote_request.passengers,
+        price_per_person=per_person,
+        base_price=base_price,
+        discount=discount,
+        club_card_total=club_card_total,
+        total=total,
+        amount=int(round(total * 100)),
+        currency=cruise.pricing.currency
+    )
+
+@api_router.post("/quotes", response_model=Quote)
+async def create_quote(quote_request: QuoteRequest):
+    """Price a booking; the same quote is enforced by /payments/create"""
+    return await catalog_cache.quote(quote_request)
+
+# ============= PAYMENT OUTBOX =============
+
+# create_payment only validates, takes seats and writes a PENDING record (the
+# outbox entry). A pool of asyncio workers charges it through Square and moves
+# it to COMPLETED or FAILED. Records are claimed with a lease, so a worker
+# process that dies mid-charge leaves its record to be picked up again by the
+# recovery loop of any worker; the Square idempotency key makes that retry safe.
+PAYMENT_WORKERS = int(os.environ.get('PAYMENT_WORKERS', '4'))
+PAYMENT_MAX_ATTEMPTS = int(os.environ.get('PAYMENT_MAX_ATTEMPTS', '5'))
+PAYMENT_LEASE_SECONDS = 60
+PAYMENT_RECOVERY_INTERVAL = 30
+
+class PaymentPipeline:
+    """Charges PENDING payment records in the background"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.waiters: Dict[str, asyncio.Event] = {}
+
+    def start(self):
+        for _ in range(self.workers):
+            spawn(self._worker())
+        spawn(self._recovery_loop())
+
+    def enqueue(self, payment_id: str):
+        self.queue.put_nowait(payment_id)
+
+    async def wait(self, payment_id: str, timeout: float):
+        """Sleep until this worker finishes the payment, or `timeout` elapses"""
+        event = self.waiters.setdefault(payment_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _notify(self, payment_id: str):
+        event = self.waiters.pop(payment_id, None)
+        if event:
+            event.set()
+
+    async def _worker(self):
+        while True:
+            payment_id = await self.queue.get()
+            try:
+                await self.process(payment_id)
+            except Exception as e:
+                logger.error(f"Payment pipeline error for {payment_id}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    async def _recovery_loop(self):
+        while True:
+            await asyncio.sleep(PAYMENT_RECOVERY_INTERVAL)
+            try:
+                now = datetime.utcnow()
+                due = await db.payments.find(
+                    {"status": PaymentStatus.PENDING.value, "next_attempt_at": {"$lte": now}, "locked_until": {"$lt": now}},
+                    {"id": 1}
+                ).to_list(100)
+                for payment in due:
+                    self.enqueue(payment["id"])
+            except Exception as e:
+                logger.warning(f"Payment recovery failed: {str(e)}")
+
+    async def _enqueue_later(self, payment_id: str, delay: float):
+        await asyncio.sleep(delay)
+        self.enqueue(payment_id)
+
+    async def claim(self, payment_id: str) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await db.payments.find_one_and_update(
+            {"id": payment_id, "status": PaymentStatus.PENDING.value, "locked_until": {"$lt": now}},
+            {
+                "$set": {"locked_until": now + timedelta(seconds=PAYMENT_LEASE_SECONDS)},
+                "$inc": {"attempts": 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def process(self, payment_id: str):
+        payment = await self.claim(payment_id)
+        if not payment:
+            return
+        if payment.get("selected_date") and await departure_cancelled(payment["cruise_id"], payment["selected_date"]):
+            # Never charge for a departure cancelled while the payment waited
+            await self.fail(payment, "Départ annulé")
+            return
+        try:
+            result = await square_gateway.create_payment(
+                source_id=payment["source_id"],
+                idempotency_key=payment["idempotency_key"],
+                amount_money={"amount": payment["amount"], "currency": payment["currency"]},
+                location_id=square_location_id,
+                note=f"Croisière: {payment['cruise_name']} - {payment['booking_type']} - {payment['passengers']} passagers",
+                buyer_email_address=payment["customer_email"],
+                # Must be identical on every attempt for Square to dedupe
+                reference_id=payment["id"]
+            )
+        except CircuitOpen as e:
+            # Square was not called, so this does not use up an attempt
+            await self.retry_later(payment, str(e), delay=square_gateway.breaker.retry_after, count_attempt=False)
+            return
+        except ApiError as e:
+            if not is_retryable(e):
+                # Declined or invalid: retrying cannot succeed
+                await self.fail(payment, f"Paiement refusé: {e.body}")
+            else:
+                await self.retry_later(payment, str(e))
+            return
+        except Exception as e:
+            await self.retry_later(payment, str(e))
+            return
+        
+        if result.payment:
+            await self.complete(payment, result.payment)
+        else:
+            await self.fail(payment, "Payment failed - no payment object returned")
+
+    async def complete(self, payment: dict, square_payment):
+        await db.payments.update_one(
+            {"id": payment["id"]},
+            {
+                "$set": {
+                    "status": PaymentStatus.COMPLETED.value,
+                    "square_payment_id": square_payment.id,
+                    "receipt_url": square_payment.receipt_url,
+                    "error_message": None,
+                    "updated_at": datetime.utcnow()
+                },
+                "$unset": {"source_id": ""}
+            }
+        )
+        await record_booking(payment)
+        await resume_departure_refunds(payment)
+        self._notify(payment["id"])
+
+    async def fail(self, payment: dict, error_message: str):
+        logger.error(f"Payment {payment['id']} failed: {error_message}")
+        await db.payments.update_one(
+            {"id": payment["id"]},
+            {
+                "$set": {
+                    "status": PaymentStatus.FAILED.value,
+                    "error_message": error_message,
+                    "updated_at": datetime.utcnow()
+                },
+                "$unset": {"source_id": ""}
+            }
+        )
+        if payment.get("seats"):
+            await release_seats(payment["cruise_id"], payment["selected_date"], payment["seats"])
+        await resume_departure_refunds(payment)
+        self._notify(payment["id"])
+
+    async def retry_later(self, payment: dict, error_message: str, delay: Optional[float] = None, count_attempt: bool = True):
+        if count_attempt and payment["attempts"] >= PAYMENT_MAX_ATTEMPTS:
+            await self.fail(payment, f"Service de paiement indisponible: {error_message}")
+            return
+        if delay is None:
+            delay = 2 ** payment["attempts"]
+        delay = max(delay, 1)
+        next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        logger.warning(f"Payment {payment['id']} attempt {payment['attempts']} failed, retrying in {delay:.0f}s: {error_message}")
+        await db.payments.update_one(
+            {"id": payment["id"]},
+            {
+                "$set": {
+                    "error_message": error_message,
+                    "next_attempt_at": next_attempt_at,
+                    "locked_until": next_attempt_at,
+                    "updated_at": datetime.utcnow()
+                },
+                "$inc": {"attempts": 0 if count_attempt else -1}
+            }
+        )
+        spawn(self._enqueue_later(payment["id"], delay))
+
+payment_pipeline = PaymentPipeline(PAYMENT_WORKERS)
+
 # ============= SQUARE PAYMENT ENDPOINTS =============
 
 @api_router.get("/payments/config")
@@ -1220,115 +2995,264 @@ async def get_payment_config():
         "environment": os.environ.get('SQUARE_ENVIRONMENT', 'sandbox').strip()
     }
 
-@api_router.post("/payments/create")
-async def create_payment(payment_request: CreatePaymentRequest):
-    """Process a payment using Square Payments API"""
+# ============= PAYMENT IDEMPOTENCY =============
+
+# Replayed results are kept this long; the TTL index removes older keys
+IDEMPOTENCY_KEY_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_HOURS', '24'))
+
+def payment_fingerprint(payment_request: CreatePaymentRequest) -> str:
+    # The card nonce is single-use and re-tokenized on every attempt, so it
+    # is not part of what makes two requests "the same payment"
+    payload = payment_request.dict(exclude={"source_id"})
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+async def replay_idempotent_payment(idempotency_key: str, fingerprint: str):
+    """Answer a request whose key was already used"""
+    stored = await db.payment_idempotency.find_one({"key": idempotency_key})
+    if not stored:
+        # The earlier attempt failed with a server error and released the key
+        raise HTTPException(status_code=409, detail="Paiement en cours de traitement, veuillez réessayer")
+    if stored["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key already used for a different payment")
+    if stored.get("status_code") is None:
+        raise HTTPException(status_code=409, detail="Paiement en cours de traitement, veuillez réessayer")
+    return JSONResponse(
+        status_code=stored["status_code"],
+        content=stored["body"],
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+@api_router.post("/payments/create", status_code=202)
+async def create_payment(
+    payment_request: CreatePaymentRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Process a payment; retries carrying the same Idempotency-Key get the
+    stored result back without contacting Square again"""
+    if not idempotency_key:
+        return await process_payment(payment_request, str(uuid.uuid4()))
+    if len(idempotency_key) > 45:
+        # Square rejects longer idempotency keys
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be at most 45 characters")
+    
+    fingerprint = payment_fingerprint(payment_request)
     try:
-        sq_client = get_square_client()
-        
-        # Create idempotency key to prevent duplicate charges
-        idempotency_key = str(uuid.uuid4())
-        
-        # Call Square Payments API with new SDK syntax
-        result = sq_client.payments.create(
-            source_id=payment_request.source_id,
-            idempotency_key=idempotency_key,
-            amount_money={
-                "amount": payment_request.amount,
-                "currency": payment_request.currency
-            },
-            location_id=square_location_id,
-            note=f"Croisière: {payment_request.cruise_name} - {payment_request.booking_type} - {payment_request.passengers} passagers",
-            buyer_email_address=payment_request.customer_email,
-            reference_id=f"cruise-{payment_request.cruise_id}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-        )
-        
-        if result.payment:
-            payment = result.payment
-            
-            # Save payment record to database
-            payment_record = {
-                "id": str(uuid.uuid4()),
-                "square_payment_id": payment.id,
-                "amount": payment_request.amount,
-                "currency": payment_request.currency,
-                "status": PaymentStatus.COMPLETED.value,
-                "cruise_id": payment_request.cruise_id,
-                "cruise_name": payment_request.cruise_name,
-                "customer_email": payment_request.customer_email,
-                "customer_name": payment_request.customer_name,
-                "passengers": payment_request.passengers,
-                "selected_date": payment_request.selected_date,
-                "booking_type": payment_request.booking_type,
-                "note": payment_request.note,
-                "receipt_url": payment.receipt_url,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            
-            await db.payments.insert_one(payment_record)
-            
-            return {
-                "success": True,
-                "payment_id": payment.id,
-                "receipt_url": payment.receipt_url,
-                "status": payment.status,
-                "amount": payment_request.amount,
-                "currency": payment_request.currency,
-                "message": "Paiement réussi ! Votre réservation est confirmée."
-            }
+        await db.payment_idempotency.insert_one({
+            "key": idempotency_key,
+            "fingerprint": fingerprint,
+            "status_code": None,
+            "body": None,
+            "created_at": datetime.utcnow(),
+            "expires_at": datetime.utcnow() + timedelta(hours=IDEMPOTENCY_KEY_HOURS)
+        })
+    except DuplicateKeyError:
+        return await replay_idempotent_payment(idempotency_key, fingerprint)
+    
+    try:
+        result = await process_payment(payment_request, idempotency_key)
+    except HTTPException as e:
+        if e.status_code >= 500:
+            # Outcome unknown: free the key so the client can retry. Square
+            # dedupes the charge itself because it receives the same key.
+            await db.payment_idempotency.delete_one({"key": idempotency_key})
         else:
-            # Payment failed
-            error_message = "Payment failed - no payment object returned"
-            
-            # Save failed payment record
-            payment_record = {
-                "id": str(uuid.uuid4()),
-                "amount": payment_request.amount,
-                "currency": payment_request.currency,
-                "status": PaymentStatus.FAILED.value,
-                "cruise_id": payment_request.cruise_id,
-                "cruise_name": payment_request.cruise_name,
-                "customer_email": payment_request.customer_email,
-                "customer_name": payment_request.customer_name,
-                "passengers": payment_request.passengers,
-                "error_message": error_message,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            
-            await db.payments.insert_one(payment_record)
-            
-            raise HTTPException(status_code=400, detail=error_message)
-            
-    except HTTPException:
+            await db.payment_idempotency.update_one(
+                {"key": idempotency_key},
+                {"$set": {"status_code": e.status_code, "body": {"detail": e.detail}}}
+            )
+        raise
+    except Exception:
+        await db.payment_idempotency.delete_one({"key": idempotency_key})
         raise
+    
+    await db.payment_idempotency.update_one(
+        {"key": idempotency_key},
+        {"$set": {"status_code": 202, "body": jsonable_encoder(result)}}
+    )
+    return result
+
+async def process_payment(payment_request: CreatePaymentRequest, idempotency_key: str):
+    """Validate the booking, take the seats and queue the charge"""
+    # The amount is checked against the server-side quote before anything else
+    quote = await catalog_cache.quote(QuoteRequest(**payment_request.dict()))
+    if payment_request.amount != quote.amount:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Montant invalide: {quote.amount} centimes attendus pour cette réservation"
+        )
+    
+    # No point taking seats for a charge that cannot be attempted
+    if square_gateway.breaker.state == "open":
+        raise HTTPException(status_code=503, detail=GATEWAY_UNAVAILABLE)
+    
+    # Seats are taken before the charge and given back if it does not go through
+    cruise = await catalog_cache.get(payment_request.cruise_id)
+    seats = 0
+    if cruise.availabilities:
+        if not payment_request.selected_date or not find_availability(cruise, payment_request.selected_date):
+            raise HTTPException(status_code=400, detail="Unknown departure date")
+        if payment_request.hold_id:
+            seats = await consume_seat_hold(
+                payment_request.hold_id, cruise.id, payment_request.selected_date,
+                payment_request.booking_type, payment_request.passengers
+            )
+            if seats is None:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Votre réservation temporaire a expiré ou ne correspond pas à ce paiement"
+                )
+        else:
+            seats = seats_for_booking(payment_request.booking_type, payment_request.passengers)
+            if not await reserve_seats(cruise.id, payment_request.selected_date, seats):
+                raise HTTPException(status_code=409, detail="Plus assez de places disponibles pour ce départ")
+    
+    # Durable record first: whatever happens next, the charge can be traced
+    record = PaymentRecord(
+        amount=payment_request.amount,
+        currency=payment_request.currency,
+        cruise_id=payment_request.cruise_id,
+        cruise_name=payment_request.cruise_name,
+        customer_email=payment_request.customer_email,
+        customer_name=payment_request.customer_name,
+        passengers=payment_request.passengers,
+        selected_date=payment_request.selected_date,
+        booking_type=payment_request.booking_type,
+        note=payment_request.note,
+        seats=seats,
+        idempotency_key=idempotency_key
+    )
+    try:
+        await db.payments.insert_one({**record.dict(), "source_id": payment_request.source_id})
     except Exception as e:
         logger.error(f"Payment error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Erreur de paiement: {str(e)}")
+        if seats:
+            await release_seats(cruise.id, payment_request.selected_date, seats)
+        raise HTTPException(status_code=500, detail="Erreur de paiement, veuillez réessayer")
+    
+    payment_pipeline.enqueue(record.id)
+    return {
+        "success": True,
+        "payment_id": record.id,
+        "status": PaymentStatus.PENDING.value,
+        "amount": payment_request.amount,
+        "currency": payment_request.currency,
+        "status_url": f"/api/payments/{record.id}",
+        "events_url": f"/api/payments/{record.id}/events",
+        "message": "Paiement en cours de traitement"
+    }
 
 @api_router.get("/payments/{payment_id}")
 async def get_payment(payment_id: str):
     """Get payment details by ID"""
-    payment = await db.payments.find_one({"square_payment_id": payment_id})
-    if not payment:
-        payment = await db.payments.find_one({"id": payment_id})
-    
+    # Either id, in one indexed lookup
+    payment = await db.payments.find_one(
+        {"$or": [{"square_payment_id": payment_id}, {"id": payment_id}]},
+        PAYMENT_PUBLIC_PROJECTION
+    )
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
     
     payment["_id"] = str(payment["_id"])
     return payment
 
+# How long a status subscription stays open before the client should poll
+PAYMENT_EVENTS_TIMEOUT = 120
+
+@api_router.get("/payments/{payment_id}/events")
+async def payment_events(payment_id: str):
+    """Server-sent events with the payment status until it is final"""
+    async def stream():
+        deadline = asyncio.get_running_loop().time() + PAYMENT_EVENTS_TIMEOUT
+        last_status = None
+        while True:
+            payment = await db.payments.find_one(
+                {"id": payment_id},
+                {"_id": 0, "id": 1, "status": 1, "square_payment_id": 1, "receipt_url": 1, "error_message": 1}
+            )
+            if not payment:
+                yield f"event: error\ndata: {json.dumps({'detail': 'Payment not found'})}\n\n"
+                return
+            if payment["status"] != last_status:
+                last_status = payment["status"]
+                yield f"data: {json.dumps(payment)}\n\n"
+            if last_status != PaymentStatus.PENDING.value or asyncio.get_running_loop().time() > deadline:
+                return
+            # Wakes immediately when this worker finishes the charge
+            await payment_pipeline.wait(payment_id, timeout=1.0)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @api_router.get("/payments/customer/{email}")
-async def get_customer_payments(email: str):
-    """Get all payments for a customer by email"""
-    payments_list = await db.payments.find({"customer_email": email}).sort("created_at", -1).to_list(length=100)
+async def get_customer_payments(
+    email: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
+    """Get all payments for a customer by email, newest first"""
+    payments_list, next_cursor = await fetch_page(
+        db.payments, {"customer_email": email}, limit, cursor, projection=PAYMENT_PUBLIC_PROJECTION
+    )
+    set_next_cursor(response, next_cursor)
     
     for payment in payments_list:
         payment["_id"] = str(payment["_id"])
     
-    return {"payments": payments_list, "count": len(payments_list)}
+    return {"payments": payments_list, "count": len(payments_list), "next_cursor": next_cursor}
+
+async def refund_payment_record(payment: dict, amount: Optional[int], idempotency_key: str,
+                                reason: str = "Customer requested refund", release: bool = True):
+    """Refund a COMPLETED payment through Square and record it.
+
+    Returns (refund, refunded amount). A full refund gives the seats back
+    unless `release` is False (the departure itself is cancelled)."""
+    refund_amount = amount if amount else payment.get("amount")
+    
+    # Call Square Refunds API off the event loop
+    result = await square_gateway.refund_payment(
+        idempotency_key=idempotency_key,
+        payment_id=payment["square_payment_id"],
+        amount_money={
+            "amount": refund_amount,
+            "currency": payment.get("currency", "EUR")
+        },
+        reason=reason
+    )
+    if not result.refund:
+        raise HTTPException(status_code=400, detail="Refund failed - no refund object returned")
+    refund = result.refund
+    
+    # Update payment record
+    await db.payments.update_one(
+        {"id": payment["id"]},
+        {"$set": {
+            "status": PaymentStatus.REFUNDED.value,
+            "refund_id": refund.id,
+            "refunded_amount": refund_amount,
+            "updated_at": datetime.utcnow()
+        }}
+    )
+    
+    await record_refund(payment, refund.id, refund_amount)
+    
+    # A full refund frees the seats the booking held
+    if release and refund_amount >= payment.get("amount", 0):
+        await release_refunded_seats(payment)
+    
+    return refund, refund_amount
+
+async def release_refunded_seats(payment: dict):
+    """Give a fully refunded booking's seats back. The API and the refund
+    webhook both get here for the same refund, so the payment is marked
+    first and the seats are released once."""
+    if not payment.get("seats") or not payment.get("selected_date"):
+        return
+    claimed = await db.payments.update_one(
+        {"id": payment["id"], "seats_released": {"$ne": True}},
+        {"$set": {"seats_released": True}}
+    )
+    if claimed.modified_count:
+        await release_seats(payment["cruise_id"], payment["selected_date"], payment["seats"])
 
 @api_router.post("/payments/{payment_id}/refund")
 async def refund_payment(payment_id: str, amount: Optional[int] = None):
@@ -1342,60 +3266,1262 @@ async def refund_payment(payment_id: str, amount: Optional[int] = None):
         if payment.get("status") != PaymentStatus.COMPLETED.value:
             raise HTTPException(status_code=400, detail="Only completed payments can be refunded")
         
-        sq_client = get_square_client()
-        
-        refund_amount = amount if amount else payment.get("amount")
-        
-        # Call Square Refunds API with new SDK syntax
-        result = sq_client.refunds.refund_payment(
-            idempotency_key=str(uuid.uuid4()),
-            payment_id=payment_id,
-            amount_money={
-                "amount": refund_amount,
-                "currency": payment.get("currency", "EUR")
-            },
-            reason="Customer requested refund"
-        )
-        
-        if result.refund:
-            refund = result.refund
+        refund, refund_amount = await refund_payment_record(payment, amount, str(uuid.uuid4()))
+        return {
+            "success": True,
+            "refund_id": refund.id,
+            "status": refund.status,
+            "amount": refund_amount,
+            "message": "Remboursement effectué avec succès"
+        }
             
-            # Update payment record
+    except HTTPException:
+        raise
+    except CircuitOpen:
+        raise HTTPException(status_code=503, detail=GATEWAY_UNAVAILABLE)
+    except GatewayTimeout as e:
+        logger.error(f"Refund timeout: {str(e)}")
+        raise HTTPException(status_code=504, detail="Le service de paiement ne répond pas, veuillez réessayer")
+    except ApiError as e:
+        logger.error(f"Refund error: {str(e)}")
+        if not is_retryable(e):
+            raise HTTPException(status_code=400, detail="Remboursement refusé par le service de paiement")
+        raise HTTPException(status_code=503, detail=GATEWAY_UNAVAILABLE)
+    except Exception as e:
+        logger.error(f"Refund error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Erreur de remboursement, veuillez réessayer")
+
+# ============= DEPARTURE CANCELLATION =============
+
+# Refunding a cancelled departure is a persisted job: one item per payment in
+# db.refund_job_items, so a run interrupted by a restart or a Square outage
+# resumes where it stopped. Each item's id doubles as the Square idempotency
+# key, so an item retried after a crash mid-call is not refunded twice.
+REFUND_CONCURRENCY = int(os.environ.get('REFUND_CONCURRENCY', '4'))
+REFUND_JOB_LEASE_SECONDS = 120
+REFUND_JOB_RECOVERY_INTERVAL = 60
+
+class RefundJobStatus(str, Enum):
+    RUNNING = "running"
+    INTERRUPTED = "interrupted"  # Items left to retry, see /resume
+    COMPLETED = "completed"
+    COMPLETED_WITH_ERRORS = "completed_with_errors"
+
+class DepartureCancellation(BaseModel):
+    cruise_id: str
+    selected_date: str
+    reason: str = "Départ annulé"
+
+class RefundJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    cruise_id: str
+    selected_date: str
+    reason: str
+    status: RefundJobStatus = RefundJobStatus.RUNNING
+    total: int = 0
+    refunded: int = 0
+    failed: int = 0
+    skipped: int = 0
+    refunded_amount: int = 0
+    locked_until: datetime = Field(default_factory=lambda: datetime(1970, 1, 1))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+async def close_departure(cruise_id: str, date_range: str):
+    """Take a departure off sale for good; open holds can no longer be paid"""
+    await db.cruises.update_one(
+        {"id": cruise_id, "availabilities.date_range": date_range},
+        {"$set": {
+            "availabilities.$.status": AvailabilityStatus.FULL.value,
+            "availabilities.$.remaining_places": 0,
+            "availabilities.$.status_label": CANCELLED_DEPARTURE_LABEL,
+            "availabilities.$.holds": [],
+            "updated_at": datetime.utcnow()
+        }}
+    )
+    await db.seat_holds.delete_many({"cruise_id": cruise_id, "selected_date": date_range})
+    await invalidate_catalog()
+
+async def departure_cancelled(cruise_id: str, date_range: str) -> bool:
+    cruise = await db.cruises.find_one(
+        {"id": cruise_id, "availabilities": {"$elemMatch": {
+            "date_range": date_range, "status_label": CANCELLED_DEPARTURE_LABEL
+        }}},
+        {"_id": 1}
+    )
+    return cruise is not None
+
+async def resume_departure_refunds(payment: dict):
+    """Run the refund job of the payment's departure, if it was cancelled,
+    now that the payment is settled"""
+    if not payment.get("selected_date"):
+        return
+    job = await db.refund_jobs.find_one(
+        {"cruise_id": payment["cruise_id"], "selected_date": payment["selected_date"]},
+        {"id": 1}
+    )
+    if job:
+        spawn(run_refund_job(job["id"]))
+
+async def refund_job_item(job: dict, item: dict):
+    """Refund one booking of the job and persist the outcome"""
+    outcome = {"updated_at": datetime.utcnow(), "waiting": False}
+    counter = None
+    payment = await db.payments.find_one({"id": item["payment_id"]})
+    if payment and payment.get("status") == PaymentStatus.PENDING.value:
+        # Still in the outbox: it fails before charging, or is refunded by a
+        # later run once it settles
+        await db.refund_job_items.update_one(
+            {"id": item["id"]}, {"$set": {"waiting": True, "updated_at": datetime.utcnow()}}
+        )
+        return
+    if not payment or payment.get("status") != PaymentStatus.COMPLETED.value:
+        # Refunded by hand in the meantime, or failed without being charged
+        outcome["status"] = "skipped"
+        counter = "skipped"
+    else:
+        try:
+            refund, refund_amount = await refund_payment_record(
+                payment, None, item["id"], reason=job["reason"], release=False
+            )
+            outcome.update({"status": "refunded", "refund_id": refund.id, "error": None})
+            counter = "refunded"
+        except (CircuitOpen, GatewayTimeout) as e:
+            outcome["error"] = str(e)
+        except ApiError as e:
+            outcome["error"] = str(e)
+            if not is_retryable(e):
+                outcome["status"] = "failed"
+                counter = "failed"
+        except Exception as e:
+            outcome["error"] = str(e)
+    
+    await db.refund_job_items.update_one({"id": item["id"]}, {"$set": outcome, "$inc": {"attempts": 1}})
+    if counter:
+        increments = {counter: 1}
+        if counter == "refunded":
+            increments["refunded_amount"] = refund_amount
+        # Progress also renews the lease of the job
+        await db.refund_jobs.update_one({"id": job["id"]}, {
+            "$inc": increments,
+            "$set": {
+                "updated_at": datetime.utcnow(),
+                "locked_until": datetime.utcnow() + timedelta(seconds=REFUND_JOB_LEASE_SECONDS)
+            }
+        })
+
+async def run_refund_job(job_id: str):
+    now = datetime.utcnow()
+    job = await db.refund_jobs.find_one_and_update(
+        {
+            "id": job_id,
+            "status": {"$in": [RefundJobStatus.RUNNING.value, RefundJobStatus.INTERRUPTED.value]},
+            "locked_until": {"$lt": now}
+        },
+        {"$set": {
+            "status": RefundJobStatus.RUNNING.value,
+            "locked_until": now + timedelta(seconds=REFUND_JOB_LEASE_SECONDS),
+            "updated_at": now
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job:
+        return  # Finished, or another worker owns it
+    
+    items = await db.refund_job_items.find({"job_id": job_id, "status": "pending"}).to_list(None)
+    semaphore = asyncio.Semaphore(REFUND_CONCURRENCY)
+    
+    async def process(item):
+        async with semaphore:
+            await refund_job_item(job, item)
+    
+    try:
+        await asyncio.gather(*(process(item) for item in items))
+    finally:
+        pending = await db.refund_job_items.count_documents({"job_id": job_id, "status": "pending"})
+        waiting = await db.refund_job_items.count_documents({"job_id": job_id, "status": "pending", "waiting": True})
+        failed = await db.refund_job_items.count_documents({"job_id": job_id, "status": "failed"})
+        if pending and pending == waiting:
+            # Only payments still in the outbox are left: settling one runs
+            # the job again, and the recovery loop picks it up otherwise
+            status = RefundJobStatus.RUNNING
+        elif pending:
+            status = RefundJobStatus.INTERRUPTED
+        elif failed:
+            status = RefundJobStatus.COMPLETED_WITH_ERRORS
+        else:
+            status = RefundJobStatus.COMPLETED
+        await db.refund_jobs.update_one({"id": job_id}, {"$set": {
+            "status": status.value,
+            "locked_until": datetime(1970, 1, 1),
+            "updated_at": datetime.utcnow()
+        }})
+        logger.info(f"Refund job {job_id} {status.value}, {pending} pending, {failed} failed")
+
+async def refund_job_recovery_loop():
+    """Pick up running jobs whose worker died (lease expired)"""
+    while True:
+        await asyncio.sleep(REFUND_JOB_RECOVERY_INTERVAL)
+        try:
+            stale = await db.refund_jobs.find(
+                {"status": RefundJobStatus.RUNNING.value, "locked_until": {"$lt": datetime.utcnow()}},
+                {"id": 1}
+            ).to_list(100)
+            for job in stale:
+                spawn(run_refund_job(job["id"]))
+        except Exception as e:
+            logger.warning(f"Refund job recovery failed: {str(e)}")
+
+@api_router.post("/admin/departures/cancel")
+async def cancel_departure(cancellation: DepartureCancellation):
+    """Take a departure off sale and refund every booking on it, including
+    payments still in the outbox once they settle"""
+    cruise = await catalog_cache.get(cancellation.cruise_id)
+    if not cruise:
+        raise HTTPException(status_code=404, detail="Cruise not found")
+    if not find_availability(cruise, cancellation.selected_date):
+        raise HTTPException(status_code=404, detail="Unknown departure date")
+    
+    existing = await db.refund_jobs.find_one(
+        {"cruise_id": cancellation.cruise_id, "selected_date": cancellation.selected_date},
+        {"_id": 0}
+    )
+    if existing:
+        return existing
+    
+    await close_departure(cancellation.cruise_id, cancellation.selected_date)
+    
+    # Uses the (cruise_id, selected_date, status) index. The departure is
+    # closed first, so no payment can start on it after this query.
+    payments = await db.payments.find(
+        {
+            "cruise_id": cancellation.cruise_id,
+            "selected_date": cancellation.selected_date,
+            "status": {"$in": [PaymentStatus.COMPLETED.value, PaymentStatus.PENDING.value]}
+        },
+        {"_id": 0, "id": 1, "square_payment_id": 1, "amount": 1, "customer_name": 1, "customer_email": 1}
+    ).to_list(None)
+    
+    job = RefundJob(**cancellation.dict(), total=len(payments))
+    if payments:
+        await db.refund_job_items.insert_many([
+            {
+                "id": str(uuid.uuid4()),
+                "job_id": job.id,
+                "payment_id": payment["id"],
+                "square_payment_id": payment.get("square_payment_id"),
+                "customer_name": payment["customer_name"],
+                "customer_email": payment["customer_email"],
+                "amount": payment["amount"],
+                "status": "pending",
+                "refund_id": None,
+                "error": None,
+                "waiting": False,
+                "attempts": 0,
+                "updated_at": datetime.utcnow()
+            }
+            for payment in payments
+        ])
+    else:
+        job.status = RefundJobStatus.COMPLETED
+    try:
+        await db.refund_jobs.insert_one(job.dict())
+    except DuplicateKeyError:
+        # Another admin cancelled the same departure at the same moment
+        await db.refund_job_items.delete_many({"job_id": job.id})
+        return await db.refund_jobs.find_one(
+            {"cruise_id": cancellation.cruise_id, "selected_date": cancellation.selected_date},
+            {"_id": 0}
+        )
+    
+    if payments:
+        spawn(run_refund_job(job.id))
+    return job
+
+@api_router.get("/admin/refund-jobs")
+async def get_refund_jobs(
+    response: Response,
+    limit: int = Query(20, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
+    """Latest departure cancellations, newest first"""
+    jobs, next_cursor = await fetch_page(db.refund_jobs, {}, limit, cursor, projection={"_id": 0})
+    set_next_cursor(response, next_cursor)
+    return jobs
+
+@api_router.get("/admin/refund-jobs/{job_id}")
+async def get_refund_job(job_id: str):
+    """Progress of a refund job with the state of every booking"""
+    job = await db.refund_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Refund job not found")
+    job["items"] = await db.refund_job_items.find({"job_id": job_id}, {"_id": 0}).to_list(None)
+    return job
+
+@api_router.post("/admin/refund-jobs/{job_id}/resume")
+async def resume_refund_job(job_id: str):
+    """Retry the bookings an interrupted job left pending"""
+    job = await db.refund_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Refund job not found")
+    if job["status"] != RefundJobStatus.INTERRUPTED.value:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    spawn(run_refund_job(job_id))
+    return {"success": True, "message": "Remboursements relancés"}
+
+# ============= ANALYTICS =============
+
+# One rollup document per (day, cruise, departure, booking type), incremented
+# as payments complete and refunds go through. Dashboards read these, so their
+# cost grows with the number of days, not of payments. Each payment records
+# the events already claimed (rollup_events) so none is counted twice, and
+# logs each one with the day and counts it added (rollups): a rebuild sums
+# that log, so it puts every count back on the day it was first made.
+# A claim stays in rollups_pending until its increment is written; if the
+# worker dies in between, the next rebuild counts it from the log.
+#
+# A rebuild holds a lease in db.locks that pauses live rollups: events are
+# left unclaimed meanwhile and counted once the rebuild is done.
+
+ANALYTICS_MAX_DAYS = 731
+ANALYTICS_REBUILD_LOCK_ID = "analytics_rebuild"
+ANALYTICS_REBUILD_LOCK_SECONDS = 300
+# Lets rollups that started before the pause finish their increment
+ROLLUP_DRAIN_SECONDS = 1
+
+def rollup_key(payment: dict, day: date) -> dict:
+    return {
+        "day": day.isoformat(),
+        "cruise_id": payment["cruise_id"],
+        "selected_date": payment.get("selected_date"),
+        "booking_type": payment.get("booking_type", "cabin")
+    }
+
+async def rollups_paused() -> bool:
+    lock = await db.locks.find_one(
+        {"_id": ANALYTICS_REBUILD_LOCK_ID, "expires_at": {"$gt": datetime.utcnow()}}, {"_id": 1}
+    )
+    return lock is not None
+
+async def record_rollup(payment: dict, event: str, increments: dict):
+    if await rollups_paused():
+        return  # Left unclaimed; rebuild_analytics counts it when it is done
+    day = datetime.utcnow().date()
+    claimed = await db.payments.update_one(
+        {"id": payment["id"], "rollup_events": {"$ne": event}},
+        {"$push": {
+            "rollup_events": event,
+            "rollups": {"event": event, "day": day.isoformat(), "counts": increments},
+            "rollups_pending": event
+        }}
+    )
+    if not claimed.modified_count:
+        return
+    await db.daily_rollups.update_one(
+        rollup_key(payment, day),
+        {
+            "$inc": increments,
+            "$set": {"cruise_name": payment.get("cruise_name"), "updated_at": datetime.utcnow()}
+        },
+        upsert=True
+    )
+    await db.payments.update_one({"id": payment["id"]}, {"$pull": {"rollups_pending": event}})
+
+async def record_booking(payment: dict):
+    await record_rollup(payment, "completed", {
+        "bookings": 1,
+        "passengers": payment.get("passengers", 0),
+        "seats": payment.get("seats", 0),
+        "revenue": payment["amount"]
+    })
+
+async def record_refund(payment: dict, refund_id: str, refund_amount: int):
+    full = refund_amount >= payment.get("amount", 0)
+    await record_rollup(payment, f"refund:{refund_id}", {
+        "refunds": 1,
+        "refunded_amount": refund_amount,
+        "seats_refunded": payment.get("seats", 0) if full else 0
+    })
+
+ROLLUP_COUNTERS = ["bookings", "passengers", "seats", "revenue", "refunds", "refunded_amount", "seats_refunded"]
+
+def add_counters(total: dict, rollup: dict):
+    for counter in ROLLUP_COUNTERS:
+        total[counter] = total.get(counter, 0) + rollup.get(counter, 0)
+    total["net_revenue"] = total.get("revenue", 0) - total.get("refunded_amount", 0)
+    return total
+
+@api_router.get("/admin/analytics")
+async def get_analytics(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cruise_id: Optional[str] = None
+):
+    """Revenue, refunds and bookings over a period (amounts in cents), and
+    current occupancy of every departure"""
+    date_to = date_to or datetime.utcnow().date()
+    date_from = date_from or date_to - timedelta(days=30)
+    if date_to < date_from or (date_to - date_from).days >= ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Période invalide (maximum {ANALYTICS_MAX_DAYS} jours)")
+    
+    query = {"day": {"$gte": date_from.isoformat(), "$lte": date_to.isoformat()}}
+    if cruise_id:
+        query["cruise_id"] = cruise_id
+    rollups = await db.daily_rollups.find(query, {"_id": 0}).to_list(None)
+    
+    totals = add_counters({}, {})
+    by_day: Dict[str, dict] = {}
+    by_cruise: Dict[str, dict] = {}
+    by_departure: Dict[tuple, dict] = {}
+    by_booking_type: Dict[str, dict] = {}
+    for rollup in rollups:
+        add_counters(totals, rollup)
+        add_counters(by_day.setdefault(rollup["day"], {"day": rollup["day"]}), rollup)
+        add_counters(by_cruise.setdefault(rollup["cruise_id"], {
+            "cruise_id": rollup["cruise_id"], "cruise_name": rollup.get("cruise_name")
+        }), rollup)
+        add_counters(by_departure.setdefault((rollup["cruise_id"], rollup["selected_date"]), {
+            "cruise_id": rollup["cruise_id"], "selected_date": rollup["selected_date"]
+        }), rollup)
+        add_counters(by_booking_type.setdefault(rollup["booking_type"], {"booking_type": rollup["booking_type"]}), rollup)
+    
+    # Occupancy is the live seat count of the catalog, which also reflects
+    # bookings made outside the app
+    occupancy = []
+    for cruise in await catalog_cache.get_all(active_only=False):
+        if cruise_id and cruise.id != cruise_id:
+            continue
+        for availability in cruise.availabilities or []:
+            if availability.remaining_places is None:
+                continue  # Seats not tracked for this departure
+            if availability.status_label == CANCELLED_DEPARTURE_LABEL:
+                continue  # Closed with no seats left, but nobody aboard
+            booked = CATAMARAN_CAPACITY - max(0, min(CATAMARAN_CAPACITY, availability.remaining_places))
+            occupancy.append({
+                "cruise_id": cruise.id,
+                "cruise_name": cruise.name_fr,
+                "selected_date": availability.date_range,
+                "capacity": CATAMARAN_CAPACITY,
+                "booked": booked,
+                "occupancy_rate": round(booked / CATAMARAN_CAPACITY, 3)
+            })
+    
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "totals": totals,
+        "by_day": sorted(by_day.values(), key=lambda row: row["day"]),
+        "by_cruise": list(by_cruise.values()),
+        "by_departure": list(by_departure.values()),
+        "by_booking_type": list(by_booking_type.values()),
+        "occupancy": occupancy
+    }
+
+@api_router.post("/admin/analytics/rebuild")
+async def rebuild_analytics():
+    """Recompute every rollup from db.payments (backfill or repair)"""
+    owner = str(uuid.uuid4())
+    if not await acquire_lock(ANALYTICS_REBUILD_LOCK_ID, owner, ANALYTICS_REBUILD_LOCK_SECONDS):
+        raise HTTPException(status_code=409, detail="A rebuild is already running")
+    try:
+        await asyncio.sleep(ROLLUP_DRAIN_SECONDS)
+        rollups = await rebuild_rollups()
+    finally:
+        await release_lock(ANALYTICS_REBUILD_LOCK_ID, owner)
+    caught_up = await record_missed_rollups()
+    return {"success": True, "rollups": rollups, "caught_up": caught_up}
+
+def logged_events_expr():
+    return {"$map": {"input": {"$ifNull": ["$rollups", []]}, "as": "r", "in": "$$r.event"}}
+
+def log_rollup_expr(event, day_field: str, counts: dict) -> dict:
+    """Append `event` to the claims and to the rollup log of a payment"""
+    return {"$set": {
+        "rollup_events": {"$setUnion": [{"$ifNull": ["$rollup_events", []]}, [event]]},
+        "rollups": {"$concatArrays": [{"$ifNull": ["$rollups", []]}, [{
+            "event": event,
+            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": day_field}},
+            "counts": counts
+        }]]}
+    }}
+
+async def rebuild_rollups() -> int:
+    """Rewrite the rollups from the log kept on each payment, after logging
+    the settled events counted before the log existed (dated by the payment).
+    Live rollups are paused by the caller."""
+    await db.payments.update_many(
+        {
+            "status": {"$in": [PaymentStatus.COMPLETED.value, PaymentStatus.REFUNDED.value]},
+            "$expr": {"$not": [{"$in": ["completed", logged_events_expr()]}]}
+        },
+        [log_rollup_expr("completed", "$created_at", {
+            "bookings": 1,
+            "passengers": "$passengers",
+            "seats": {"$ifNull": ["$seats", 0]},
+            "revenue": "$amount"
+        })]
+    )
+    await db.payments.update_many(
+        {
+            "status": PaymentStatus.REFUNDED.value,
+            "refund_id": {"$type": "string"},
+            "$expr": {"$not": [{"$in": [{"$concat": ["refund:", "$refund_id"]}, logged_events_expr()]}]}
+        },
+        [log_rollup_expr({"$concat": ["refund:", "$refund_id"]}, "$updated_at", {
+            "refunds": 1,
+            "refunded_amount": "$refunded_amount",
+            "seats_refunded": {"$cond": [
+                {"$gte": ["$refunded_amount", "$amount"]}, {"$ifNull": ["$seats", 0]}, 0
+            ]}
+        })]
+    )
+    
+    rows = await db.payments.aggregate([
+        {"$match": {"rollups": {"$exists": True}}},
+        {"$unwind": "$rollups"},
+        {"$group": {
+            "_id": {
+                "day": "$rollups.day",
+                "cruise_id": "$cruise_id",
+                "selected_date": "$selected_date",
+                "booking_type": "$booking_type"
+            },
+            "cruise_name": {"$first": "$cruise_name"},
+            **{
+                counter: {"$sum": {"$ifNull": [f"$rollups.counts.{counter}", 0]}}
+                for counter in ROLLUP_COUNTERS
+            }
+        }}
+    ]).to_list(None)
+    
+    await db.daily_rollups.delete_many({})
+    operations = []
+    for row in rows:
+        key = row.pop("_id")
+        cruise_name = row.pop("cruise_name")
+        operations.append(UpdateOne(
+            key,
+            {"$inc": row, "$set": {"cruise_name": cruise_name, "updated_at": datetime.utcnow()}},
+            upsert=True
+        ))
+    if operations:
+        await db.daily_rollups.bulk_write(operations, ordered=False)
+    # Claims whose increment never landed are counted above
+    await db.payments.update_many(
+        {"rollups_pending": {"$exists": True, "$ne": []}}, {"$set": {"rollups_pending": []}}
+    )
+    return len(operations)
+
+async def record_missed_rollups() -> int:
+    """Count the events of payments settled while rollups were paused"""
+    missed = await db.payments.find({"$or": [
+        {
+            "status": {"$in": [PaymentStatus.COMPLETED.value, PaymentStatus.REFUNDED.value]},
+            "rollup_events": {"$ne": "completed"}
+        },
+        {
+            "status": PaymentStatus.REFUNDED.value,
+            "refund_id": {"$type": "string"},
+            "$expr": {"$not": [{"$in": [
+                {"$concat": ["refund:", "$refund_id"]}, {"$ifNull": ["$rollup_events", []]}
+            ]}]}
+        }
+    ]}).to_list(None)
+    for payment in missed:
+        await record_booking(payment)
+        if payment["status"] == PaymentStatus.REFUNDED.value and isinstance(payment.get("refund_id"), str):
+            await record_refund(payment, payment["refund_id"], payment.get("refunded_amount", 0))
+    return len(missed)
+
+# ============= PAYMENT RECONCILIATION =============
+
+# The season is split into day windows listed from Square in parallel; Square
+# pages within a window are sequential because they follow a cursor.
+RECONCILE_CONCURRENCY = int(os.environ.get('RECONCILE_CONCURRENCY', '4'))
+RECONCILE_MAX_DAYS = 366
+RECONCILE_JOIN_CHUNK = 500
+
+# Our statuses that agree with each Square payment status
+EXPECTED_PAYMENT_STATUSES = {
+    "APPROVED": {PaymentStatus.PENDING.value},
+    "PENDING": {PaymentStatus.PENDING.value},
+    "COMPLETED": {PaymentStatus.COMPLETED.value, PaymentStatus.REFUNDED.value},
+    "CANCELED": {PaymentStatus.FAILED.value},
+    "FAILED": {PaymentStatus.FAILED.value},
+}
+
+class ReconciliationReport(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    begin: date
+    end: date
+    square_count: int = 0
+    record_count: int = 0
+    missing_in_db: List[dict] = []  # Charged by Square, unknown to us
+    missing_in_square: List[dict] = []  # Completed for us, absent from Square
+    amount_mismatches: List[dict] = []
+    stale_statuses: List[dict] = []
+    duration_ms: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+def day_windows(begin: date, end: date) -> List[tuple]:
+    """[begin, end] as one (start, stop) datetime pair per day"""
+    windows = []
+    day = begin
+    while day <= end:
+        start = datetime.combine(day, datetime.min.time())
+        windows.append((start, start + timedelta(days=1)))
+        day += timedelta(days=1)
+    return windows
+
+def expected_status(square_payment: dict) -> set:
+    if square_payment["status"] == "COMPLETED" and square_payment["refunded"] >= square_payment["amount"] > 0:
+        return {PaymentStatus.REFUNDED.value}
+    return EXPECTED_PAYMENT_STATUSES.get(square_payment["status"], set())
+
+def diff_payments(square_payments: List[dict], records: Dict[str, dict], report: ReconciliationReport):
+    """Compare Square's payments with our records keyed by square_payment_id"""
+    for square_payment in square_payments:
+        record = records.pop(square_payment["id"], None)
+        if record is None:
+            if square_payment["status"] in ("COMPLETED", "APPROVED"):
+                report.missing_in_db.append(square_payment)
+            continue
+        if record["amount"] != square_payment["amount"]:
+            report.amount_mismatches.append({
+                "payment_id": record["id"],
+                "square_payment_id": square_payment["id"],
+                "amount": record["amount"],
+                "square_amount": square_payment["amount"]
+            })
+        if record["status"] not in expected_status(square_payment):
+            report.stale_statuses.append({
+                "payment_id": record["id"],
+                "square_payment_id": square_payment["id"],
+                "status": record["status"],
+                "square_status": square_payment["status"],
+                "square_refunded": square_payment["refunded"]
+            })
+
+async def reconcile_payments(begin: date, end: date) -> ReconciliationReport:
+    started = asyncio.get_running_loop().time()
+    report = ReconciliationReport(begin=begin, end=end)
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    
+    async def list_window(start: datetime, stop: datetime) -> List[dict]:
+        async with semaphore:
+            return await square_gateway.list_payments(
+                begin_time=start.isoformat() + "Z",
+                end_time=stop.isoformat() + "Z",
+                location_id=square_location_id,
+                limit=100
+            )
+    
+    windows = await asyncio.gather(*(list_window(start, stop) for start, stop in day_windows(begin, end)))
+    square_payments = [payment for window in windows for payment in window]
+    report.square_count = len(square_payments)
+    
+    # Join on square_payment_id (indexed) in a few $in queries run together
+    projection = {"_id": 0, "id": 1, "square_payment_id": 1, "amount": 1, "status": 1, "created_at": 1}
+    square_ids = [payment["id"] for payment in square_payments]
+    chunks = [square_ids[i:i + RECONCILE_JOIN_CHUNK] for i in range(0, len(square_ids), RECONCILE_JOIN_CHUNK)]
+    
+    # Records Square should know about: charged in the same period
+    period = {
+        "created_at": {"$gte": datetime.combine(begin, datetime.min.time()), "$lt": datetime.combine(end + timedelta(days=1), datetime.min.time())},
+        "square_payment_id": {"$ne": None}
+    }
+    results = await asyncio.gather(
+        db.payments.find(period, projection).to_list(None),
+        *(db.payments.find({"square_payment_id": {"$in": chunk}}, projection).to_list(None) for chunk in chunks)
+    )
+    records = {record["square_payment_id"]: record for result in results for record in result}
+    report.record_count = len(records)
+    
+    diff_payments(square_payments, records, report)
+    report.missing_in_square = list(records.values())
+    report.duration_ms = int((asyncio.get_running_loop().time() - started) * 1000)
+    return report
+
+@api_router.post("/admin/payments/reconcile")
+async def reconcile(begin: date, end: date):
+    """Diff db.payments against Square for [begin, end] and keep the report"""
+    if end < begin or (end - begin).days >= RECONCILE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Période invalide (maximum {RECONCILE_MAX_DAYS} jours)")
+    try:
+        report = await reconcile_payments(begin, end)
+    except CircuitOpen:
+        raise HTTPException(status_code=503, detail=GATEWAY_UNAVAILABLE)
+    except GatewayTimeout:
+        raise HTTPException(status_code=504, detail="Le service de paiement ne répond pas, veuillez réessayer")
+    await db.reconciliation_reports.insert_one({**report.dict(), "begin": begin.isoformat(), "end": end.isoformat()})
+    return report
+
+@api_router.get("/admin/payments/gateway")
+async def get_gateway_status():
+    """Circuit breaker state and Square call counters for this worker"""
+    return square_gateway.status()
+
+@api_router.get("/admin/payments/reconciliations")
+async def get_reconciliations(
+    response: Response,
+    limit: int = Query(20, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
+    """Latest reconciliation reports, newest first"""
+    reports, next_cursor = await fetch_page(db.reconciliation_reports, {}, limit, cursor, projection={"_id": 0})
+    set_next_cursor(response, next_cursor)
+    return reports
+
+# ============= SQUARE WEBHOOKS =============
+
+# Square signs each notification with HMAC-SHA256 over the subscription URL
+# followed by the raw body. The URL must be the one registered with Square,
+# which behind a proxy is not necessarily the one the app sees.
+SQUARE_WEBHOOK_SIGNATURE_KEY = os.environ.get('SQUARE_WEBHOOK_SIGNATURE_KEY', '').strip()
+SQUARE_WEBHOOK_URL = os.environ.get('SQUARE_WEBHOOK_URL', '').strip()
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '100'))
+WEBHOOK_BATCH_WINDOW = float(os.environ.get('WEBHOOK_BATCH_WINDOW', '0.05'))
+
+# Square payment statuses that settle one of our PENDING records. Failures are
+# left to the outbox worker, which also gives the seats back.
+SQUARE_PAYMENT_STATUSES = {
+    "COMPLETED": PaymentStatus.COMPLETED.value,
+}
+# Square statuses that never change again: an older event delivered after
+# one of these must not overwrite it
+FINAL_SQUARE_PAYMENT_STATUSES = ["COMPLETED", "CANCELED", "FAILED"]
+FINAL_SQUARE_REFUND_STATUSES = ["COMPLETED", "REJECTED", "FAILED"]
+
+def square_signature(signature_key: str, notification_url: str, body: bytes) -> str:
+    digest = hmac.new(signature_key.encode(), notification_url.encode() + body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+def verify_square_signature(signature: Optional[str], notification_url: str, body: bytes) -> bool:
+    if not SQUARE_WEBHOOK_SIGNATURE_KEY or not signature:
+        return False
+    expected = square_signature(SQUARE_WEBHOOK_SIGNATURE_KEY, notification_url, body)
+    return hmac.compare_digest(expected, signature)
+
+def webhook_operations(event: dict) -> List[UpdateOne]:
+    """Translate one Square event into updates on db.payments.
+
+    Every update skips records that already carry the event id, so redelivered
+    events are no-ops.
+    """
+    event_id = event.get("event_id")
+    event_type = event.get("type", "")
+    data = (event.get("data") or {}).get("object") or {}
+    not_seen = {"square_event_ids": {"$ne": event_id}}
+    seen = {"$addToSet": {"square_event_ids": event_id}}
+    now = datetime.utcnow()
+    
+    if event_type.startswith("payment."):
+        payment = data.get("payment") or {}
+        if not payment.get("id"):
+            return []
+        status = SQUARE_PAYMENT_STATUSES.get(payment.get("status"))
+        match = {"$or": [{"square_payment_id": payment.get("id")}, {"id": payment.get("reference_id")}]}
+        operations = [UpdateOne(
+            {**match, **not_seen, "square_status": {"$nin": FINAL_SQUARE_PAYMENT_STATUSES}},
+            {"$set": {"square_status": payment.get("status"), "updated_at": now}, **seen}
+        )]
+        if status:
+            # Only a charge still in the outbox is settled from here; the
+            # worker that owns it will find it final and stop
+            operations.append(UpdateOne(
+                {**match, "status": PaymentStatus.PENDING.value},
+                {
+                    "$set": {
+                        "status": status,
+                        "square_payment_id": payment.get("id"),
+                        "receipt_url": payment.get("receipt_url"),
+                        "updated_at": now
+                    },
+                    "$unset": {"source_id": ""}
+                }
+            ))
+        return operations
+    
+    if event_type.startswith("refund."):
+        refund = data.get("refund") or {}
+        if not refund.get("payment_id"):
+            return []
+        refunded = (refund.get("amount_money") or {}).get("amount", 0)
+        operations = [UpdateOne(
+            {
+                "square_payment_id": refund.get("payment_id"),
+                f"refunds.{refund.get('id')}.status": {"$nin": FINAL_SQUARE_REFUND_STATUSES},
+                **not_seen
+            },
+            {
+                "$set": {
+                    f"refunds.{refund.get('id')}": {
+                        "status": refund.get("status"),
+                        "amount": refunded,
+                        "reason": refund.get("reason")
+                    },
+                    "updated_at": now
+                },
+                **seen
+            }
+        )]
+        # Completed refunds, from the API or the Square dashboard, are settled
+        # by settle_webhook_payments once the batch is written
+        return operations
+    
+    if event_type.startswith("dispute."):
+        dispute = data.get("dispute") or {}
+        disputed_payment = dispute.get("disputed_payment") or {}
+        if not disputed_payment.get("payment_id"):
+            return []
+        return [UpdateOne(
+            {"square_payment_id": disputed_payment.get("payment_id"), **not_seen},
+            {
+                "$set": {
+                    "dispute": {
+                        "id": dispute.get("id") or dispute.get("dispute_id"),
+                        "state": dispute.get("state"),
+                        "reason": dispute.get("reason"),
+                        "amount": (dispute.get("amount_money") or {}).get("amount")
+                    },
+                    "updated_at": now
+                },
+                **seen
+            }
+        )]
+    
+    return []
+
+class WebhookBatcher:
+    """Coalesces webhook events into one bulk_write per batch.
+
+    Each request waits for its batch to be written before Square gets its
+    200, so an event is never acknowledged and then lost.
+    """
+
+    def __init__(self, batch_size: int, window: float):
+        self.batch_size = batch_size
+        self.window = window
+        self.pending: List[tuple] = []
+        self.flush_task: Optional[asyncio.Task] = None
+
+    async def submit(self, event: dict):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((event, future))
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = spawn(self._flush_later())
+        await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        # Duplicates inside one burst are dropped before reaching MongoDB
+        operations = []
+        event_ids = set()
+        for event, _ in batch:
+            if event.get("event_id") in event_ids:
+                continue
+            event_ids.add(event.get("event_id"))
+            operations.extend(webhook_operations(event))
+        try:
+            if operations:
+                await db.payments.bulk_write(operations, ordered=False)
+                await settle_webhook_payments([event for event, _ in batch])
+        except Exception as e:
+            logger.error(f"Webhook batch of {len(batch)} events failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+def webhook_payment_keys(event: dict) -> tuple:
+    """(Square payment id, our payment id) an event is about"""
+    data = (event.get("data") or {}).get("object") or {}
+    if event.get("type", "").startswith("payment."):
+        payment = data.get("payment") or {}
+        return payment.get("id"), payment.get("reference_id")
+    if event.get("type", "").startswith("refund."):
+        return (data.get("refund") or {}).get("payment_id"), None
+    return None, None
+
+async def settle_webhook_payments(events: List[dict]):
+    """Rollups, REFUNDED status and seats for the payments a batch touched,
+    through the same idempotent steps as the API paths. It looks at the
+    stored state rather than at the events, so it also settles a refund
+    whose event came in before the payment's."""
+    square_ids, record_ids = set(), set()
+    for event in events:
+        square_id, record_id = webhook_payment_keys(event)
+        if square_id:
+            square_ids.add(square_id)
+        if record_id:
+            record_ids.add(record_id)
+    if not square_ids and not record_ids:
+        return
+    settled = [PaymentStatus.COMPLETED.value, PaymentStatus.REFUNDED.value]
+    payments = await db.payments.find({"$and": [
+        {"$or": [{"square_payment_id": {"$in": list(square_ids)}}, {"id": {"$in": list(record_ids)}}]},
+        {"status": {"$in": settled}},
+        {"$or": [{"refunds": {"$exists": True}}, {"rollup_events": {"$ne": "completed"}}]}
+    ]}).to_list(None)
+    for payment in payments:
+        # Charges settled by a payment event never reach the outbox worker
+        await record_booking(payment)
+        completed = {
+            refund_id: refund for refund_id, refund in (payment.get("refunds") or {}).items()
+            if refund.get("status") == "COMPLETED"
+        }
+        for refund_id, refund in completed.items():
+            await record_refund(payment, refund_id, refund.get("amount", 0))
+        refunded = sum(refund.get("amount", 0) for refund in completed.values())
+        if not completed or refunded < payment["amount"]:
+            continue
+        if payment["status"] == PaymentStatus.COMPLETED.value:
             await db.payments.update_one(
-                {"square_payment_id": payment_id},
+                {"id": payment["id"], "status": PaymentStatus.COMPLETED.value},
                 {"$set": {
                     "status": PaymentStatus.REFUNDED.value,
-                    "refund_id": refund.id,
-                    "refunded_amount": refund_amount,
+                    "refund_id": next(iter(completed)),
+                    "refunded_amount": refunded,
                     "updated_at": datetime.utcnow()
                 }}
             )
-            
-            return {
-                "success": True,
-                "refund_id": refund.id,
-                "status": refund.status,
-                "amount": refund_amount,
-                "message": "Remboursement effectué avec succès"
-            }
+        await release_refunded_seats(payment)
+
+webhook_batcher = WebhookBatcher(WEBHOOK_BATCH_SIZE, WEBHOOK_BATCH_WINDOW)
+
+@api_router.post("/webhooks/square")
+async def square_webhook(
+    request: Request,
+    signature: Optional[str] = Header(None, alias="x-square-hmacsha256-signature")
+):
+    """Receive payment, refund and dispute notifications from Square"""
+    body = await request.body()
+    if not verify_square_signature(signature, SQUARE_WEBHOOK_URL or str(request.url), body):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    
+    try:
+        event = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not event.get("event_id"):
+        raise HTTPException(status_code=400, detail="Missing event_id")
+    
+    try:
+        await webhook_batcher.submit(event)
+    except Exception:
+        # Square redelivers on any non-2xx response
+        raise HTTPException(status_code=503, detail="Event not stored, retry later")
+    return {"received": True}
+
+# ============= ADMIN EXPORTS =============
+
+# Whole collections streamed as NDJSON or CSV: documents are read from the
+# Motor cursor a batch at a time and written out in chunks, so memory use does
+# not depend on the size of the export.
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+# Exported fields, in CSV column order
+EXPORT_COLUMNS = {
+    "members": ["id", "username", "email", "cruises_done", "is_active", "is_banned", "created_at"],
+    "posts": ["id", "author_id", "author_name", "title", "content", "category", "likes_count", "comments", "created_at", "updated_at"],
+    "messages": ["id", "sender_id", "sender_name", "receiver_id", "receiver_name", "content", "is_from_captain", "is_read", "created_at"],
+    "payments": [
+        "id", "square_payment_id", "status", "amount", "currency", "refunded_amount", "cruise_id", "cruise_name",
+        "selected_date", "booking_type", "passengers", "seats", "customer_name", "customer_email", "receipt_url",
+        "created_at", "updated_at"
+    ],
+}
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def csv_cell(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=export_value, ensure_ascii=False)
+    return export_value(value)
+
+async def export_rows(collection: str, query: dict, export_format: ExportFormat):
+    columns = EXPORT_COLUMNS[collection]
+    cursor = db[collection].find(query, {"_id": 0, **{column: 1 for column in columns}}) \
+        .sort([("created_at", 1), ("id", 1)]).batch_size(EXPORT_BATCH_SIZE)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == ExportFormat.CSV:
+        writer.writerow(columns)
+    async for doc in cursor:
+        if export_format == ExportFormat.CSV:
+            writer.writerow([csv_cell(doc.get(column)) for column in columns])
         else:
-            raise HTTPException(status_code=400, detail="Refund failed - no refund object returned")
-            
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Refund error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Erreur de remboursement: {str(e)}")
+            buffer.write(json.dumps(doc, default=export_value, ensure_ascii=False))
+            buffer.write("\n")
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+@api_router.get("/admin/export/{collection}")
+async def admin_export(
+    collection: str,
+    format: ExportFormat = ExportFormat.NDJSON,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    customer_email: Optional[str] = None
+):
+    """Stream members, posts, messages or payments, oldest first"""
+    if collection not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail=f"Unknown collection, expected one of {', '.join(EXPORT_COLUMNS)}")
+    
+    query = {}
+    if date_from or date_to:
+        query["created_at"] = {}
+        if date_from:
+            query["created_at"]["$gte"] = datetime.combine(date_from, datetime.min.time())
+        if date_to:
+            query["created_at"]["$lt"] = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+    if customer_email:
+        if collection != "payments":
+            raise HTTPException(status_code=400, detail="customer_email only applies to payments")
+        query["customer_email"] = customer_email
+    
+    media_type = "text/csv; charset=utf-8" if format == ExportFormat.CSV else "application/x-ndjson"
+    filename = f"{collection}-{datetime.utcnow().strftime('%Y%m%d')}.{format.value}"
+    return StreamingResponse(
+        export_rows(collection, query, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# ============= INDEXES =============
+
+# Every index the code relies on, per collection, applied at startup. Unique
+# indexes mark fields the code treats as unique; TTL indexes let MongoDB
+# expire holds and idempotency keys on its own.
+INDEXES: Dict[str, List[dict]] = {
+    "cruises": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("order", 1)]},
+    ],
+    # Paged lists sort on (created_at, id): see PAGINATION
+    "members": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("email", 1)], "unique": True},
+        {"keys": [("created_at", -1), ("id", -1)]},
+        {"keys": [("is_active", 1), ("created_at", -1), ("id", -1)]},
+    ],
+    "posts": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("created_at", -1), ("id", -1)]},
+        {"keys": [("category", 1), ("created_at", -1), ("id", -1)]},
+    ],
+    "messages": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("created_at", -1), ("id", -1)]},
+        # Both directions of a conversation, already in display order
+        {"keys": [("sender_id", 1), ("receiver_id", 1), ("created_at", 1), ("id", 1)]},
+    ],
+    "conversations": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("participant_ids", 1), ("last_message_at", -1), ("id", -1)]},
+    ],
+    "payments": [
+        {"keys": [("id", 1)], "unique": True},
+        # Only charged payments have a Square id
+        {"keys": [("square_payment_id", 1)], "unique": True,
+         "partialFilterExpression": {"square_payment_id": {"$type": "string"}}},
+        {"keys": [("customer_email", 1), ("created_at", -1), ("id", -1)]},
+        # Reconciliation ranges and exports in (created_at, id) order
+        {"keys": [("created_at", 1), ("id", 1)]},
+        {"keys": [("status", 1), ("next_attempt_at", 1)]},
+        {"keys": [("cruise_id", 1), ("selected_date", 1), ("status", 1)]},
+    ],
+    "seat_holds": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "payment_idempotency": [
+        {"keys": [("key", 1)], "unique": True},
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "refund_jobs": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("cruise_id", 1), ("selected_date", 1)], "unique": True},
+        {"keys": [("created_at", -1), ("id", -1)]},
+    ],
+    "refund_job_items": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("job_id", 1), ("status", 1)]},
+    ],
+    "daily_rollups": [
+        {"keys": [("day", 1), ("cruise_id", 1), ("selected_date", 1), ("booking_type", 1)], "unique": True},
+    ],
+    "reconciliation_reports": [
+        {"keys": [("created_at", -1), ("id", -1)]},
+    ],
+}
+
+# Queries on request paths, as (collection, filter, sort). Sample values stand
+# in for real ones; only the shape matters to the planner.
+HOT_QUERIES = [
+    ("cruises", {"id": "x"}, None),
+    ("members", {"id": "x"}, None),
+    ("members", {"email": "x", "is_active": True}, None),
+    ("members", {"is_active": True}, [("created_at", -1), ("id", -1)]),
+    ("posts", {"id": "x"}, None),
+    ("posts", {"category": "general"}, [("created_at", -1), ("id", -1)]),
+    ("posts", {}, [("created_at", -1), ("id", -1)]),
+    ("messages", {"$or": [
+        {"sender_id": "a", "receiver_id": "b"},
+        {"sender_id": "b", "receiver_id": "a"}
+    ]}, [("created_at", 1), ("id", 1)]),
+    ("messages", {}, [("created_at", -1), ("id", -1)]),
+    ("conversations", {"id": "x"}, None),
+    ("conversations", {"participant_ids": "x"}, [("last_message_at", -1), ("id", -1)]),
+    ("payments", {"id": "x"}, None),
+    ("payments", {"square_payment_id": "x"}, None),
+    ("payments", {"customer_email": "x"}, [("created_at", -1), ("id", -1)]),
+    ("payments", {"cruise_id": "x", "selected_date": "x", "status": "COMPLETED"}, None),
+    ("seat_holds", {"id": "x"}, None),
+    ("payment_idempotency", {"key": "x"}, None),
+]
+
+# Set in CI to refuse to start when a hot query would scan a collection
+INDEX_CHECK_STRICT = os.environ.get('INDEX_CHECK_STRICT', '').strip().lower() in ('1', 'true', 'yes')
+
+# "Index already exists with different options": raised when a registry entry
+# changes an index created by an earlier version
+INDEX_CONFLICT_CODES = (85, 86)
+
+INDEX_LOCK_ID = "indexes"
+INDEX_LOCK_SECONDS = 300
+
+def index_options(spec: dict) -> dict:
+    return {key: value for key, value in spec.items() if key != "keys"}
+
+async def ensure_indexes() -> List[str]:
+    """Create the missing indexes and return the ones whose options changed.
+    Those are only reported: every worker runs this at startup, and dropping
+    a unique index there would leave its field unguarded while the workers
+    race each other, so POST /admin/indexes/rebuild replaces them."""
+    conflicts = []
+    for collection, specs in INDEXES.items():
+        for spec in specs:
+            try:
+                await db[collection].create_index(spec["keys"], **index_options(spec))
+            except OperationFailure as e:
+                if e.code not in INDEX_CONFLICT_CODES:
+                    logger.error(f"Index {collection}{spec['keys']} not created: {str(e)}")
+                    continue
+                conflicts.append(f"{collection} {spec['keys']}")
+                logger.error(
+                    f"Index {collection}{spec['keys']} differs from the registry: "
+                    f"rebuild it from /api/admin/indexes/rebuild"
+                )
+            except Exception as e:
+                # e.g. duplicates left in existing data under a unique index:
+                # keep serving, but make it visible
+                logger.error(f"Index {collection}{spec['keys']} not created: {str(e)}")
+    return conflicts
+
+def plan_stages(plan: dict):
+    if "queryPlan" in plan:
+        # MongoDB 7+ wraps the classic plan next to the slot-based one
+        plan = plan["queryPlan"]
+    yield plan.get("stage")
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            yield from plan_stages(child)
+
+async def explain_query(collection: str, query: dict, sort: Optional[list]) -> List[str]:
+    command = {"find": collection, "filter": query}
+    if sort:
+        command["sort"] = dict(sort)
+    explained = await db.command("explain", command, verbosity="queryPlanner")
+    return list(plan_stages(explained["queryPlanner"]["winningPlan"]))
+
+async def check_query_plans() -> List[str]:
+    """Hot queries whose winning plan scans a whole collection"""
+    problems = []
+    for collection, query, sort in HOT_QUERIES:
+        stages = await explain_query(collection, query, sort)
+        if "COLLSCAN" in stages:
+            problems.append(f"{collection} {json.dumps(query)}")
+            logger.error(f"COLLSCAN for hot query on {collection}: {json.dumps(query)}")
+    return problems
+
+@api_router.get("/admin/indexes/check")
+async def get_index_check():
+    """Winning plan of every hot query; ok is false if any scans a collection"""
+    plans = []
+    for collection, query, sort in HOT_QUERIES:
+        stages = await explain_query(collection, query, sort)
+        plans.append({"collection": collection, "filter": query, "sort": sort, "stages": stages, "collscan": "COLLSCAN" in stages})
+    return {"ok": not any(plan["collscan"] for plan in plans), "queries": plans}
+
+@api_router.post("/admin/indexes/rebuild")
+async def rebuild_indexes():
+    """Drop and recreate the indexes whose options differ from the registry.
+    Uniqueness is not enforced between the drop and the create, so run it
+    when bookings are quiet."""
+    owner = str(uuid.uuid4())
+    if not await acquire_lock(INDEX_LOCK_ID, owner, INDEX_LOCK_SECONDS):
+        raise HTTPException(status_code=409, detail="An index rebuild is already running")
+    rebuilt = []
+    try:
+        for collection, specs in INDEXES.items():
+            for spec in specs:
+                try:
+                    await db[collection].create_index(spec["keys"], **index_options(spec))
+                except OperationFailure as e:
+                    if e.code not in INDEX_CONFLICT_CODES:
+                        raise
+                    await db[collection].drop_index(spec["keys"])
+                    await db[collection].create_index(spec["keys"], **index_options(spec))
+                    rebuilt.append(f"{collection} {spec['keys']}")
+                    logger.info(f"Index {collection}{spec['keys']} rebuilt")
+    finally:
+        await release_lock(INDEX_LOCK_ID, owner)
+    return {"rebuilt": rebuilt}
 
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.middleware("http")
+async def count_db_round_trips(request: Request, call_next):
+    counter = [0]
+    db_round_trips.set(counter)
+    response = await call_next(request)
+    response.headers["X-DB-Round-Trips"] = str(counter[0])
+    return response
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets browser clients read the cursor of the next page
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -1405,6 +4531,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes()
+    try:
+        problems = await check_query_plans()
+    except Exception as e:
+        logger.warning(f"Query plan check skipped: {str(e)}")
+        problems = []
+    if problems and INDEX_CHECK_STRICT:
+        raise RuntimeError(f"Hot queries without an index: {', '.join(problems)}")
+    await run_migrations()
+    spawn(compact_cruises_in_background())
+
+@app.on_event("startup")
+async def start_version_sync():
+    await sync_shared_versions()
+    spawn(version_sync_loop())
+    payment_pipeline.start()
+    spawn(refund_job_recovery_loop())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+    square_gateway.shutdown()